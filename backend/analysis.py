@@ -0,0 +1,143 @@
+"""
+音声・映像の簡易解析
+元動画を1回だけ低解像度の輝度と低サンプルレートの音声にデコードし、
+セグメントごとの音量・黒画面率・動き量をNumPyでまとめて計算する
+"""
+import os
+import subprocess
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import scheduler
+from video import has_audio_stream
+
+# 解析用のデコード設定（精度より速度を優先）
+ANALYSIS_WIDTH = 64
+ANALYSIS_HEIGHT = 36
+ANALYSIS_FPS = 2
+ANALYSIS_SAMPLE_RATE = 8000
+
+# 判定しきい値（環境変数で調整可）
+SILENCE_DB = float(os.getenv("ANALYSIS_SILENCE_DB", "-50"))  # これ以下の音量は無音
+BLACK_LUMA = float(os.getenv("ANALYSIS_BLACK_LUMA", "20"))  # 平均輝度がこれ未満のフレームは黒
+BLACK_RATIO = float(os.getenv("ANALYSIS_BLACK_RATIO", "0.9"))  # 黒フレームがこの割合以上なら黒画面
+MOTION_MIN = float(os.getenv("ANALYSIS_MOTION_MIN", "0.5"))  # これ未満は動きなし
+
+
+class DecodedMedia:
+    """解析用にデコードした輝度フレームと音声"""
+
+    def __init__(self, frames: np.ndarray, audio: Optional[np.ndarray]):
+        self.frames = frames  # (フレーム数, 高さ, 幅) uint8
+        self.audio = audio  # (サンプル数,) int16。音声トラックがなければNone
+
+    def frame_range(self, start_sec: float, end_sec: float) -> Tuple[int, int]:
+        return int(start_sec * ANALYSIS_FPS), min(len(self.frames), int(np.ceil(end_sec * ANALYSIS_FPS)))
+
+
+def decode(video_path: str) -> DecodedMedia:
+    """ffmpeg1回で輝度（stdout）と音声（一時ファイル）を同時にデコード"""
+    fd, audio_path = tempfile.mkstemp(suffix=".pcm")
+    os.close(fd)
+    cmd = [
+        "ffmpeg", "-v", "error",
+        "-i", video_path,
+        "-map", "0:v:0",
+        "-vf", f"fps={ANALYSIS_FPS},scale={ANALYSIS_WIDTH}:{ANALYSIS_HEIGHT},format=gray",
+        "-f", "rawvideo", "pipe:1"
+    ]
+    if has_audio_stream(video_path):
+        cmd += [
+            "-map", "0:a:0",
+            "-ac", "1", "-ar", str(ANALYSIS_SAMPLE_RATE),
+            "-f", "s16le", audio_path, "-y"
+        ]
+    try:
+        result = scheduler.run(cmd, capture_output=True, check=True)
+        frame_size = ANALYSIS_WIDTH * ANALYSIS_HEIGHT
+        raw = np.frombuffer(result.stdout, dtype=np.uint8)
+        frames = raw[:len(raw) // frame_size * frame_size].reshape(-1, ANALYSIS_HEIGHT, ANALYSIS_WIDTH)
+        audio = np.fromfile(audio_path, dtype="<i2") if os.path.getsize(audio_path) else None
+        return DecodedMedia(frames, audio)
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"Failed to decode for analysis: {e.stderr.decode(errors='ignore')[-500:]}")
+    finally:
+        os.remove(audio_path)
+
+
+def decode_cached(video_path: str, cache_path: str) -> DecodedMedia:
+    """デコード結果を .npz に保存して使い回す（再分割後の再解析でデコードし直さない）"""
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(video_path):
+        with np.load(cache_path) as cached:
+            return DecodedMedia(cached["frames"], cached["audio"] if "audio" in cached else None)
+
+    media = decode(video_path)
+    arrays = {"frames": media.frames}
+    if media.audio is not None:
+        arrays["audio"] = media.audio
+    temp_path = f"{cache_path}.{os.getpid()}.tmp.npz"
+    np.savez(temp_path, **arrays)
+    os.replace(temp_path, cache_path)
+    return media
+
+
+def _segment_starts(boundaries: List[Tuple[float, float]], rate: float, length: int) -> np.ndarray:
+    return np.array([min(int(start * rate), max(length - 1, 0)) for start, _ in boundaries])
+
+
+def _reduce_mean(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """区間ごとの平均（np.add.reduceatで一括計算）"""
+    if len(values) == 0:
+        return np.full(len(starts), np.nan)
+    sums = np.add.reduceat(values, starts)
+    counts = np.diff(np.append(starts, len(values)))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+
+def analyze(media: DecodedMedia, boundaries: List[Tuple[float, float]]) -> List[Dict]:
+    """セグメント境界 [(開始秒, 終了秒), ...] ごとのスコアを計算"""
+    if not boundaries:
+        return []
+
+    frames = media.frames
+    frame_starts = _segment_starts(boundaries, ANALYSIS_FPS, len(frames))
+    frame_means = frames.reshape(len(frames), -1).mean(axis=1) if len(frames) else np.empty(0)
+    black_ratio = _reduce_mean((frame_means < BLACK_LUMA).astype(np.float64), frame_starts)
+
+    # 動き量: 連続フレーム間の平均絶対差（先頭フレームは0）
+    if len(frames) > 1:
+        diffs = np.abs(np.diff(frames.astype(np.int16), axis=0)).reshape(len(frames) - 1, -1).mean(axis=1)
+        motion = _reduce_mean(np.concatenate([[0.0], diffs]), frame_starts)
+    else:
+        motion = np.zeros(len(boundaries))
+
+    if media.audio is not None and len(media.audio):
+        samples = media.audio.astype(np.float64)
+        audio_starts = _segment_starts(boundaries, ANALYSIS_SAMPLE_RATE, len(samples))
+        mean_square = _reduce_mean(samples * samples, audio_starts)
+        with np.errstate(divide="ignore"):
+            loudness = 20 * np.log10(np.sqrt(mean_square) / 32768.0)
+        loudness = np.maximum(loudness, -120.0)
+    else:
+        loudness = np.full(len(boundaries), np.nan)
+
+    return [
+        {
+            "loudness_db": None if np.isnan(loudness[i]) else round(float(loudness[i]), 2),
+            "black_ratio": None if np.isnan(black_ratio[i]) else round(float(black_ratio[i]), 3),
+            "motion": None if np.isnan(motion[i]) else round(float(motion[i]), 3)
+        }
+        for i in range(len(boundaries))
+    ]
+
+
+def is_dead(scores: Dict) -> bool:
+    """黒画面、または無音かつ動きなしのセグメント"""
+    if scores.get("black_ratio") is not None and scores["black_ratio"] >= BLACK_RATIO:
+        return True
+    loudness = scores.get("loudness_db")
+    silent = loudness is None or loudness <= SILENCE_DB
+    return silent and scores.get("motion") is not None and scores["motion"] < MOTION_MIN
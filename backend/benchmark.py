@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+SwipeCut ベンチマーク
+使い方: python benchmark.py <ベンチマーク名> [オプション]
+  analysis <動画> [--chunk-sec 60]  音声・映像解析のコスト（実時間比）
+  startup [--top 15] [--runs 5]      APIの起動時間（-X importtime の内訳つき）
+  segments [--count 10000]           セグメント行の一括挿入と主要クエリの実行計画
+  preview <動画> [--chunk-sec 60] [--per-segment]
+                                     早見プレビューの作成コスト（元動画1分あたり。--per-segment はセグメントごとに作る場合と比較）
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+def bench_analysis(args):
+    import analysis
+    from video import get_video_duration, segment_boundaries
+
+    duration = get_video_duration(args.video)
+    boundaries = segment_boundaries(duration, args.chunk_sec)
+
+    started = time.perf_counter()
+    media = analysis.decode(args.video)
+    decoded = time.perf_counter()
+    scores = analysis.analyze(media, boundaries)
+    finished = time.perf_counter()
+
+    elapsed = finished - started
+    print(f"media duration : {duration:.1f} s ({len(boundaries)} segments)")
+    print(f"decode         : {decoded - started:.3f} s")
+    print(f"analyze        : {(finished - decoded) * 1000:.1f} ms")
+    print(f"total          : {elapsed:.3f} s ({elapsed / duration:.4f}x realtime)")
+    print(f"flagged        : {sum(analysis.is_dead(s) for s in scores)}")
+
+
+# 別プロセスで main を読み込み、create_app() までの時間を計測する
+STARTUP_SCRIPT = """
+import time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.create_app()
+created = time.perf_counter()
+print(f"{imported - started} {created - imported}")
+"""
+
+
+def parse_importtime(stderr: str):
+    """-X importtime の出力を (自身のμs, 累積μs, 深さ, モジュール名) のリストにする"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return rows
+
+
+def bench_startup(args):
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    walls, imports, creates = [], [], []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT],
+            cwd=backend_dir, capture_output=True, text=True, check=True
+        )
+        walls.append(time.perf_counter() - started)
+        import_sec, create_sec = map(float, result.stdout.split()[-2:])
+        imports.append(import_sec)
+        creates.append(create_sec)
+
+    print(f"process total  : {statistics.median(walls) * 1000:.1f} ms (median of {args.runs})")
+    print(f"import main    : {statistics.median(imports) * 1000:.1f} ms")
+    print(f"create_app()   : {statistics.median(creates) * 1000:.1f} ms")
+
+    # 最後の実行の内訳（main から直接読み込まれたモジュールを累積時間順に）
+    rows = parse_importtime(result.stderr)
+    main_depth = next((depth for _, _, depth, name in rows if name == "main"), 0)
+    direct = [row for row in rows if row[2] == main_depth + 1]
+    print(f"\ntop {args.top} imports under main (cumulative):")
+    for self_us, cumulative_us, _, name in sorted(direct, key=lambda row: -row[1])[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+
+# 判定画面・エクスポートで毎回実行されるクエリ
+HOT_QUERIES = {
+    "next pending": "SELECT * FROM segments WHERE video_id = 1 AND decision = 0 ORDER BY \"index\" LIMIT 1",
+    "kept for export": "SELECT * FROM segments WHERE video_id = 1 AND decision = 1 ORDER BY \"index\"",
+    "decision counts": "SELECT decision, count(id) FROM segments WHERE video_id = 1 GROUP BY decision",
+    "cluster pending": "SELECT count(id) FROM segments WHERE video_id = 1 AND dup_cluster = 5 AND decision = 0",
+}
+
+
+def bench_segments(args):
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.orm import sessionmaker
+
+    from models import Base, Segment, Video
+    from tasks import insert_segments
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add(Video(id=1, filename="bench.mp4", original_path="bench.mp4"))
+    session.commit()
+
+    def rows(offset):
+        return [
+            {"video_id": 1, "index": offset + i, "path": f"segment_{offset + i}.mp4", "start_sec": i * 60.0,
+             "end_sec": (i + 1) * 60.0, "decision": ("pending", "keep", "drop")[i % 3], "size_bytes": 1000000,
+             "crc32": i, "duration_sec": 60.0, "dup_cluster": i // 4}
+            for i in range(args.count)
+        ]
+
+    started = time.perf_counter()
+    for row in rows(0):
+        session.add(Segment(**row))
+    session.commit()
+    orm_sec = time.perf_counter() - started
+
+    started = time.perf_counter()
+    insert_segments(session, rows(args.count))
+    session.commit()
+    bulk_sec = time.perf_counter() - started
+
+    print(f"ORM add x{args.count}   : {orm_sec * 1000:.1f} ms")
+    print(f"bulk insert x{args.count}: {bulk_sec * 1000:.1f} ms ({orm_sec / bulk_sec:.1f}x faster)")
+    print("\nquery plans:")
+    with engine.connect() as conn:
+        for name, sql in HOT_QUERIES.items():
+            plan = " / ".join(row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+            print(f"  {name:16}: {plan}")
+
+
+def bench_preview(args):
+    import tempfile
+
+    import preview
+    from video import get_video_duration, segment_boundaries
+
+    duration = get_video_duration(args.video)
+    ranges = segment_boundaries(duration, args.chunk_sec)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        destinations = [os.path.join(work_dir, f"preview_{i}.mp4") for i in range(len(ranges))]
+        started = time.perf_counter()
+        written = preview.render(args.video, ranges, destinations)
+        elapsed = time.perf_counter() - started
+        output_bytes = sum(os.path.getsize(d) for d, ok in zip(destinations, written) if ok)
+
+        print(f"media duration : {duration:.1f} s ({len(ranges)} segments)")
+        print(f"settings       : {preview.SPEED:g}x, {preview.HEIGHT}p, {preview.FPS} fps, crf {preview.CRF}")
+        print(f"one pass       : {elapsed:.3f} s ({elapsed / duration * 60:.2f} s per source minute, "
+              f"{duration / elapsed:.1f}x realtime)")
+        print(f"previews       : {sum(written)}/{len(ranges)}, {output_bytes / 1e6:.2f} MB "
+              f"({output_bytes / duration * 60 / 1e6:.2f} MB per source minute)")
+
+        if args.per_segment:
+            started = time.perf_counter()
+            for i, segment_range in enumerate(ranges):
+                preview.render(args.video, [segment_range], [os.path.join(work_dir, f"single_{i}.mp4")])
+            per_segment = time.perf_counter() - started
+            print(f"per segment    : {per_segment:.3f} s ({per_segment / duration * 60:.2f} s per source minute, "
+                  f"{per_segment / elapsed:.1f}x slower)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SwipeCut benchmarks")
+    subparsers = parser.add_subparsers(dest="name", required=True)
+
+    p = subparsers.add_parser("analysis", help="音声・映像解析のコスト")
+    p.add_argument("video")
+    p.add_argument("--chunk-sec", type=int, default=60)
+    p.set_defaults(func=bench_analysis)
+
+    p = subparsers.add_parser("startup", help="APIの起動時間")
+    p.add_argument("--top", type=int, default=15)
+    p.add_argument("--runs", type=int, default=5)
+    p.set_defaults(func=bench_startup)
+
+    p = subparsers.add_parser("segments", help="セグメント行の一括挿入と実行計画")
+    p.add_argument("--count", type=int, default=10000)
+    p.set_defaults(func=bench_segments)
+
+    p = subparsers.add_parser("preview", help="早見プレビューの作成コスト")
+    p.add_argument("video")
+    p.add_argument("--chunk-sec", type=int, default=60)
+    p.add_argument("--per-segment", action="store_true")
+    p.set_defaults(func=bench_preview)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
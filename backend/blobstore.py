@@ -0,0 +1,260 @@
+"""
+メディアファイルの保存先（ストレージバックエンド）
+ffmpegはローカルファイルを読み書きするので、処理は常に STORAGE_DIR 以下（storage.py のレイアウト）で行い、
+完成したファイル（元動画・セグメント・ZIP）をバックエンドに保存する。ローカルのファイルは作業用のキャッシュになる
+  local: STORAGE_DIR そのものが保存先。配信はアプリから行う
+  s3:    S3互換ストレージ（AWS S3・MinIOなど）。キーは STORAGE_DIR からの相対パス
+         マルチパートで分割しながら書き込み、配信は署名付きURLへのリダイレクトでアプリを経由しない
+STORAGE_BACKEND=s3 のときは S3_BUCKET（必須）・S3_ENDPOINT_URL・S3_REGION・S3_PREFIX・S3_URL_EXPIRES を使う
+（認証情報は AWS_ACCESS_KEY_ID などboto3の標準の設定から読む）
+"""
+import contextlib
+import os
+import shutil
+import uuid
+from typing import BinaryIO, Iterator, Optional
+
+from config import STORAGE_DIR
+
+BACKEND = os.getenv("STORAGE_BACKEND", "local")
+# マルチパートの1パートのサイズ（S3の下限は5MB）
+PART_SIZE = max(5, int(os.getenv("S3_PART_SIZE_MB", "8"))) * 1024 * 1024
+# 署名付きURLの有効期間（秒）
+URL_EXPIRES = int(os.getenv("S3_URL_EXPIRES", "3600"))
+
+COPY_BLOCK = 1024 * 1024
+
+
+@contextlib.contextmanager
+def _local_writer(path: str) -> Iterator[BinaryIO]:
+    """一時ファイルに書いてから置き換える（書きかけのファイルを読ませない）"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            yield f
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class LocalBackend:
+    """STORAGE_DIR に置いたファイルがそのまま保存先"""
+
+    name = "local"
+    remote = False
+
+    def writer(self, path: str):
+        return _local_writer(path)
+
+    def publish(self, path: str):
+        pass
+
+    def fetch(self, path: str) -> str:
+        return path
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(path)
+
+    def url(self, path: str, filename: Optional[str] = None) -> Optional[str]:
+        return None
+
+    def delete(self, path: str):
+        pass
+
+    def delete_tree(self, directory: str):
+        pass
+
+
+class MultipartUpload:
+    """書き込まれたデータをPART_SIZEごとにアップロード（全体をメモリやディスクに溜めない）
+    PART_SIZE未満で終わった小さいファイルは1回のPUTで保存する"""
+
+    def __init__(self, client, bucket: str, key: str):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.upload_id: Optional[str] = None
+        self.parts = []
+        self.buffer = bytearray()
+
+    def write(self, data: bytes):
+        self.buffer += data
+        while len(self.buffer) >= PART_SIZE:
+            self._upload_part(bytes(self.buffer[:PART_SIZE]))
+            del self.buffer[:PART_SIZE]
+
+    def _upload_part(self, body: bytes):
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key)["UploadId"]
+        number = len(self.parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=body
+        )
+        self.parts.append({"PartNumber": number, "ETag": response["ETag"]})
+
+    def complete(self):
+        if self.upload_id is None:
+            self.client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer))
+            return
+        if self.buffer:
+            self._upload_part(bytes(self.buffer))
+            self.buffer.clear()
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": self.parts}
+        )
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+
+class _TeeWriter:
+    """ローカルのキャッシュとS3へ同時に書き込む"""
+
+    def __init__(self, local: BinaryIO, upload: MultipartUpload):
+        self.local = local
+        self.upload = upload
+
+    def write(self, data: bytes) -> int:
+        self.local.write(data)
+        self.upload.write(data)
+        return len(data)
+
+
+class S3Backend:
+    """S3互換ストレージ（STORAGE_DIR はローカルの作業用キャッシュ）"""
+
+    name = "s3"
+    remote = True
+
+    def __init__(self):
+        # boto3はS3を使う場合だけ必要
+        import boto3
+        from botocore.config import Config
+
+        self.bucket = os.environ["S3_BUCKET"]
+        self.prefix = os.getenv("S3_PREFIX", "").strip("/")
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=os.getenv("S3_ENDPOINT_URL") or None,
+            region_name=os.getenv("S3_REGION") or None,
+            config=Config(signature_version="s3v4")
+        )
+
+    def key(self, path: str) -> str:
+        """ローカルパスに対応するキー（STORAGE_DIR の外はValueError）"""
+        relative = os.path.relpath(os.path.abspath(path), os.path.abspath(STORAGE_DIR))
+        if relative == "." or relative.startswith(".."):
+            raise ValueError(f"Path is outside of STORAGE_DIR: {path}")
+        return "/".join(part for part in (self.prefix, relative.replace(os.sep, "/")) if part)
+
+    @contextlib.contextmanager
+    def writer(self, path: str):
+        """ローカルに書きながら、同じ内容をマルチパートでアップロード"""
+        upload = MultipartUpload(self.client, self.bucket, self.key(path))
+        try:
+            with _local_writer(path) as local:
+                yield _TeeWriter(local, upload)
+            upload.complete()
+        except BaseException:
+            upload.abort()
+            raise
+
+    def publish(self, path: str):
+        """ローカルで作ったファイルをアップロード"""
+        upload = MultipartUpload(self.client, self.bucket, self.key(path))
+        try:
+            with open(path, "rb") as f:
+                while True:
+                    block = f.read(COPY_BLOCK)
+                    if not block:
+                        break
+                    upload.write(block)
+            upload.complete()
+        except BaseException:
+            upload.abort()
+            raise
+
+    def fetch(self, path: str) -> str:
+        """ローカルにない（別のマシンで作られた）ファイルをダウンロード"""
+        if os.path.exists(path) or not self.exists(path):
+            return path
+        with _local_writer(path) as f:
+            body = self.client.get_object(Bucket=self.bucket, Key=self.key(path))["Body"]
+            shutil.copyfileobj(body, f, COPY_BLOCK)
+        return path
+
+    def exists(self, path: str) -> bool:
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(path))
+            return True
+        except ClientError:
+            return False
+
+    def url(self, path: str, filename: Optional[str] = None) -> Optional[str]:
+        """署名付きGET URL（STORAGE_DIR の外のファイルはNone）"""
+        try:
+            params = {"Bucket": self.bucket, "Key": self.key(path)}
+        except ValueError:
+            return None
+        if filename:
+            params["ResponseContentDisposition"] = f'attachment; filename="{filename}"'
+        return self.client.generate_presigned_url("get_object", Params=params, ExpiresIn=URL_EXPIRES)
+
+    def delete(self, path: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(path))
+
+    def delete_tree(self, directory: str):
+        """ディレクトリ以下のオブジェクトをまとめて削除（1000件ずつ）"""
+        prefix = self.key(directory) + "/"
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            objects = [{"Key": item["Key"]} for item in page.get("Contents", [])]
+            if objects:
+                self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True})
+
+
+_backend = None
+
+
+def backend():
+    global _backend
+    if _backend is None:
+        _backend = S3Backend() if BACKEND == "s3" else LocalBackend()
+    return _backend
+
+
+def is_remote() -> bool:
+    """ファイルがアプリのマシンにあるとは限らない（配信はURLへのリダイレクト）"""
+    return backend().remote
+
+
+def writer(path: str):
+    return backend().writer(path)
+
+
+def publish(path: str):
+    backend().publish(path)
+
+
+def fetch(path: str) -> str:
+    return backend().fetch(path)
+
+
+def exists(path: str) -> bool:
+    return backend().exists(path)
+
+
+def url(path: str, filename: Optional[str] = None) -> Optional[str]:
+    return backend().url(path, filename)
+
+
+def delete(path: str):
+    backend().delete(path)
+
+
+def delete_tree(directory: str):
+    backend().delete_tree(directory)
@@ -0,0 +1,177 @@
+"""
+Keepセグメントを1本の動画に連結して書き出す
+コーデック・解像度が揃っているセグメントはconcat demuxerでストリームコピーし、
+揃っていないセグメントだけを基準の形式に再エンコードする（結果はキャッシュ）
+トリムのレンダリングと再エンコードはワーカーの concat ジョブで済ませ、APIはストリームコピーの連結だけを行う
+出力はfragmented MP4でstdoutから流すため、連結の完了を待たずにダウンロードが始まる
+"""
+import logging
+import os
+import subprocess
+import tempfile
+from collections import Counter
+from typing import Iterator, List, Optional, Tuple
+
+import blobstore
+import profiling
+import scheduler
+import storage
+import trim
+from models import Segment
+from video import DEFAULT_CODEC, ENCODERS
+
+READ_BLOCK = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+# (コーデック, 幅, 高さ)
+Signature = Tuple[Optional[str], Optional[int], Optional[int]]
+
+
+def signature(segment: Segment) -> Signature:
+    return segment.codec, segment.width, segment.height
+
+
+def target_signature(segments: List[Segment]) -> Signature:
+    """再エンコードが最も少なくなる形式（合計の長さが最大の形式）を基準にする"""
+    durations = Counter()
+    for s in segments:
+        durations[signature(s)] += s.duration_sec or (s.end_sec - s.start_sec)
+    target = durations.most_common(1)[0][0]
+    if len(durations) > 1 and target[0] not in ENCODERS:
+        # 基準のコーデックでエンコードできない場合はH.264に揃える
+        return DEFAULT_CODEC, target[1], target[2]
+    return target
+
+
+def normalized_path(segment: Segment, target: Signature) -> str:
+    codec, width, height = target
+    return os.path.join(
+        storage.export_dir(segment.video_id),
+        f"normalized_{segment.id}_{trim.source_key(segment)}_{codec}_{width}x{height}_{segment.trim_in}_{segment.trim_out}.mp4"
+    )
+
+
+def discard_normalized(video_id: int):
+    """再エンコード結果のキャッシュを消す（セグメントを切り直したとき）"""
+    export_dir = storage.export_dir(video_id)
+    if not os.path.isdir(export_dir):
+        return
+    for name in os.listdir(export_dir):
+        if name.startswith("normalized_"):
+            os.remove(os.path.join(export_dir, name))
+
+
+def normalize_segment(segment: Segment, target: Signature) -> str:
+    """基準の形式に合わないセグメントを再エンコード（同じ結果は使い回す）"""
+    output_path = normalized_path(segment, target)
+    if os.path.exists(output_path):
+        return output_path
+
+    codec, width, height = target
+    cmd = ["ffmpeg", "-v", "error", "-i", trim.export_source(segment)]
+    if width and height:
+        cmd += ["-vf", f"scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1"]
+    cmd += ENCODERS.get(codec, ENCODERS[DEFAULT_CODEC])
+    cmd += ["-preset", "veryfast", "-c:a", "aac", "-f", "mp4"]
+
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        scheduler.run(cmd + [temp_path, "-y"], scheduler.EXPORT, check=True, capture_output=True)
+        os.replace(temp_path, output_path)
+    except subprocess.CalledProcessError as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise Exception(f"Failed to re-encode segment {segment.index}: {e.stderr.decode(errors='ignore')[-500:]}")
+    return output_path
+
+
+def prepare_sources(segments: List[Segment]) -> List[str]:
+    """連結に使うファイルを用意して index 順に返す（トリムのレンダリングと、形式が違うものの再エンコード）
+    重い処理なのでワーカーのジョブから呼ぶ（レンダリングしたトリムのサイズとCRCは呼び出し側でコミットする）"""
+    target = target_signature(segments)
+    paths = []
+    for segment in segments:
+        blobstore.fetch(storage.segment_path(segment))
+        if trim.is_trimmed(segment):
+            # トリムは形式を変えずにレンダリングされる
+            trim.render_trim(segment)
+        if signature(segment) == target:
+            paths.append(trim.export_source(segment))
+        else:
+            logger.info("🔄 Re-encoding mismatched segment %d to %s", segment.index, target,
+                        extra={"video_id": segment.video_id})
+            paths.append(normalize_segment(segment, target))
+    return paths
+
+
+def prepared_sources(segments: List[Segment]) -> Optional[List[str]]:
+    """prepare_sources が用意済みなら連結に使うファイルを返す（未レンダリング・未変換のものがあればNone）"""
+    target = target_signature(segments)
+    paths = []
+    for segment in segments:
+        if not trim.is_rendered(segment):
+            return None
+        path = trim.export_source(segment) if signature(segment) == target else normalized_path(segment, target)
+        if not os.path.exists(path):
+            return None
+        paths.append(path)
+    return paths
+
+
+def concat_path(video_id: int, fingerprint: str) -> str:
+    """ワーカーが書き出した連結動画（保存先がS3のとき、APIは署名付きURLを返す）"""
+    return os.path.join(storage.export_dir(video_id), f"kept_{fingerprint}.mp4")
+
+
+def _write_concat_list(paths: List[str], directory: str) -> str:
+    fd, list_path = tempfile.mkstemp(suffix=".txt", dir=directory)
+    with os.fdopen(fd, "w") as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    return list_path
+
+
+def iter_concat(video_id: int, paths: List[str]) -> Iterator[bytes]:
+    """用意済みのファイル（prepared_sources）をストリームコピーで連結したfragmented MP4をチャンク単位で生成"""
+    directory = storage.export_dir(video_id)
+    os.makedirs(directory, exist_ok=True)
+    list_path = _write_concat_list(paths, directory)
+    cmd = [
+        "ffmpeg", "-v", "error",
+        "-f", "concat", "-safe", "0", "-i", list_path,
+        "-map", "0",
+        "-c", "copy",
+        "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+        "-f", "mp4", "pipe:1"
+    ]
+    # ストリームコピーのみでCPUをほとんど使わず、クライアントの受信速度に律速されるので実行枠は取らない
+    process = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, preexec_fn=scheduler.preexec(scheduler.EXPORT)
+    )
+    profile = profiling.current()
+    if profile is not None:
+        profile.ffmpeg_calls += 1
+    try:
+        while True:
+            if profile is None:
+                block = process.stdout.read(READ_BLOCK)
+            else:
+                # 出力を待っている時間をffmpegの時間として記録
+                with profile.child_wait(new_process=False) as acquired:
+                    acquired()
+                    block = process.stdout.read(READ_BLOCK)
+            if not block:
+                break
+            yield block
+        if process.wait() != 0:
+            raise Exception(f"Failed to concatenate segments: {process.stderr.read().decode(errors='ignore')[-500:]}")
+    finally:
+        # クライアントが途中で切断した場合もffmpegを止める
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+        os.remove(list_path)
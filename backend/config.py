@@ -0,0 +1,11 @@
+import os
+
+# 一時ストレージ設定（本格運用でも十分）
+# 動画処理後はZIPファイルでダウンロードするため永続化不要
+# 動画ごとのファイル（元動画・セグメント・エクスポート）は STORAGE_DIR 以下に配置（storage.py参照）
+STORAGE_DIR = os.getenv("STORAGE_DIR", "data/videos")
+# アップロード途中のファイル
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "data/original")
+# 以下は旧フラットレイアウト（migrate_storage.pyの移行元）
+SEGMENTS_DIR = os.getenv("SEGMENTS_DIR", "data/segments")
+EXPORT_DIR = os.getenv("EXPORT_DIR", "data/export")
@@ -1,16 +1,76 @@
-from sqlalchemy import create_engine
+import os
+from sqlalchemy import Integer, create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker
 from models import Base
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./swipecut.db"
+# 複数のワーカー/マシンで共有する場合は DATABASE_URL で共有DBを指定
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./swipecut.db")
+
+if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+    # Webとワーカーの複数プロセスから書き込むためロック待ちを許可
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False, "timeout": 30}
+    )
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragma(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.close()
+else:
+    engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_pre_ping=True)
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 def create_tables():
     Base.metadata.create_all(bind=engine)
+    if needs_schema_migration():
+        raise RuntimeError("Database schema is outdated. Run: python migrate_schema.py")
+    add_missing_columns()
+    add_missing_indexes()
+
+def needs_schema_migration() -> bool:
+    """列の型が変わった既存DB（segments.decision が文字列のまま）は migrate_schema.py での変換が必要"""
+    inspector = inspect(engine)
+    if not inspector.has_table("segments"):
+        return False
+    columns = {column["name"]: column["type"] for column in inspector.get_columns("segments")}
+    return "decision" in columns and not isinstance(columns["decision"], Integer)
+
+def add_missing_columns():
+    """既存DBのテーブルに、モデルに追加された列をALTER TABLEで追加（NULL許可の列のみ）"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+
+def add_missing_indexes():
+    """既存DBのテーブルに、モデルに追加されたインデックスを作成"""
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+
+def refresh_for_update(db, instance):
+    """instanceの行を読み直し、コミットするまで他のプロセスが同じ行を更新できないようにする
+    （読み込み→更新→コミットの間に他のプロセスの更新を上書きしないため）
+    SQLiteは行ロックがないので BEGIN IMMEDIATE でDB全体の書き込みロックを取る。それまでのトランザクションはコミットする"""
+    db.commit()
+    if engine.dialect.name == "sqlite":
+        db.execute(text("BEGIN IMMEDIATE"))
+        db.refresh(instance)
+    else:
+        db.refresh(instance, with_for_update=True)
 
 def get_db():
     db = SessionLocal()
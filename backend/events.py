@@ -0,0 +1,116 @@
+"""
+動画ごとのイベント配信（プロセス内Pub/Sub）
+判定カウンタの変化・セグメント準備完了・ジョブ進捗をSSEでフロントエンドへプッシュする
+"""
+import asyncio
+import json
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set
+
+# 購読者ごとのキュー上限（超えた分は古いものから捨てる）
+SUBSCRIBER_QUEUE_SIZE = 256
+# 最新値だけ届けば良いイベント（連続した更新は1件にまとめる）
+COALESCED_EVENTS = {"progress", "job"}
+# 接続維持のためのコメント送信間隔（秒）
+KEEPALIVE_SEC = 15
+
+
+class Subscriber:
+    """1接続分の受信バッファ"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.latest: Dict[str, dict] = {}  # まとめるイベントは種類（ジョブはjob_id）ごとに最新のみ保持
+        self.queue: Deque[dict] = deque(maxlen=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+        self.wakeup = asyncio.Event()
+
+    def push(self, event: str, data: dict):
+        if event in COALESCED_EVENTS:
+            self.latest[f"{event}:{data.get('job_id', '')}"] = {"event": event, "data": data}
+        else:
+            if len(self.queue) == self.queue.maxlen:
+                self.overflowed = True
+            self.queue.append({"event": event, "data": data})
+        self.wakeup.set()
+
+    def drain(self) -> List[dict]:
+        items = list(self.queue)
+        self.queue.clear()
+        if self.overflowed:
+            # 取りこぼしがあった場合はクライアントに再同期を促す
+            items.insert(0, {"event": "resync", "data": {}})
+            self.overflowed = False
+        items.extend(self.latest.values())
+        self.latest.clear()
+        self.wakeup.clear()
+        return items
+
+
+class EventBus:
+    def __init__(self):
+        self._subscribers: Dict[int, Set[Subscriber]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, video_id: int) -> Subscriber:
+        subscriber = Subscriber(asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.setdefault(video_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, video_id: int, subscriber: Subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(video_id)
+            if subscribers:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[video_id]
+
+    def has_subscribers(self, video_id: int) -> bool:
+        return video_id in self._subscribers
+
+    def subscribed_video_ids(self) -> List[int]:
+        with self._lock:
+            return list(self._subscribers)
+
+    def publish(self, video_id: int, event: str, data: dict):
+        """イベントを配信（イベントループ外のスレッドからも呼び出し可能）"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(video_id, ()))
+        for subscriber in subscribers:
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is subscriber.loop:
+                subscriber.push(event, data)
+            else:
+                subscriber.loop.call_soon_threadsafe(subscriber.push, event, data)
+
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def stream(video_id: int, initial: Optional[List[dict]] = None):
+    """SSEレスポンス本体。購読を開始し、バーストをまとめて送出する"""
+    subscriber = event_bus.subscribe(video_id)
+    try:
+        for item in initial or []:
+            yield format_sse(item["event"], item["data"])
+        while True:
+            try:
+                await asyncio.wait_for(subscriber.wakeup.wait(), timeout=KEEPALIVE_SEC)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            # 同一ティック内の連続したpublishをまとめてから送る
+            await asyncio.sleep(0)
+            yield "".join(format_sse(item["event"], item["data"]) for item in subscriber.drain())
+    finally:
+        event_bus.unsubscribe(video_id, subscriber)
+
+
+# シングルトンインスタンス
+event_bus = EventBus()
@@ -0,0 +1,210 @@
+"""
+Google Photosの認証情報ストア（ユーザーごと）
+認証情報はDB（google_credentials）に暗号化して保存し、プロセス内ではユーザーごとに
+Credentials と認可済みのAPIクライアントをキャッシュして使い回す
+アクセストークンは期限の GOOGLE_TOKEN_REFRESH_AHEAD 秒前にバックグラウンドで更新するので、
+リクエストの処理中にトークンの更新やDBの読み込みを待つのは、プロセスで最初に使うときだけになる
+同じユーザーの更新はロックでまとめ、別のプロセスが更新済みならDBの新しいトークンを取り込む
+暗号鍵は GOOGLE_CREDENTIALS_KEY（Fernetの鍵）。未設定なら GOOGLE_PHOTOS_CLIENT_SECRET から導出する
+"""
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from models import GoogleCredential
+
+# アクセストークンの期限の何秒前に更新するか（Googleのトークンは1時間）
+REFRESH_AHEAD = int(os.getenv("GOOGLE_TOKEN_REFRESH_AHEAD", "600"))
+# バックグラウンド更新の確認間隔（秒）
+REFRESH_INTERVAL = int(os.getenv("GOOGLE_TOKEN_REFRESH_INTERVAL", "60"))
+# 認証URLのstate（ユーザーIDを暗号化したもの）の有効期間（秒）
+STATE_TTL = 600
+# Photos Library APIの定義（googleapiclientに同梱されていないので、プロセスで1回だけ取得する）
+DISCOVERY_URL = "https://photoslibrary.googleapis.com/$discovery/rest?version=v1"
+
+
+class _Entry:
+    """ユーザーごとのキャッシュ（Credentials と、それで認可したAPIクライアント）"""
+
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self.service = None
+
+
+_entries: Dict[str, _Entry] = {}
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+_fernet = None
+_discovery_doc: Optional[str] = None
+
+logger = logging.getLogger(__name__)
+
+
+def _cipher():
+    global _fernet
+    if _fernet is None:
+        from cryptography.fernet import Fernet
+
+        key = os.getenv("GOOGLE_CREDENTIALS_KEY")
+        if not key:
+            secret = os.getenv("GOOGLE_PHOTOS_CLIENT_SECRET")
+            if not secret:
+                raise RuntimeError("GOOGLE_CREDENTIALS_KEY is not set")
+            key = base64.urlsafe_b64encode(hashlib.sha256(f"swipecut-credentials:{secret}".encode()).digest())
+        _fernet = Fernet(key)
+    return _fernet
+
+
+def encode_state(user_id: str) -> str:
+    """認証URLのstate（コールバックはブラウザの遷移なので、ユーザーIDをstateで受け渡す）"""
+    return _cipher().encrypt(user_id.encode()).decode()
+
+
+def decode_state(state: str) -> str:
+    """ValueErrorは不正・期限切れのstate"""
+    from cryptography.fernet import InvalidToken
+
+    try:
+        return _cipher().decrypt(state.encode(), ttl=STATE_TTL).decode()
+    except InvalidToken as e:
+        raise ValueError("Invalid state") from e
+
+
+def _lock(user_id: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(user_id, threading.Lock())
+
+
+def _is_fresh(credentials) -> bool:
+    """期限までREFRESH_AHEAD秒以上ある（expiryはUTCのnaive datetime）"""
+    return credentials.expiry is None or credentials.expiry - datetime.utcnow() > timedelta(seconds=REFRESH_AHEAD)
+
+
+def _decrypt(row: GoogleCredential):
+    from google.oauth2.credentials import Credentials
+
+    info = json.loads(_cipher().decrypt(row.encrypted.encode()))
+    credentials = Credentials.from_authorized_user_info(info, info.get("scopes"))
+    # from_authorized_user_infoは期限を読まないので、保存した期限を戻す（期限なしだと有効と見なされない）
+    credentials.expiry = row.expires_at
+    return credentials
+
+
+def _store(db: Session, user_id: str, credentials):
+    info = json.loads(credentials.to_json())
+    row = db.query(GoogleCredential).filter(GoogleCredential.user_id == user_id).first()
+    if not row:
+        row = GoogleCredential(user_id=user_id)
+        db.add(row)
+    row.encrypted = _cipher().encrypt(json.dumps(info).encode()).decode()
+    row.expires_at = credentials.expiry
+    row.updated_at = datetime.utcnow()
+    db.commit()
+
+
+def save(db: Session, user_id: str, credentials):
+    """認証完了時に保存し、キャッシュを置き換える（以前のAPIクライアントは破棄）"""
+    with _lock(user_id):
+        _store(db, user_id, credentials)
+        _entries[user_id] = _Entry(credentials)
+
+
+def _drop(db: Session, user_id: str):
+    db.query(GoogleCredential).filter(GoogleCredential.user_id == user_id).delete()
+    db.commit()
+    _entries.pop(user_id, None)
+
+
+def _refresh(db: Session, user_id: str, entry: Optional[_Entry]) -> Optional[_Entry]:
+    """ロックを持った状態で呼ぶ。DBの方が新しければ取り込み、それでも期限が近ければGoogleで更新する"""
+    from google.auth.exceptions import RefreshError
+    from google.auth.transport.requests import Request
+
+    row = db.query(GoogleCredential).filter(GoogleCredential.user_id == user_id).first()
+    if not row:
+        _entries.pop(user_id, None)
+        return None
+    stored = _decrypt(row)
+    if entry is None:
+        entry = _Entry(stored)
+        _entries[user_id] = entry
+    elif stored.expiry and (entry.credentials.expiry is None or stored.expiry > entry.credentials.expiry):
+        # 別のプロセスが更新済み（APIクライアントは同じCredentialsを参照しているので、中身だけ差し替える）
+        entry.credentials.token = stored.token
+        entry.credentials.expiry = stored.expiry
+
+    if _is_fresh(entry.credentials):
+        return entry
+    if not entry.credentials.refresh_token:
+        # 更新できない認証情報は期限が切れるまで使い、切れたら消す（再認証が必要）
+        if entry.credentials.expired:
+            _drop(db, user_id)
+            return None
+        return entry
+    try:
+        entry.credentials.refresh(Request())
+    except RefreshError:
+        # 取り消された認証情報は消す（通信エラーなどは次の確認で再試行）
+        _drop(db, user_id)
+        raise
+    _store(db, user_id, entry.credentials)
+    return entry
+
+
+def _build(credentials):
+    """APIクライアントを作る（API定義の取得はプロセスで1回だけ）"""
+    global _discovery_doc
+    from googleapiclient.discovery import build_from_document
+
+    if _discovery_doc is None:
+        import requests
+        response = requests.get(DISCOVERY_URL, timeout=30)
+        response.raise_for_status()
+        _discovery_doc = response.text
+    return build_from_document(_discovery_doc, credentials=credentials)
+
+
+def service(db: Session, user_id: str):
+    """ユーザーの認可済みAPIクライアント（未認証ならNone）
+    通常はキャッシュを返すだけ。期限切れ（バックグラウンド更新が間に合わなかった）の場合だけその場で更新する"""
+    entry = _entries.get(user_id)
+    if entry is None or entry.service is None or entry.credentials.expired:
+        with _lock(user_id):
+            entry = _entries.get(user_id)
+            if entry is None or entry.credentials.expired:
+                entry = _refresh(db, user_id, entry)
+                if entry is None:
+                    return None
+            if entry.service is None:
+                entry.service = _build(entry.credentials)
+    return entry.service
+
+
+def refresh_due(db: Session) -> int:
+    """期限が近いトークンを更新（キャッシュ中のユーザーと、DB上で期限が近いユーザー）。更新した件数を返す"""
+    horizon = datetime.utcnow() + timedelta(seconds=REFRESH_AHEAD)
+    user_ids = {user_id for user_id, entry in list(_entries.items()) if not _is_fresh(entry.credentials)}
+    user_ids.update(
+        user_id for (user_id,) in db.query(GoogleCredential.user_id).filter(GoogleCredential.expires_at < horizon)
+    )
+    refreshed = 0
+    for user_id in user_ids:
+        try:
+            with _lock(user_id):
+                entry = _entries.get(user_id)
+                if entry is not None and _is_fresh(entry.credentials):
+                    continue
+                entry = _refresh(db, user_id, entry)
+                if entry is not None and _is_fresh(entry.credentials):
+                    refreshed += 1
+        except Exception as e:
+            db.rollback()
+            logger.warning("⚠️ Failed to refresh Google token of %s: %s", user_id, e)
+    return refreshed
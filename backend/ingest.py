@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+ローカルフォルダの動画の一括取り込み
+HTTPのアップロードを通さず、ファイルをその場で登録し（ハードリンク、別のファイルシステムならシンボリックリンク。コピーしない）、
+APIと同じVideo・Segmentの行を書く。分割はプロセスプールで並列に行う（プロセス数はffmpegの実行枠に合わせる）
+  - 内容のSHA-256が同じ動画が登録済みならスキップ（登録済みのパスはハッシュも計算しない）
+  - 中断しても、もう一度同じコマンドを実行すれば続きから再開する（分割済みのセグメントは作り直さない）
+  - 解析（無音・重複の検出）は通常のワーカーに任せる
+
+使い方: python ingest.py <ディレクトリ> [--chunk-sec 60] [--workers N] [--dry-run]
+"""
+import argparse
+import hashlib
+import os
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func
+
+import blobstore
+import jobs
+import library
+import logs
+import scheduler
+import storage
+from db import SessionLocal, create_tables, engine
+from models import Job, Segment, Video
+
+VIDEO_EXTENSIONS = {".mp4", ".mov", ".m4v", ".mkv", ".avi", ".webm", ".mts", ".m2ts", ".3gp"}
+HASH_BLOCK = 1024 * 1024
+# 取り込みジョブのリース所有者（中断した取り込みのジョブを見分ける）
+OWNER_PREFIX = f"ingest:{socket.gethostname()}:"
+
+
+def scan(directory: str) -> List[str]:
+    """ディレクトリ以下の動画ファイル（隠しファイルを除く）をパス順に返す"""
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(files):
+            if not name.startswith(".") and os.path.splitext(name)[1].lower() in VIDEO_EXTENSIONS:
+                paths.append(os.path.abspath(os.path.join(root, name)))
+    return paths
+
+
+def file_hash(path: str) -> Tuple[str, str, int]:
+    """(パス, SHA-256, サイズ)（子プロセスで実行）"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(HASH_BLOCK)
+            if not block:
+                break
+            digest.update(block)
+    return path, digest.hexdigest(), os.path.getsize(path)
+
+
+def link_original(source: str, destination: str):
+    """元動画をコピーせずに配置（ハードリンク、できなければシンボリックリンク）"""
+    if os.path.lexists(destination):
+        return
+    try:
+        os.link(source, destination)
+    except OSError:
+        os.symlink(source, destination)
+
+
+def register(db, path: str, content_hash: str, chunk_sec: int) -> Video:
+    """Video行を作り、元動画を配置して分割待ちにする（APIのアップロード完了時と同じ状態）"""
+    filename = os.path.basename(path)
+    video = Video(filename=filename, original_path="", source="ingest", source_id=path, content_hash=content_hash)
+    db.add(video)
+    db.flush()
+    video.original_path = storage.original_path(video.id, filename)
+    storage.prepare_video_dirs(video.id)
+    link_original(path, video.original_path)
+    blobstore.publish(video.original_path)
+    video.chunk_sec = chunk_sec
+    video.set_status("uploaded")
+    library.original_stored(db, video)
+    db.commit()
+    return video
+
+
+def release_stale_jobs(db) -> int:
+    """このマシンで中断した取り込みのジョブ（プロセスが残っていないもの）をすぐ再実行できるようにする"""
+    released = 0
+    for job in db.query(Job).filter(Job.status == "running", Job.lease_owner.like(f"{OWNER_PREFIX}%")).all():
+        pid = int(job.lease_owner[len(OWNER_PREFIX):].split(":")[0])
+        try:
+            os.kill(pid, 0)
+            continue
+        except ProcessLookupError:
+            pass
+        except PermissionError:
+            continue
+        job.status = "queued"
+        job.lease_owner = None
+        released += 1
+    db.commit()
+    return released
+
+
+def _init_worker():
+    # 親プロセスから引き継いだDB接続は使わない（ログの書き出しスレッドは子プロセスで起動し直す）
+    engine.dispose(close=False)
+    logs.setup()
+
+
+def segment_video(video_id: int, chunk_sec: int) -> Tuple[int, Optional[dict], Optional[str]]:
+    """分割ジョブを登録して自分で実行する（子プロセスで実行）。(video_id, 結果, エラー) を返す"""
+    from tasks import run_segment_job
+
+    db = SessionLocal()
+    owner = OWNER_PREFIX + jobs.worker_id().split(":", 1)[1]
+    try:
+        job = jobs.enqueue(db, "segment", video_id, {"chunk_sec": chunk_sec}, dedupe_key=f"segment:{video_id}")
+        job = jobs.claim_job(db, job.id, owner)
+        if job is None:
+            # 通常のワーカーが先に取得した
+            return video_id, None, None
+        try:
+            with scheduler.priority(scheduler.INGEST):
+                result = run_segment_job(db, job, lambda done, total: jobs.heartbeat(db, job.id, owner, done, total))
+        except Exception as e:
+            db.rollback()
+            jobs.fail(db, job.id, owner, str(e))
+            return video_id, None, str(e)
+        jobs.complete(db, job.id, owner, result)
+        # スループットの表示用（元動画のサイズと長さ）
+        video = db.query(Video).filter(Video.id == video_id).first()
+        result["bytes"] = os.path.getsize(video.original_path)
+        result["duration_sec"] = db.query(func.max(Segment.end_sec)).filter(Segment.video_id == video_id).scalar() or 0.0
+        return video_id, result, None
+    finally:
+        db.close()
+
+
+def ingest(directory: str, chunk_sec: int, workers: int, dry_run: bool = False):
+    logs.setup()
+    create_tables()
+    paths = scan(directory)
+    print(f"📂 Found {len(paths)} video files in {directory}")
+
+    db = SessionLocal()
+    try:
+        known_paths = {
+            source_id for (source_id,) in db.query(Video.source_id).filter(Video.source == "ingest", Video.source_id.in_(paths))
+        } if paths else set()
+        new_paths = [path for path in paths if path not in known_paths]
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            # 内容のハッシュ（登録済みのパスは計算しない）
+            started = time.monotonic()
+            hashes = [future.result() for future in as_completed([pool.submit(file_hash, path) for path in new_paths])]
+            hashed_bytes = sum(size for _, _, size in hashes)
+            elapsed = max(time.monotonic() - started, 1e-6)
+            print(f"🔍 Hashed {len(hashes)} files ({hashed_bytes / 1e9:.2f} GB) in {elapsed:.1f}s "
+                  f"({hashed_bytes / 1e6 / elapsed:.0f} MB/s)")
+
+            known_hashes = {
+                content_hash for (content_hash,) in
+                db.query(Video.content_hash).filter(Video.content_hash.in_([h for _, h, _ in hashes]))
+            } if hashes else set()
+            to_register = []
+            for path, content_hash, _ in sorted(hashes):
+                if content_hash in known_hashes:
+                    print(f"⏭️ Skipping duplicate: {path}")
+                    continue
+                known_hashes.add(content_hash)
+                to_register.append((path, content_hash))
+
+            if dry_run:
+                print(f"✅ Dry run: {len(to_register)} files would be ingested, {len(paths) - len(to_register)} skipped")
+                return
+
+            for path, content_hash in to_register:
+                register(db, path, content_hash, chunk_sec)
+            released = release_stale_jobs(db)
+            if released:
+                print(f"⏩ Resuming {released} interrupted segmentation jobs")
+
+            # 今回・前回の実行で登録して、分割が終わっていない動画
+            pending = db.query(Video.id, Video.chunk_sec).filter(
+                Video.source == "ingest", Video.status.in_(["uploaded", "segmenting"])
+            ).order_by(Video.id).all()
+            print(f"🎬 Segmenting {len(pending)} videos on {workers} processes "
+                  f"({len(to_register)} new, {len(paths) - len(to_register)} already ingested or duplicate)")
+
+            started = time.monotonic()
+            done = failed = segments = 0
+            total_bytes = total_duration = 0.0
+            futures = [pool.submit(segment_video, video_id, video_chunk or chunk_sec) for video_id, video_chunk in pending]
+            for future in as_completed(futures):
+                video_id, result, error = future.result()
+                if error:
+                    failed += 1
+                    print(f"❌ Video {video_id}: {error}")
+                    continue
+                if result is None:
+                    print(f"⏭️ Video {video_id} is being segmented by a worker")
+                    continue
+                done += 1
+                segments += result["segments_count"]
+                total_bytes += result["bytes"]
+                total_duration += result["duration_sec"]
+                elapsed = max(time.monotonic() - started, 1e-6)
+                print(f"✅ [{done + failed}/{len(pending)}] video {video_id}: {result['segments_count']} segments | "
+                      f"{done / elapsed * 60:.1f} videos/min, {total_bytes / 1e6 / elapsed:.0f} MB/s, "
+                      f"{total_duration / elapsed:.1f}x realtime")
+    finally:
+        db.close()
+
+    print(f"🏁 Ingested {done} videos ({segments} segments) in {time.monotonic() - started:.1f}s, {failed} failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest a local folder of videos without uploading them")
+    parser.add_argument("directory", help="取り込むディレクトリ（サブディレクトリも含む）")
+    parser.add_argument("--chunk-sec", type=int, default=60, help="分割秒数")
+    parser.add_argument("--workers", type=int, default=scheduler.slot_limit(scheduler.INGEST),
+                        help="分割に使うプロセス数（デフォルト: ffmpegのingest用の実行枠の数）")
+    parser.add_argument("--dry-run", action="store_true", help="登録せずに取り込み対象だけ表示")
+    args = parser.parse_args()
+    ingest(args.directory, args.chunk_sec, max(1, args.workers), args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
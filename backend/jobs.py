@@ -0,0 +1,254 @@
+"""
+DBバックエンドのジョブキュー
+Webプロセスはジョブを登録するだけで、分割・エクスポートはワーカー（worker.py）がリース付きで取得して実行する
+"""
+import json
+import math
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import scheduler
+from models import Job
+
+# リースの有効期間（秒）。ハートビートが途絶えるとこの時間で再キューされる
+LEASE_SEC = int(os.getenv("JOB_LEASE_SEC", "60"))
+
+# 優先度ごとの待ち行列の上限（超えたら429で受付を断る）
+MAX_QUEUED = {
+    scheduler.INTERACTIVE: int(os.getenv("JOB_MAX_QUEUED_INTERACTIVE", "50")),
+    scheduler.INGEST: int(os.getenv("JOB_MAX_QUEUED_INGEST", "20")),
+    scheduler.EXPORT: int(os.getenv("JOB_MAX_QUEUED_EXPORT", "10")),
+}
+# クライアントごとの未完了ジョブ数の上限と、同時に実行できるジョブ数
+MAX_PENDING_PER_CLIENT = int(os.getenv("JOB_MAX_PENDING_PER_CLIENT", "5"))
+MAX_RUNNING_PER_CLIENT = int(os.getenv("JOB_MAX_RUNNING_PER_CLIENT", "2"))
+# 処理速度が分からないときのRetry-After（秒）
+DEFAULT_RETRY_AFTER = 30
+
+
+class Backpressure(Exception):
+    """待ち行列が混んでいて受け付けられない（APIは429とRetry-Afterを返す）"""
+
+    def __init__(self, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def job_to_dict(job: Job) -> dict:
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "video_id": job.video_id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "done": job.progress_done,
+        "total": job.progress_total,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error
+    }
+
+
+def estimate_wait(db: Session, priority: int, depth: int) -> int:
+    """直近10分の処理件数から、待ち行列がはけるまでの秒数を見積もる"""
+    since = datetime.utcnow() - timedelta(minutes=10)
+    finished = db.query(func.count(Job.id)).filter(
+        Job.priority == priority, Job.status == "done", Job.updated_at > since
+    ).scalar()
+    if not finished:
+        return DEFAULT_RETRY_AFTER
+    return min(600, max(1, math.ceil(depth * 600 / finished)))
+
+
+def check_admission(db: Session, kind: str, client_id: Optional[str] = None):
+    """待ち行列の深さとクライアントごとの未完了数を見て、受け付けられなければBackpressureを送出"""
+    priority = scheduler.KIND_PRIORITY.get(kind, scheduler.INGEST)
+    depth = db.query(func.count(Job.id)).filter(Job.priority == priority, Job.status == "queued").scalar()
+    if depth >= MAX_QUEUED.get(priority, MAX_QUEUED[scheduler.INGEST]):
+        raise Backpressure(
+            f"Too many queued {scheduler.PRIORITY_NAMES[priority]} jobs ({depth})",
+            estimate_wait(db, priority, depth - MAX_QUEUED[priority] + 1)
+        )
+    if client_id:
+        pending = db.query(func.count(Job.id)).filter(
+            Job.client_id == client_id, Job.status.in_(["queued", "running"])
+        ).scalar()
+        if pending >= MAX_PENDING_PER_CLIENT:
+            raise Backpressure(
+                f"Too many pending jobs for this client ({pending})",
+                estimate_wait(db, priority, pending - MAX_PENDING_PER_CLIENT + 1)
+            )
+
+
+def enqueue(db: Session, kind: str, video_id: int, payload: Optional[dict] = None,
+            dedupe_key: Optional[str] = None, max_attempts: int = 3,
+            client_id: Optional[str] = None, admit: bool = False) -> Job:
+    """ジョブを登録（同じdedupe_keyの未完了ジョブがあればそれを返す）
+    admit=Trueなら新規登録の前に受付制限を確認する（混雑時はBackpressure）"""
+    if dedupe_key:
+        existing = db.query(Job).filter(
+            Job.dedupe_key == dedupe_key,
+            Job.status.in_(["queued", "running"])
+        ).first()
+        if existing:
+            return existing
+    if admit:
+        check_admission(db, kind, client_id)
+
+    job = Job(
+        kind=kind,
+        video_id=video_id,
+        payload=json.dumps(payload or {}),
+        dedupe_key=dedupe_key,
+        max_attempts=max_attempts,
+        priority=scheduler.KIND_PRIORITY.get(kind, scheduler.INGEST),
+        client_id=client_id
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def requeue_expired(db: Session) -> int:
+    """リース切れの実行中ジョブを再キュー（試行回数を使い切ったものは失敗にする）"""
+    now = datetime.utcnow()
+    expired = Job.status == "running", Job.lease_expires_at < now
+    failed = db.query(Job).filter(*expired, Job.attempts >= Job.max_attempts).update(
+        {"status": "failed", "lease_owner": None, "error": "Lease expired", "updated_at": now},
+        synchronize_session=False
+    )
+    requeued = db.query(Job).filter(*expired).update(
+        {"status": "queued", "lease_owner": None, "updated_at": now},
+        synchronize_session=False
+    )
+    db.commit()
+    return failed + requeued
+
+
+def claim(db: Session, owner: str, kinds: Optional[list] = None) -> Optional[Job]:
+    """優先度の高いジョブからリース付きで取得。条件付きUPDATEで他のワーカーとの取り合いを防ぐ
+    同じクライアントのジョブが既に上限数実行中なら、そのクライアントのジョブは後回しにする"""
+    requeue_expired(db)
+
+    query = db.query(Job.id, Job.client_id).filter(Job.status == "queued")
+    if kinds:
+        query = query.filter(Job.kind.in_(kinds))
+    candidates = query.order_by(Job.priority, Job.id).limit(32).all()
+
+    busy_clients = {
+        client_id for client_id, running in db.query(Job.client_id, func.count(Job.id)).filter(
+            Job.status == "running", Job.client_id.isnot(None)
+        ).group_by(Job.client_id).all()
+        if running >= MAX_RUNNING_PER_CLIENT
+    }
+
+    for job_id, client_id in candidates:
+        if client_id in busy_clients:
+            continue
+        job = _take(db, job_id, owner)
+        if job:
+            return job
+    return None
+
+
+def claim_job(db: Session, job_id: int, owner: str) -> Optional[Job]:
+    """指定したジョブをリース付きで取得（一括取り込みが自分で登録したジョブを実行する）。実行中・完了済みならNone"""
+    requeue_expired(db)
+    return _take(db, job_id, owner)
+
+
+def _take(db: Session, job_id: int, owner: str) -> Optional[Job]:
+    now = datetime.utcnow()
+    claimed = db.query(Job).filter(Job.id == job_id, Job.status == "queued").update(
+        {
+            "status": "running",
+            "lease_owner": owner,
+            "lease_expires_at": now + timedelta(seconds=LEASE_SEC),
+            "attempts": Job.attempts + 1,
+            "updated_at": now
+        },
+        synchronize_session=False
+    )
+    db.commit()
+    if claimed == 1:
+        return db.query(Job).filter(Job.id == job_id).first()
+    return None
+
+
+def heartbeat(db: Session, job_id: int, owner: str, done: Optional[int] = None, total: Optional[int] = None) -> bool:
+    """リースを延長（進捗も更新）。リースを失っていればFalse"""
+    now = datetime.utcnow()
+    values = {"lease_expires_at": now + timedelta(seconds=LEASE_SEC), "updated_at": now}
+    if done is not None:
+        values["progress_done"] = done
+    if total is not None:
+        values["progress_total"] = total
+    updated = db.query(Job).filter(
+        Job.id == job_id, Job.status == "running", Job.lease_owner == owner
+    ).update(values, synchronize_session=False)
+    db.commit()
+    return updated == 1
+
+
+def complete(db: Session, job_id: int, owner: str, result: Optional[dict] = None) -> bool:
+    updated = db.query(Job).filter(
+        Job.id == job_id, Job.status == "running", Job.lease_owner == owner
+    ).update(
+        {"status": "done", "lease_owner": None, "result": json.dumps(result or {}), "updated_at": datetime.utcnow()},
+        synchronize_session=False
+    )
+    db.commit()
+    return updated == 1
+
+
+def fail(db: Session, job_id: int, owner: str, error: str) -> bool:
+    """失敗を記録。試行回数が残っていれば再キュー"""
+    job = db.query(Job).filter(Job.id == job_id, Job.lease_owner == owner).first()
+    if not job or job.status != "running":
+        return False
+    job.status = "queued" if job.attempts < job.max_attempts else "failed"
+    job.lease_owner = None
+    job.error = error
+    job.updated_at = datetime.utcnow()
+    db.commit()
+    return True
+
+
+def cancel_queued(db: Session, video_id: int, kinds: list, reason: str) -> int:
+    """実行待ちのジョブを取り消す（失敗として理由を記録。実行中のジョブはそのまま）"""
+    cancelled = db.query(Job).filter(
+        Job.video_id == video_id, Job.kind.in_(kinds), Job.status == "queued"
+    ).update(
+        {"status": "failed", "error": reason, "updated_at": datetime.utcnow()},
+        synchronize_session=False
+    )
+    db.commit()
+    return cancelled
+
+
+def latest_job(db: Session, kind: str, video_id: int, statuses: Optional[list] = None) -> Optional[Job]:
+    query = db.query(Job).filter(Job.kind == kind, Job.video_id == video_id)
+    if statuses:
+        query = query.filter(Job.status.in_(statuses))
+    return query.order_by(Job.id.desc()).first()
+
+
+def changed_since(db: Session, since: datetime, video_ids: list) -> list:
+    """指定時刻以降に更新されたジョブ（イベント配信用）"""
+    if not video_ids:
+        return []
+    return db.query(Job).filter(
+        Job.updated_at > since,
+        Job.video_id.in_(video_ids)
+    ).order_by(Job.updated_at).all()
@@ -0,0 +1,178 @@
+"""
+動画ライブラリ（一覧とVideoに非正規化した集計値）
+セグメントの追加・削除・判定・トリムのたびにVideoの集計値を差分で更新し、
+一覧は (created_at, id) のキーセットページングで1ページ1回のインデックス検索で返す
+"""
+import base64
+import json
+import os
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, func, tuple_
+from sqlalchemy.orm import Session
+
+from models import Segment, Video
+
+MAX_PAGE_SIZE = 100
+
+
+def kept_seconds(segment: Segment) -> float:
+    """エクスポートされる長さ（トリム後）"""
+    length = segment.duration_sec or (segment.end_sec - segment.start_sec)
+    trim_in = segment.trim_in or 0.0
+    trim_out = min(segment.trim_out, length) if segment.trim_out is not None else length
+    return max(0.0, trim_out - trim_in)
+
+
+def _apply(db: Session, video_id: int, **deltas):
+    """集計値に差分を加える（UPDATE ... SET x = x + :d。他のプロセスの更新と競合しない）"""
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    db.query(Video).filter(Video.id == video_id).update(
+        {getattr(Video, name): func.coalesce(getattr(Video, name), 0) + delta for name, delta in deltas.items()},
+        synchronize_session=False
+    )
+
+
+def _decision_deltas(segment: Segment, old: str, new: str) -> dict:
+    deltas = {"kept_count": 0, "dropped_count": 0, "kept_duration_sec": 0.0}
+    for decision, sign in ((old, -1), (new, 1)):
+        if decision == "keep":
+            deltas["kept_count"] += sign
+            deltas["kept_duration_sec"] += sign * kept_seconds(segment)
+        elif decision == "drop":
+            deltas["dropped_count"] += sign
+    return deltas
+
+
+def segments_added(db: Session, video_id: int, segments: Iterable[Segment]):
+    deltas = {"segment_count": 0, "storage_bytes": 0, "kept_count": 0, "dropped_count": 0, "kept_duration_sec": 0.0}
+    for segment in segments:
+        deltas["segment_count"] += 1
+        deltas["storage_bytes"] += segment.size_bytes or 0
+        for name, delta in _decision_deltas(segment, "pending", segment.decision).items():
+            deltas[name] += delta
+    _apply(db, video_id, **deltas)
+
+
+def segments_removed(db: Session, video_id: int, segments: Iterable[Segment]):
+    deltas = {"segment_count": 0, "storage_bytes": 0, "kept_count": 0, "dropped_count": 0, "kept_duration_sec": 0.0}
+    for segment in segments:
+        deltas["segment_count"] -= 1
+        deltas["storage_bytes"] -= segment.size_bytes or 0
+        for name, delta in _decision_deltas(segment, segment.decision, "pending").items():
+            deltas[name] += delta
+    _apply(db, video_id, **deltas)
+
+
+def set_decisions(db: Session, video_id: int, segments: Iterable[Segment], decision: str):
+    """セグメントの判定を変更し、集計値をまとめて更新"""
+    deltas = {"kept_count": 0, "dropped_count": 0, "kept_duration_sec": 0.0}
+    for segment in segments:
+        for name, delta in _decision_deltas(segment, segment.decision, decision).items():
+            deltas[name] += delta
+        segment.decision = decision
+    _apply(db, video_id, **deltas)
+
+
+def pending_dropped(db: Session, video_id: int, count: int):
+    """未判定のセグメントcount件がまとめてDropされた（Keepの集計は変わらない）"""
+    _apply(db, video_id, dropped_count=count)
+
+
+def trim_changed(db: Session, segment: Segment, old_seconds: float):
+    if segment.decision == "keep":
+        _apply(db, segment.video_id, kept_duration_sec=kept_seconds(segment) - old_seconds)
+
+
+def original_stored(db: Session, video: Video):
+    """元動画の保存完了時にサイズを加える"""
+    path = video.original_path
+    if path and os.path.exists(path):
+        _apply(db, video.id, storage_bytes=os.path.getsize(path))
+
+
+def refresh_stats(db: Session, video: Video):
+    """集計値をセグメントから計算し直す（差し替え・既存DBの移行用。1回の集計クエリ）"""
+    kept = Segment.decision == "keep"
+    count, kept_count, dropped_count, segment_bytes = db.query(
+        func.count(Segment.id),
+        func.coalesce(func.sum(case((kept, 1), else_=0)), 0),
+        func.coalesce(func.sum(case((Segment.decision == "drop", 1), else_=0)), 0),
+        func.coalesce(func.sum(Segment.size_bytes), 0)
+    ).filter(Segment.video_id == video.id).one()
+    kept_segments = db.query(Segment).filter(Segment.video_id == video.id, kept).all()
+    original_bytes = os.path.getsize(video.original_path) if video.original_path and os.path.exists(video.original_path) else 0
+
+    video.segment_count = count
+    video.kept_count = kept_count
+    video.dropped_count = dropped_count
+    video.kept_duration_sec = sum(kept_seconds(s) for s in kept_segments)
+    video.storage_bytes = original_bytes + segment_bytes
+
+
+def backfill_stats(db: Session) -> int:
+    """集計値が未計算の動画（集計列の追加前に作られた動画）を計算する
+    状態の列の追加前に分割された動画（statusがNULLでセグメントがある）は segmented にする"""
+    has_segments = db.query(Segment.id).filter(Segment.video_id == Video.id).exists()
+    db.query(Video).filter(Video.status.is_(None), has_segments).update(
+        {Video.status: "segmented"}, synchronize_session=False
+    )
+    videos = db.query(Video).filter(Video.segment_count.is_(None)).all()
+    for video in videos:
+        refresh_stats(db, video)
+    db.commit()
+    return len(videos)
+
+
+def encode_cursor(video: Video) -> str:
+    raw = json.dumps([video.created_at.isoformat(), video.id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """ValueErrorは不正なカーソル"""
+    try:
+        created_at, video_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at), int(video_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def list_videos(db: Session, limit: int, cursor: Optional[str] = None,
+                source: Optional[str] = None, status: Optional[str] = None) -> Tuple[List[Video], Optional[str]]:
+    """新しい順に1ページ分の動画と次ページのカーソルを返す
+    (created_at, id) の複合インデックス（絞り込み時は (source|status, created_at, id)）を逆順に辿るだけで、
+    ライブラリの大きさによらず1回のクエリで済む"""
+    query = db.query(Video)
+    if source:
+        query = query.filter(Video.source == source)
+    if status:
+        query = query.filter(Video.status == status)
+    if cursor:
+        query = query.filter(tuple_(Video.created_at, Video.id) < decode_cursor(cursor))
+    videos = query.order_by(Video.created_at.desc(), Video.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(videos[limit - 1]) if len(videos) > limit else None
+    return videos[:limit], next_cursor
+
+
+def video_to_dict(video: Video) -> dict:
+    segment_count = video.segment_count or 0
+    kept = video.kept_count or 0
+    dropped = video.dropped_count or 0
+    return {
+        "video_id": video.id,
+        "filename": video.filename,
+        "source": video.source,
+        "status": video.status,
+        "created_at": video.created_at.isoformat(),
+        "segments_total": video.segments_total,
+        "segment_count": segment_count,
+        "kept": kept,
+        "dropped": dropped,
+        "pending": segment_count - kept - dropped,
+        "kept_duration_sec": round(video.kept_duration_sec or 0.0, 3),
+        "storage_bytes": video.storage_bytes or 0
+    }
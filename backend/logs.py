@@ -0,0 +1,229 @@
+"""
+構造化ログ（printの置き換え）
+レコードには request_id・video_id などのコンテキスト（contextvarsで引き継ぐ）と、stage・elapsed_ms などの任意のフィールドが付く
+ハンドラはキュー経由（呼び出し側はキューに積むだけ）で、メッセージの整形と標準出力への書き込みは別スレッドで行う
+（キューが溢れたらイベントループを止めずに捨て、捨てた件数を次のレコードの dropped に入れる）
+  LOG_LEVEL:  出力するレベル（デフォルト: INFO）。無効なレベルの呼び出しはレベルの比較だけで返る
+  LOG_FORMAT: text（デフォルト）か json（1行1レコード。コンテナのログドライバ・集計向け）
+  LOG_RATE_LIMIT・LOG_RATE_WINDOW: 同じメッセージ（書式文字列が同じもの）は LOG_RATE_WINDOW 秒（デフォルト: 60）に
+      LOG_RATE_LIMIT 件（デフォルト: 20、0で無制限）まで。抑制した件数は次に出力するレコードの suppressed に入る
+"""
+import atexit
+import contextlib
+import contextvars
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+FORMAT = os.getenv("LOG_FORMAT", "text")
+RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", "20"))
+RATE_WINDOW = float(os.getenv("LOG_RATE_WINDOW", "60"))
+QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# 処理中のリクエスト・ジョブのフィールド（request_id・video_id・job_id など）
+_context: contextvars.ContextVar[Dict[str, object]] = contextvars.ContextVar("log_context", default={})
+# LogRecordの標準の属性（これ以外の属性をフィールドとして出力する）
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_pid: Optional[int] = None
+_request_prefix = uuid.uuid4().hex[:8]
+_request_ids = itertools.count(1)
+_NOOP = contextlib.nullcontext()
+
+
+@contextlib.contextmanager
+def bind(**fields) -> Iterator[None]:
+    """ブロック内のログに fields を付ける（asyncio.to_thread・スレッドプールで実行される処理にも引き継がれる）"""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def stage(logger: logging.Logger, name: str, level: int = logging.DEBUG, **fields):
+    """ブロックの所要時間を stage・elapsed_ms として記録（レベルが無効なら何もしないコンテキストを返すだけ）"""
+    if not logger.isEnabledFor(level):
+        return _NOOP
+    return _timed(logger, name, level, fields)
+
+
+@contextlib.contextmanager
+def _timed(logger: logging.Logger, name: str, level: int, fields: Dict[str, object]) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+        logger.log(level, "%s finished in %.1f ms", name, elapsed_ms,
+                   extra={"stage": name, "elapsed_ms": elapsed_ms, **fields})
+
+
+def fields_of(record: logging.LogRecord) -> Dict[str, object]:
+    """標準の属性以外（コンテキストとextraで付けたもの）"""
+    return {key: value for key, value in record.__dict__.items() if key not in _RECORD_ATTRS}
+
+
+class RateLimitFilter(logging.Filter):
+    """同じ書式文字列のレコードを窓ごとにlimit件まで通す（引数の違うメッセージもまとめて数える）"""
+
+    def __init__(self, limit: int, window: float):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self._counts: Dict[tuple, List] = {}  # (logger, level, 書式) -> [窓の開始時刻, 件数, 抑制した件数]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.limit <= 0:
+            return True
+        key = (record.name, record.levelno, record.msg if isinstance(record.msg, str) else type(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            state = self._counts.get(key)
+            if state is None or now - state[0] >= self.window:
+                if len(self._counts) >= 4096:
+                    self._prune(now)
+                self._counts[key] = [now, 1, 0]
+                if state is not None and state[2]:
+                    record.suppressed = state[2]
+                return True
+            if state[1] < self.limit:
+                state[1] += 1
+                return True
+            state[2] += 1
+            return False
+
+    def _prune(self, now: float):
+        for key in [key for key, state in self._counts.items() if now - state[0] >= self.window]:
+            del self._counts[key]
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """コンテキストを付けてキューに積むだけ（標準のQueueHandlerはここでメッセージを整形してしまう）"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        for key, value in _context.get().items():
+            if key not in record.__dict__:
+                setattr(record, key, value)
+        if self.dropped:
+            record.dropped, self.dropped = self.dropped, 0
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class TextFormatter(logging.Formatter):
+    """時刻 レベル ロガー: メッセージ key=value ..."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        extra = " ".join(f"{key}={value}" for key, value in fields_of(record).items())
+        if not extra:
+            return line
+        head, _, rest = line.partition("\n")
+        return f"{head} {extra}" + (f"\n{rest}" if rest else "")
+
+
+class JsonFormatter(logging.Formatter):
+    """1行1レコードのJSON（ts・level・logger・msg と各フィールド、例外は exc）"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.utcfromtimestamp(record.created).isoformat(timespec="milliseconds") + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **fields_of(record),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def shutdown():
+    """キューに残ったレコードを書き出して書き出しスレッドを止める（atexitを通らずに終わる子プロセスでは明示的に呼ぶ）"""
+    if _listener is not None and _pid == os.getpid() and _listener._thread is not None:
+        _listener.stop()
+
+
+def setup():
+    """ルートロガーにキュー経由のハンドラを付ける（プロセスごとに1回。forkした子プロセスでは付け直す）"""
+    global _listener, _pid
+    if _pid == os.getpid():
+        return
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, ContextQueueHandler):
+            root.removeHandler(handler)
+
+    log_queue: queue.Queue = queue.Queue(QUEUE_SIZE)
+    handler = ContextQueueHandler(log_queue)
+    handler.addFilter(RateLimitFilter(RATE_LIMIT, RATE_WINDOW))
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if FORMAT == "json" else TextFormatter())
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+    root.addHandler(handler)
+    root.setLevel(LEVEL)
+    if _pid is None:
+        # 終了時にキューに残ったレコードを書き出す
+        atexit.register(shutdown)
+    _pid = os.getpid()
+
+
+class RequestIdMiddleware:
+    """リクエストごとに request_id をログのコンテキストに入れ、X-Request-Id ヘッダで返すASGIミドルウェア
+    （クライアント・プロキシが X-Request-Id を付けていればそれを使う）"""
+
+    def __init__(self, app):
+        self.app = app
+        self.logger = logging.getLogger("request")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        if not request_id:
+            request_id = f"{_request_prefix}-{next(_request_ids):x}"
+        header = (b"x-request-id", request_id.encode("latin-1"))
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), header]}
+            await send(message)
+
+        token = _context.set({**_context.get(), "request_id": request_id})
+        try:
+            with stage(self.logger, "request", method=scope["method"], path=scope["path"]):
+                await self.app(scope, receive, send_with_id)
+        finally:
+            _context.reset(token)
@@ -1,21 +1,39 @@
-from fastapi import FastAPI, File, UploadFile, Depends, HTTPException, Query
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import APIRouter, FastAPI, File, UploadFile, Depends, HTTPException, Query, Request, Header
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, Response, RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from sqlalchemy import func, or_
 from sqlalchemy.orm import Session
+from contextlib import asynccontextmanager
 from typing import List, Optional
+from datetime import datetime, timedelta
+import asyncio
+import logging
 import os
 import json
-import zipfile
+import shutil
 import time
+import zipfile
 from pathlib import Path
 
-from db import get_db, create_tables
-from models import Video, Segment
-from video import split_video, create_zip_archive
-from google_photos import google_photos_client
-
-app = FastAPI(title="SwipeCut API", version="1.0.0")
+from config import UPLOAD_DIR, STORAGE_DIR
+from db import get_db, create_tables, SessionLocal
+from models import Video, Segment, Job, UploadSession
+from events import event_bus, stream as event_stream
+import uploads
+import blobstore
+import jobs
+import library
+import logs
+import zipstream
+import storage
+import concat
+import preview
+import profiling
+import scheduler
+import trim
+from video import parse_cut_points
+from tasks import export_fingerprint, export_zip_path
 
 # CORS設定（本番環境用）
 ALLOWED_ORIGINS = [
@@ -25,70 +43,229 @@ ALLOWED_ORIGINS = [
     "http://localhost:3000",  # 開発環境用
 ]
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=ALLOWED_ORIGINS,
-    allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE"],
-    allow_headers=["*"],
-)
-
-# データベーステーブル作成
-create_tables()
-
-# アプリケーション起動ログ
-print("🚀 SwipeCut API starting...")
-print(f"📁 Working directory: {os.getcwd()}")
-print(f"🌐 Port: {os.getenv('PORT', '8000')}")
-print(f"📂 Frontend dist exists: {os.path.exists('frontend/dist')}")
-print("✅ Database tables created")
-print("✅ Application ready!")
-
-# 一時ストレージ設定（本格運用でも十分）
-# 動画処理後はZIPファイルでダウンロードするため永続化不要
-UPLOAD_DIR = os.getenv("UPLOAD_DIR", "data/original")
-SEGMENTS_DIR = os.getenv("SEGMENTS_DIR", "data/segments")
-EXPORT_DIR = os.getenv("EXPORT_DIR", "data/export")
-
-# ディレクトリ作成
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-os.makedirs(SEGMENTS_DIR, exist_ok=True)
-os.makedirs(EXPORT_DIR, exist_ok=True)
+# ワーカーが更新したジョブ状態をSSEへ中継する間隔（秒）
+JOB_WATCH_INTERVAL = float(os.getenv("JOB_WATCH_INTERVAL", "0.5"))
+# 古い動画・放置アップロードを掃除する間隔（秒）
+CLEANUP_INTERVAL = float(os.getenv("CLEANUP_INTERVAL", "3600"))
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+def get_google_photos():
+    """Google Photos連携（googleapiclient等の読み込みは初回利用時まで遅延）"""
+    import google_photos
+    return google_photos
+
+def google_user(request: Request) -> str:
+    """Google Photosの認証情報の持ち主（X-Client-Id。接続元IPは共有されうるので使わない）"""
+    user_id = request.headers.get("X-Client-Id")
+    if not user_id:
+        raise HTTPException(status_code=400, detail="X-Client-Id header is required")
+    return user_id
+
+def google_photos_client(db: Session, request: Request):
+    google_photos = get_google_photos()
+    try:
+        return google_photos.client_for(db, google_user(request))
+    except google_photos.NotAuthenticated:
+        raise HTTPException(status_code=401, detail="Google Photos is not connected")
+
+def delete_video(db: Session, video: Video):
+    """動画を削除（行を消し、ディレクトリはtrashへ移動するだけ）"""
+    db.query(Segment).filter(Segment.video_id == video.id).delete(synchronize_session=False)
+    db.query(Job).filter(Job.video_id == video.id).delete(synchronize_session=False)
+    db.query(UploadSession).filter(UploadSession.video_id == video.id).update(
+        {"video_id": None}, synchronize_session=False
+    )
+    db.delete(video)
+    db.commit()
+    storage.delete_video_files(video.id)
+    blobstore.delete_tree(storage.video_dir(video.id))
 
 def cleanup_old_files():
-    """古いファイルをクリーンアップ（24時間以上前）"""
-    current_time = time.time()
-    cutoff_time = current_time - (24 * 60 * 60)  # 24時間前
-    
-    for directory in [UPLOAD_DIR, SEGMENTS_DIR, EXPORT_DIR]:
-        if os.path.exists(directory):
-            for file_path in Path(directory).glob("*"):
-                if file_path.is_file() and file_path.stat().st_mtime < cutoff_time:
-                    try:
-                        file_path.unlink()
-                        print(f"🗑️ Cleaned up old file: {file_path}")
-                    except Exception as e:
-                        print(f"⚠️ Failed to clean up {file_path}: {e}")
-
-# 起動時にクリーンアップ実行
-cleanup_old_files()
+    """古い動画をクリーンアップ（24時間以上前）"""
+    cutoff = datetime.utcnow() - timedelta(hours=24)
+    
+    db = SessionLocal()
+    try:
+        for video in db.query(Video).filter(Video.created_at < cutoff).all():
+            try:
+                delete_video(db, video)
+                logger.info("🗑️ Cleaned up old video", extra={"video_id": video.id})
+            except Exception as e:
+                db.rollback()
+                logger.warning("⚠️ Failed to clean up video: %s", e, extra={"video_id": video.id})
+    finally:
+        db.close()
+    storage.purge_trash()
+
+def cleanup_expired_uploads():
+    """放置されたアップロードセッションを削除"""
+    db = SessionLocal()
+    try:
+        expired = uploads.expire_sessions(db)
+        if expired:
+            logger.info("🗑️ Expired %d abandoned upload sessions", expired)
+    finally:
+        db.close()
+
+def count_progress(db: Session, video_id: int) -> dict:
+    """判定状況を集計（1クエリ）"""
+    rows = db.query(Segment.decision, func.count(Segment.id)).filter(
+        Segment.video_id == video_id
+    ).group_by(Segment.decision).all()
+    counts = {decision: count for decision, count in rows}
+    return {
+        "total": sum(counts.values()),
+        "kept": counts.get("keep", 0),
+        "dropped": counts.get("drop", 0),
+        "pending": counts.get("pending", 0)
+    }
+
+def create_video(db: Session, filename: str, **kwargs) -> Video:
+    """Video行を作成し、動画ごとのディレクトリ内に元動画のパスを割り当てる"""
+    video = Video(filename=filename, original_path="", **kwargs)
+    db.add(video)
+    db.flush()
+    video.original_path = storage.original_path(video.id, filename)
+    db.commit()
+    db.refresh(video)
+    logger.info("💾 Video record created", extra={"video_id": video.id})
+    return video
+
+def client_id(request: Request) -> str:
+    """ジョブの依頼元（X-Client-Idヘッダ、なければ接続元IP）"""
+    return request.headers.get("X-Client-Id") or (request.client.host if request.client else "unknown")
+
+def too_busy(e: jobs.Backpressure) -> HTTPException:
+    return HTTPException(status_code=429, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+
+def admit(db: Session, kind: str, client: str):
+    """待ち行列が混んでいれば429とRetry-Afterを返す（動画を保存する前に確認する）"""
+    try:
+        jobs.check_admission(db, kind, client)
+    except jobs.Backpressure as e:
+        raise too_busy(e)
+
+def enqueue_admitted(db: Session, request: Request, kind: str, video_id: int, payload: dict, dedupe_key: str) -> Job:
+    """受付制限を確認してジョブを登録（同じジョブが既にあれば混雑時でもそれを返す）"""
+    try:
+        return jobs.enqueue(db, kind, video_id, payload, dedupe_key=dedupe_key,
+                            client_id=client_id(request), admit=True)
+    except jobs.Backpressure as e:
+        raise too_busy(e)
+
+def enqueue_segmentation(db: Session, video: Video, chunk_sec: int, client: Optional[str] = None):
+    """元動画の保存完了を記録し、分割ジョブを登録（実際の分割はワーカーが行う）"""
+    video.chunk_sec = chunk_sec
+    video.set_status("uploaded")
+    library.original_stored(db, video)
+    job = jobs.enqueue(db, "segment", video.id, {"chunk_sec": chunk_sec}, dedupe_key=f"segment:{video.id}", client_id=client)
+    logger.info("📋 Segmentation job queued", extra={"video_id": video.id, "job_id": job.id})
+    return job
+
+def check_not_rechunking(db: Session, video_id: int):
+    """切り直し中の動画のセグメントは差し替えで消えるので、表示・判定・編集を409で断る"""
+    job = jobs.latest_job(db, "rechunk", video_id, ["running"])
+    if job:
+        raise HTTPException(status_code=409, detail=f"Video is being re-chunked (job {job.id})",
+                            headers={"Retry-After": "5", "Location": f"/api/jobs/{job.id}"})
+
+def job_event(job: Job) -> dict:
+    """SSEのjobイベント（stage: 画面表示用の段階）"""
+    stage = {"done": "ready", "running": "segmenting" if job.kind in ("segment", "rechunk") else "exporting"}.get(job.status, job.status)
+    return {**jobs.job_to_dict(job), "stage": stage}
+
+async def watch_jobs():
+    """ワーカーが更新したジョブの状態をSSE購読者へ中継（購読者がいるときだけDBを見る）"""
+    last_seen = datetime.utcnow()
+    reported = {}  # job_id -> 配信済みの完了セグメント数
+    while True:
+        await asyncio.sleep(JOB_WATCH_INTERVAL)
+        video_ids = event_bus.subscribed_video_ids()
+        if not video_ids:
+            last_seen = datetime.utcnow()
+            continue
+        db = SessionLocal()
+        try:
+            for job in jobs.changed_since(db, last_seen, video_ids):
+                last_seen = max(last_seen, job.updated_at)
+                event_bus.publish(job.video_id, "job", job_event(job))
+                if job.kind == "segment":
+                    for index in range(reported.get(job.id, 0), job.progress_done or 0):
+                        event_bus.publish(job.video_id, "segment_ready", {"index": index})
+                    reported[job.id] = job.progress_done or 0
+                if job.status in ("done", "failed"):
+                    reported.pop(job.id, None)
+                    if job.kind in ("segment", "rechunk"):
+                        event_bus.publish(job.video_id, "progress", count_progress(db, job.video_id))
+        except Exception as e:
+            logger.warning("⚠️ Job watcher error: %s", e)
+        finally:
+            db.close()
+
+async def refresh_google_tokens():
+    """Google Photosのアクセストークンを期限前に更新（リクエストの処理中に更新を待たせない）"""
+    import google_credentials
+    while True:
+        db = SessionLocal()
+        try:
+            refreshed = await asyncio.to_thread(google_credentials.refresh_due, db)
+            if refreshed:
+                logger.info("🔑 Refreshed %d Google Photos tokens", refreshed)
+        except Exception as e:
+            logger.warning("⚠️ Token refresh error: %s", e)
+        finally:
+            db.close()
+        await asyncio.sleep(google_credentials.REFRESH_INTERVAL)
+
+async def run_cleanup():
+    """古い動画・放置アップロードの掃除（起動をブロックしないようバックグラウンドで定期実行）"""
+    while True:
+        try:
+            await asyncio.to_thread(cleanup_old_files)
+            await asyncio.to_thread(cleanup_expired_uploads)
+        except Exception as e:
+            logger.warning("⚠️ Cleanup error: %s", e)
+        await asyncio.sleep(CLEANUP_INTERVAL)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """起動時の初期化と、バックグラウンドタスクの開始・停止"""
+    logger.info("🚀 SwipeCut API starting...", extra={"cwd": os.getcwd(), "port": os.getenv("PORT", "8000")})
+    with logs.stage(logger, "create_tables", logging.INFO):
+        await asyncio.to_thread(create_tables)
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    os.makedirs(STORAGE_DIR, exist_ok=True)
+    
+    tasks = [asyncio.create_task(watch_jobs()), asyncio.create_task(run_cleanup())]
+    if os.getenv("GOOGLE_PHOTOS_CLIENT_ID"):
+        tasks.append(asyncio.create_task(refresh_google_tokens()))
+    logger.info("✅ Application ready!")
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 # ヘルスチェック用のエンドポイント
-@app.get("/health")
+@router.get("/health")
 async def health_check():
-    import os
-    print(f"Health check called - Port: {os.getenv('PORT', '8000')}")
+    logger.debug("Health check called")
     return {
         "message": "SwipeCut API is running", 
         "status": "healthy",
         "port": os.getenv("PORT", "8000"),
         "frontend_exists": os.path.exists("frontend/dist"),
         "logo_exists": os.path.exists("frontend/dist/swipeout_logo.jpg"),
+        "ffmpeg_running": scheduler.running_count(),
+        "ffmpeg_max_concurrency": scheduler.MAX_CONCURRENCY,
         "timestamp": __import__("datetime").datetime.now().isoformat()
     }
 
 # デバッグ用：静的ファイル一覧
-@app.get("/debug/files")
+@router.get("/debug/files")
 async def debug_files():
     import os
     from pathlib import Path
@@ -112,179 +289,375 @@ async def debug_files():
     }
 
 # デバッグ用：APIエンドポイント一覧
-@app.get("/debug/endpoints")
+@router.get("/debug/endpoints")
 async def debug_endpoints():
     return {
         "endpoints": [
             {"path": "/health", "method": "GET"},
             {"path": "/api/upload", "method": "POST"},
+            {"path": "/api/uploads", "method": "POST"},
+            {"path": "/api/uploads/{upload_id}", "method": "HEAD/GET/PATCH/DELETE"},
+            {"path": "/api/uploads/{upload_id}/complete", "method": "POST"},
             {"path": "/api/next_segment", "method": "GET"},
             {"path": "/api/decide", "method": "POST"},
+            {"path": "/api/drop_flagged", "method": "POST"},
+            {"path": "/api/clusters", "method": "GET"},
             {"path": "/api/name", "method": "POST"},
+            {"path": "/api/trim", "method": "POST"},
             {"path": "/api/progress", "method": "GET"},
+            {"path": "/api/events", "method": "GET"},
             {"path": "/api/export", "method": "GET"},
             {"path": "/api/export_zip", "method": "GET"},
+            {"path": "/api/export_video", "method": "GET"},
+            {"path": "/api/jobs/{job_id}", "method": "GET"},
+            {"path": "/api/videos", "method": "GET"},
+            {"path": "/api/videos/{video_id}", "method": "DELETE"},
+            {"path": "/api/videos/{video_id}/rechunk", "method": "POST"},
+            {"path": "/api/admin/profiles", "method": "GET"},
+            {"path": "/api/admin/profiles/{profile_id}", "method": "GET"},
         ],
         "cors_origins": ALLOWED_ORIGINS,
         "upload_dir": UPLOAD_DIR,
-        "segments_dir": SEGMENTS_DIR
+        "storage_dir": STORAGE_DIR
     }
 
-# 静的ファイル配信（フロントエンド用）
-if os.path.exists("frontend/dist"):
-    print("📂 Mounting static files from frontend/dist")
-    
-    # ルートパスでフロントエンドのindex.htmlを配信
-    @app.get("/")
-    async def serve_frontend():
-        return FileResponse("frontend/dist/index.html")
-    
-    # 静的ファイルを /static パスで配信（APIルートより後にマウント）
-    app.mount("/static", StaticFiles(directory="frontend/dist"), name="static")
-    
-    print("✅ Static files mounted at /static")
-    print("✅ Frontend served at /")
-else:
-    print("❌ Frontend dist directory not found")
-    # フロントエンドがない場合のフォールバック
-    @app.get("/")
-    async def root():
-        return {"message": "SwipeCut API is running", "status": "healthy", "frontend": "not found"}
-
-@app.post("/api/upload")
+@router.post("/api/upload")
 async def upload_video(
+    request: Request,
     file: UploadFile = File(...),
     chunk_sec: int = Query(60, description="分割秒数"),
     db: Session = Depends(get_db)
 ):
     """動画アップロード＆分割"""
+    client = client_id(request)
+    admit(db, "segment", client)
     try:
-        print(f"📤 Upload started: {file.filename}, chunk_sec: {chunk_sec}")
-        print(f"📁 Upload directory: {UPLOAD_DIR}")
-        print(f"📁 Segments directory: {SEGMENTS_DIR}")
-        
-        # ディレクトリの存在確認と作成
-        if not os.path.exists(UPLOAD_DIR):
-            print(f"📁 Creating upload directory: {UPLOAD_DIR}")
-            os.makedirs(UPLOAD_DIR, exist_ok=True)
+        logger.info("📤 Upload started: %s", file.filename, extra={"chunk_sec": chunk_sec})
         
-        if not os.path.exists(SEGMENTS_DIR):
-            print(f"📁 Creating segments directory: {SEGMENTS_DIR}")
-            os.makedirs(SEGMENTS_DIR, exist_ok=True)
+        # データベースに記録（保存先は動画ごとのディレクトリ）
+        video = create_video(db, file.filename)
         
         # ファイル保存
-        file_path = os.path.join(UPLOAD_DIR, file.filename)
-        print(f"💾 Saving file to: {file_path}")
+        file_path = video.original_path
+        logger.debug("💾 Saving file to: %s", file_path, extra={"video_id": video.id})
         
         # 書き込み権限の確認
         try:
-            with open(file_path, "wb") as buffer:
-                content = await file.read()
-                buffer.write(content)
-            print(f"✅ File saved successfully, size: {len(content)} bytes")
+            started = time.perf_counter()
+            size = await profiling.to_thread(save_upload, file.file, file_path)
+            logger.info("✅ File saved successfully", extra={
+                "video_id": video.id, "size_bytes": size, "stage": "save_upload",
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)
+            })
         except PermissionError as e:
-            print(f"❌ Permission error: {e}")
+            logger.error("❌ Permission error: %s", e, extra={"video_id": video.id})
             raise HTTPException(status_code=500, detail=f"Permission denied: {str(e)}")
         except Exception as e:
-            print(f"❌ File save error: {e}")
+            logger.error("❌ File save error: %s", e, extra={"video_id": video.id})
             raise HTTPException(status_code=500, detail=f"File save failed: {str(e)}")
         
-        # データベースに記録
-        video = Video(filename=file.filename, original_path=file_path)
-        db.add(video)
-        db.commit()
-        db.refresh(video)
-        print(f"💾 Video record created: ID {video.id}")
-        
-        # 動画分割
-        print("🎬 Starting video segmentation...")
-        segments_data = split_video(file_path, SEGMENTS_DIR, chunk_sec)
-        print(f"✅ Video segmented into {len(segments_data)} segments")
+        # 動画分割（ワーカーに依頼）
+        job = enqueue_segmentation(db, video, chunk_sec, client)
         
-        # セグメントをデータベースに記録
-        for i, (start_sec, end_sec, segment_path) in enumerate(segments_data):
-            segment = Segment(
-                video_id=video.id,
-                index=i,
-                path=segment_path,
-                start_sec=start_sec,
-                end_sec=end_sec,
-                decision="pending"
-            )
-            db.add(segment)
-        
-        db.commit()
-        print("✅ All segments saved to database")
-        
-        return {"video_id": video.id, "segments_count": len(segments_data)}
+        return {"video_id": video.id, "segments_count": 0, "status": "queued", "job_id": job.id}
     
     except Exception as e:
-        print(f"❌ Upload error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ Upload error: %s", e)
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
-@app.get("/api/next_segment")
+def save_upload(source, path: str) -> int:
+    """受信したファイルをストレージに保存（S3ではマルチパートで送りながら書く）。サイズを返す"""
+    with blobstore.writer(path) as out:
+        shutil.copyfileobj(source, out, 1024 * 1024)
+    return os.path.getsize(path)
+
+# 再開可能なチャンクアップロード（tus方式）
+def upload_headers(session) -> dict:
+    ranges = uploads.get_ranges(session)
+    return {
+        "Upload-Offset": str(uploads.contiguous_offset(ranges)),
+        "Upload-Length": str(session.size),
+        "Cache-Control": "no-store"
+    }
+
+@router.post("/api/uploads")
+async def create_upload_session(
+    request: Request,
+    filename: str = Query(...),
+    size: int = Query(..., description="ファイルサイズ（バイト）"),
+    chunk_sec: int = Query(60, description="分割秒数"),
+    db: Session = Depends(get_db)
+):
+    """アップロードセッションを作成（混雑時は送信を始める前に429で断る）"""
+    admit(db, "segment", client_id(request))
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    uploads.expire_sessions(db)
+    try:
+        session = uploads.create_session(db, filename, size, chunk_sec, UPLOAD_DIR)
+    except uploads.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    logger.info("📤 Upload session created: %s", filename, extra={"upload_id": session.id, "size_bytes": size})
+    
+    return JSONResponse(
+        {
+            "upload_id": session.id,
+            "chunk_size": uploads.RECOMMENDED_CHUNK_SIZE,
+            "max_chunk_size": uploads.MAX_CHUNK_SIZE,
+            "expires_at": session.expires_at.isoformat()
+        },
+        status_code=201,
+        headers={"Location": f"/api/uploads/{session.id}", **upload_headers(session)}
+    )
+
+@router.head("/api/uploads/{upload_id}")
+async def get_upload_offset(upload_id: str, db: Session = Depends(get_db)):
+    """受信済みオフセットを返す（レスポンスヘッダのUpload-Offset）"""
+    try:
+        session = uploads.get_session(db, upload_id)
+    except uploads.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return Response(status_code=200, headers=upload_headers(session))
+
+@router.get("/api/uploads/{upload_id}")
+async def get_upload_status(upload_id: str, db: Session = Depends(get_db)):
+    """受信済みの範囲を返す（並列アップロードの再開用）"""
+    try:
+        session = uploads.get_session(db, upload_id)
+    except uploads.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    ranges = uploads.get_ranges(session)
+    return {
+        "upload_id": session.id,
+        "size": session.size,
+        "offset": uploads.contiguous_offset(ranges),
+        "received": uploads.received_bytes(ranges),
+        "ranges": ranges,
+        "status": session.status,
+        "video_id": session.video_id
+    }
+
+@router.patch("/api/uploads/{upload_id}")
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(..., alias="Upload-Offset"),
+    upload_checksum: Optional[str] = Header(None, alias="Upload-Checksum"),
+    db: Session = Depends(get_db)
+):
+    """チャンクを指定オフセットに書き込む（並列送信可）"""
+    try:
+        session = uploads.get_session(db, upload_id)
+        checksum = uploads.parse_checksum(upload_checksum)
+        await uploads.write_chunk(db, session, upload_offset, request.stream(), checksum)
+    except uploads.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return Response(status_code=204, headers=upload_headers(session))
+
+@router.post("/api/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str, request: Request, db: Session = Depends(get_db)):
+    """全チャンク受信後に動画を登録して分割（429の場合はRetry-After後に再度呼べばよい）"""
+    try:
+        session = uploads.get_session(db, upload_id)
+        if session.status == "completed" and session.video_id:
+            job = jobs.latest_job(db, "segment", session.video_id)
+            return {
+                "video_id": session.video_id,
+                "segments_count": count_progress(db, session.video_id)["total"],
+                "status": job.status if job else "done",
+                "job_id": job.id if job else None
+            }
+        uploads.check_complete(session)
+    except uploads.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    
+    client = client_id(request)
+    admit(db, "segment", client)
+    try:
+        video = create_video(db, session.filename)
+        uploads.finalize_session(db, session, video)
+        await profiling.to_thread(blobstore.publish, video.original_path)
+        
+        job = enqueue_segmentation(db, video, session.chunk_sec, client)
+        return {"video_id": video.id, "segments_count": 0, "status": "queued", "job_id": job.id}
+    except Exception as e:
+        logger.exception("❌ Upload error: %s", e)
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+
+@router.delete("/api/uploads/{upload_id}")
+async def abort_upload(upload_id: str, db: Session = Depends(get_db)):
+    """アップロードを中止して一時ファイルを削除"""
+    try:
+        session = uploads.get_session(db, upload_id)
+    except uploads.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    uploads.delete_session(db, session)
+    return Response(status_code=204)
+
+@router.get("/api/next_segment")
 async def get_next_segment(
     video_id: int = Query(...),
+    skip_flagged: bool = Query(False, description="無音・黒画面と判定されたセグメントを飛ばす"),
+    rendition: str = Query("full", regex="^(full|preview)$", description="preview: 早見プレビュー（作成済みの場合）"),
     db: Session = Depends(get_db)
 ):
-    """次の未判定セグメントを取得"""
-    segment = db.query(Segment).filter(
+    """次の未判定セグメントを取得
+    media_path・media_url は再生するファイル（rendition で選ぶ。プレビューが未作成なら元のセグメント）
+    path・url は常に元のセグメント（早見で気になったときだけ取得する）"""
+    check_not_rechunking(db, video_id)
+    query = db.query(Segment).filter(
         Segment.video_id == video_id,
         Segment.decision == "pending"
-    ).first()
+    )
+    if skip_flagged:
+        query = query.filter(or_(Segment.flagged.is_(None), Segment.flagged.is_(False)))
+    segment = query.order_by(Segment.index).first()
     
     if not segment:
         return {"done": True}
     
+    # 同じクラスタで未判定のセグメント数（1回のスワイプでまとめて判定できる）
+    cluster_pending = 0
+    if segment.dup_cluster is not None:
+        cluster_pending = db.query(func.count(Segment.id)).filter(
+            Segment.video_id == video_id,
+            Segment.dup_cluster == segment.dup_cluster,
+            Segment.decision == "pending"
+        ).scalar()
+
+    served = "preview" if rendition == "preview" and preview.is_ready(segment) else "full"
+    media_path = segment.preview_path if served == "preview" else segment.path
+    
     return {
         "done": False,
         "segment_id": segment.id,
         "index": segment.index,
         "path": segment.path,
+        "url": blobstore.url(segment.path),  # S3の場合は署名付きURL（アプリを経由せずに再生できる）
+        "rendition": served,
+        "media_path": media_path,
+        "media_url": blobstore.url(media_path),
         "start": segment.start_sec,
         "end": segment.end_sec,
-        "name": segment.name
+        "name": segment.name,
+        "trim_in": segment.trim_in,
+        "trim_out": segment.trim_out,
+        "loudness_db": segment.loudness_db,
+        "black_ratio": segment.black_ratio,
+        "motion": segment.motion,
+        "flagged": segment.flagged,
+        "cluster_id": segment.dup_cluster,
+        "cluster_pending": cluster_pending
     }
 
-@app.post("/api/decide")
+@router.post("/api/drop_flagged")
+async def drop_flagged_segments(
+    video_id: int = Query(...),
+    db: Session = Depends(get_db)
+):
+    """無音・黒画面と判定された未判定セグメントをまとめて捨てる"""
+    check_not_rechunking(db, video_id)
+    dropped = db.query(Segment).filter(
+        Segment.video_id == video_id,
+        Segment.decision == "pending",
+        Segment.flagged.is_(True)
+    ).update({"decision": "drop"}, synchronize_session=False)
+    library.pending_dropped(db, video_id, dropped)
+    db.commit()
+    if dropped and event_bus.has_subscribers(video_id):
+        event_bus.publish(video_id, "progress", count_progress(db, video_id))
+    
+    return {"status": "success", "dropped": dropped}
+
+@router.post("/api/decide")
 async def decide_segment(
     segment_id: int = Query(...),
     decision: str = Query(..., regex="^(keep|drop)$"),
+    cluster: bool = Query(False, description="類似セグメント（同じクラスタの未判定分）にも適用"),
     db: Session = Depends(get_db)
 ):
     """セグメント判定を保存"""
     segment = db.query(Segment).filter(Segment.id == segment_id).first()
     if not segment:
         raise HTTPException(status_code=404, detail="Segment not found")
+    check_not_rechunking(db, segment.video_id)
     
-    segment.decision = decision
+    targets = [segment]
+    if cluster and segment.dup_cluster is not None:
+        targets += db.query(Segment).filter(
+            Segment.video_id == segment.video_id,
+            Segment.dup_cluster == segment.dup_cluster,
+            Segment.decision == "pending",
+            Segment.id != segment.id
+        ).all()
+    library.set_decisions(db, segment.video_id, targets, decision)
+    decided = len(targets)
     db.commit()
+    if event_bus.has_subscribers(segment.video_id):
+        event_bus.publish(segment.video_id, "progress", count_progress(db, segment.video_id))
     
-    return {"status": "success"}
+    return {"status": "success", "decided": decided}
 
-@app.get("/api/progress")
-async def get_progress(
+@router.get("/api/clusters")
+async def get_duplicate_clusters(
     video_id: int = Query(...),
     db: Session = Depends(get_db)
 ):
-    """進捗状況を取得"""
-    segments = db.query(Segment).filter(Segment.video_id == video_id).all()
+    """類似セグメントのクラスタ一覧"""
+    rows = db.query(Segment.dup_cluster, Segment.id, Segment.index, Segment.decision).filter(
+        Segment.video_id == video_id,
+        Segment.dup_cluster.isnot(None)
+    ).order_by(Segment.dup_cluster, Segment.index).all()
     
-    total = len(segments)
-    kept = len([s for s in segments if s.decision == "keep"])
-    dropped = len([s for s in segments if s.decision == "drop"])
-    pending = len([s for s in segments if s.decision == "pending"])
+    clusters = {}
+    for cluster_id, segment_id, index, decision in rows:
+        clusters.setdefault(cluster_id, []).append({"segment_id": segment_id, "index": index, "decision": decision})
     
     return {
-        "total": total,
-        "kept": kept,
-        "dropped": dropped,
-        "pending": pending
+        "video_id": video_id,
+        "clusters": [
+            {"cluster_id": cluster_id, "size": len(members), "segments": members}
+            for cluster_id, members in clusters.items()
+        ]
     }
 
-@app.post("/api/name")
+@router.get("/api/progress")
+async def get_progress(
+    video_id: int = Query(...),
+    db: Session = Depends(get_db)
+):
+    """進捗状況を取得（分割の状態つき）"""
+    progress = count_progress(db, video_id)
+    video = db.query(Video).filter(Video.id == video_id).first()
+    if video:
+        progress["status"] = video.status
+        progress["segments_total"] = video.segments_total
+    return progress
+
+@router.get("/api/events")
+async def subscribe_events(
+    video_id: int = Query(...),
+    job_id: Optional[int] = Query(None, description="初期状態に含めるジョブ（完了を待っているジョブ）")
+):
+    """進捗・セグメント準備完了・ジョブ状況をServer-Sent Eventsでプッシュ
+    接続中ずっとDB接続を占有しないよう、初期状態だけ短いセッションで読んで閉じる（Depends(get_db)はストリーム終了まで閉じない）"""
+    db = SessionLocal()
+    try:
+        initial = [{"event": "progress", "data": count_progress(db, video_id)}]
+        watched = [jobs.latest_job(db, "segment", video_id)]
+        if job_id is not None:
+            # 接続前に終わったジョブは以降の変更として配信されないので、今の状態を送る
+            watched.append(db.query(Job).filter(Job.id == job_id, Job.video_id == video_id).first())
+        for job in {job.id: job for job in watched if job}.values():
+            initial.append({"event": "job", "data": job_event(job)})
+    finally:
+        db.close()
+    return StreamingResponse(
+        event_stream(video_id, initial),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/api/name")
 async def set_segment_name(
     segment_id: int = Query(...),
     name: str = Query(...),
@@ -294,13 +667,56 @@ async def set_segment_name(
     segment = db.query(Segment).filter(Segment.id == segment_id).first()
     if not segment:
         raise HTTPException(status_code=404, detail="Segment not found")
+    check_not_rechunking(db, segment.video_id)
     
     segment.name = name
     db.commit()
     
     return {"status": "success"}
 
-@app.get("/api/export")
+@router.post("/api/trim")
+async def trim_segment(
+    request: Request,
+    segment_id: int = Query(...),
+    trim_in: Optional[float] = Query(None, ge=0, description="イン点（セグメント先頭からの秒）"),
+    trim_out: Optional[float] = Query(None, gt=0, description="アウト点（セグメント先頭からの秒）"),
+    db: Session = Depends(get_db)
+):
+    """セグメントのイン・アウト点を設定（両方省略でトリム解除）。エクスポート時に適用される
+    （レンダリングはワーカーの trim ジョブが先に済ませておく）"""
+    segment = db.query(Segment).filter(Segment.id == segment_id).first()
+    if not segment:
+        raise HTTPException(status_code=404, detail="Segment not found")
+    check_not_rechunking(db, segment.video_id)
+    
+    length = segment.duration_sec or (segment.end_sec - segment.start_sec)
+    if (trim_in or 0) >= (trim_out if trim_out is not None else length):
+        raise HTTPException(status_code=400, detail="trim_in must be before trim_out")
+    if trim_out is not None and trim_out > length:
+        raise HTTPException(status_code=400, detail=f"trim_out exceeds segment length ({length:.2f}s)")
+    
+    old_seconds = library.kept_seconds(segment)
+    segment.trim_in = trim_in or None
+    segment.trim_out = trim_out if trim_out is not None and trim_out < length else None
+    segment.trim_size_bytes = None
+    segment.trim_crc32 = None
+    library.trim_changed(db, segment, old_seconds)
+    db.commit()
+    
+    # ワーカーがinteractiveの枠で先行レンダリング（混雑時はエクスポート時のレンダリングに任せる）
+    job = None
+    if trim.is_trimmed(segment):
+        try:
+            job = jobs.enqueue(db, "trim", segment.video_id, {"segment_id": segment.id},
+                               dedupe_key=f"trim:{segment.id}:{segment.trim_in}:{segment.trim_out}",
+                               client_id=client_id(request), admit=True)
+        except jobs.Backpressure:
+            pass
+    
+    return {"status": "success", "trim_in": segment.trim_in, "trim_out": segment.trim_out,
+            "job_id": job.id if job else None}
+
+@router.get("/api/export")
 async def export_kept_segments(
     video_id: int = Query(...),
     db: Session = Depends(get_db)
@@ -309,10 +725,12 @@ async def export_kept_segments(
     segments = db.query(Segment).filter(
         Segment.video_id == video_id,
         Segment.decision == "keep"
-    ).all()
+    ).order_by(Segment.index).all()
     
     manifest = {
         "video_id": video_id,
+        "total_bytes": sum((s.trim_size_bytes if trim.is_trimmed(s) else s.size_bytes) or 0 for s in segments),
+        "total_duration_sec": sum(trim.trimmed_duration(s) or (s.end_sec - s.start_sec) for s in segments),
         "segments": [
             {
                 "id": s.id,
@@ -320,145 +738,354 @@ async def export_kept_segments(
                 "name": s.name or f"segment_{s.index:03d}",
                 "start_sec": s.start_sec,
                 "end_sec": s.end_sec,
-                "path": s.path
+                "path": s.path,
+                "duration_sec": s.duration_sec,
+                "size_bytes": s.size_bytes,
+                "codec": s.codec,
+                "width": s.width,
+                "height": s.height,
+                "bitrate": s.bitrate,
+                "keyframe_count": s.keyframe_count,
+                "trim_in": s.trim_in,
+                "trim_out": s.trim_out,
+                "trimmed_duration_sec": trim.trimmed_duration(s)
             }
             for s in segments
         ]
     }
     
     # エクスポートディレクトリに保存
-    export_path = os.path.join(EXPORT_DIR, f"video_{video_id}_manifest.json")
+    os.makedirs(storage.export_dir(video_id), exist_ok=True)
+    export_path = os.path.join(storage.export_dir(video_id), "manifest.json")
     with open(export_path, "w") as f:
         json.dump(manifest, f, indent=2)
     
     return manifest
 
-@app.get("/api/export_zip")
+@router.get("/api/export_zip")
 async def export_zip(
+    request: Request,
     video_id: int = Query(...),
     db: Session = Depends(get_db)
 ):
-    """KeepされたセグメントをZIPで返す"""
+    """KeepされたセグメントをZIPで返す（未作成ならワーカーに作成を依頼して202を返す）"""
     segments = db.query(Segment).filter(
         Segment.video_id == video_id,
         Segment.decision == "keep"
-    ).all()
+    ).order_by(Segment.index).all()
     
     if not segments:
         raise HTTPException(status_code=404, detail="No kept segments found")
     
-    # ZIPファイル作成
-    zip_path = os.path.join(EXPORT_DIR, f"video_{video_id}_kept_segments.zip")
-    create_zip_archive(video_id, segments, zip_path)
+    # サイズとCRCがDBにあればZIPをその場でストリーミング（出力サイズも事前に確定）
+    # トリムされたセグメントはレンダリング済みの場合のみ（未レンダリングならワーカーに任せる）
+    # S3の場合はセグメントがこのマシンにあるとは限らないので、ワーカーが作ったZIPの署名付きURLを返す
+    if not blobstore.is_remote() and all(s.size_bytes is not None and s.crc32 is not None and trim.is_rendered(s) for s in segments):
+        entries = [
+            zipstream.ZipEntry(
+                trim.export_source(s),
+                f"{s.name or f'segment_{s.index:03d}'}.mp4",
+                s.trim_size_bytes if trim.is_trimmed(s) else s.size_bytes,
+                s.trim_crc32 if trim.is_trimmed(s) else s.crc32,
+                s.created_at
+            )
+            for s in segments
+        ]
+        filename = f"video_{video_id}_kept_segments.zip"
+        return StreamingResponse(
+            profiling.traced(zipstream.iter_archive(entries)),
+            media_type="application/zip",
+            headers={
+                "Content-Length": str(zipstream.archive_size(entries)),
+                "Content-Disposition": f'attachment; filename="{filename}"'
+            }
+        )
     
-    return FileResponse(
-        zip_path,
-        media_type="application/zip",
-        filename=f"video_{video_id}_kept_segments.zip"
+    fingerprint = export_fingerprint(segments)
+    zip_path = export_zip_path(video_id, fingerprint)
+    if await profiling.to_thread(blobstore.exists, zip_path):
+        url = blobstore.url(zip_path, f"video_{video_id}_kept_segments.zip")
+        if url:
+            return RedirectResponse(url, status_code=307)
+        return FileResponse(
+            zip_path,
+            media_type="application/zip",
+            filename=f"video_{video_id}_kept_segments.zip"
+        )
+    
+    # ZIP作成ジョブを登録
+    job = enqueue_admitted(db, request, "export", video_id, {"fingerprint": fingerprint}, f"export:{video_id}:{fingerprint}")
+    return JSONResponse(
+        {"status": job.status, "job_id": job.id},
+        status_code=202,
+        headers={"Retry-After": "2", "Location": f"/api/jobs/{job.id}"}
     )
 
-@app.get("/api/file")
+@router.get("/api/export_video")
+async def export_video(
+    request: Request,
+    video_id: int = Query(...),
+    db: Session = Depends(get_db)
+):
+    """Keepセグメントを index 順に連結した1本の動画（fragmented MP4）をストリーミング
+    （トリムのレンダリング・再エンコードが済んでいなければワーカーに準備を依頼して202を返す）"""
+    segments = db.query(Segment).filter(
+        Segment.video_id == video_id,
+        Segment.decision == "keep"
+    ).order_by(Segment.index).all()
+    
+    if not segments:
+        raise HTTPException(status_code=404, detail="No kept segments found")
+    
+    filename = f"video_{video_id}_kept.mp4"
+    fingerprint = export_fingerprint(segments)
+    if blobstore.is_remote():
+        # S3の場合はワーカーが連結して保存した動画の署名付きURLを返す
+        concat_path = concat.concat_path(video_id, fingerprint)
+        if await profiling.to_thread(blobstore.exists, concat_path):
+            return RedirectResponse(blobstore.url(concat_path, filename), status_code=307)
+    else:
+        paths = await profiling.to_thread(concat.prepared_sources, segments)
+        if paths is not None:
+            return StreamingResponse(
+                profiling.traced(concat.iter_concat(video_id, paths)),
+                media_type="video/mp4",
+                headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+            )
+    
+    # 連結の準備ジョブを登録
+    job = enqueue_admitted(db, request, "concat", video_id, {"fingerprint": fingerprint}, f"concat:{video_id}:{fingerprint}")
+    return JSONResponse(
+        {"status": job.status, "job_id": job.id},
+        status_code=202,
+        headers={"Retry-After": "2", "Location": f"/api/jobs/{job.id}"}
+    )
+
+@router.post("/api/videos/{video_id}/rechunk")
+async def rechunk_video(
+    video_id: int,
+    request: Request,
+    chunk_sec: Optional[int] = Query(None, ge=1, description="新しい分割秒数"),
+    cuts: Optional[str] = Query(None, description="カンマ区切りの分割位置（秒）"),
+    db: Session = Depends(get_db)
+):
+    """アップロード済みの元動画を新しい秒数（または任意の分割位置）で分割し直す"""
+    video = db.query(Video).filter(Video.id == video_id).first()
+    if not video:
+        raise HTTPException(status_code=404, detail="Video not found")
+    if video.status != "segmented":
+        raise HTTPException(status_code=409, detail=f"Video is not ready for re-chunking (status: {video.status})")
+    if (chunk_sec is None) == (cuts is None):
+        raise HTTPException(status_code=400, detail="Specify either chunk_sec or cuts")
+    
+    payload = {"chunk_sec": chunk_sec}
+    if cuts is not None:
+        try:
+            payload = {"cuts": parse_cut_points(cuts)}
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    # 切り直しは動画ごとに1つずつ（同じ指定なら実行待ちのジョブを返し、違う指定は断る）
+    pending = jobs.latest_job(db, "rechunk", video_id, ["queued", "running"])
+    if pending and json.loads(pending.payload or "{}") != payload:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Another re-chunk with different parameters is pending (job {pending.id})",
+            headers={"Location": f"/api/jobs/{pending.id}"}
+        )
+    job = enqueue_admitted(db, request, "rechunk", video_id, payload, f"rechunk:{video_id}")
+    return JSONResponse(
+        {"status": job.status, "job_id": job.id},
+        status_code=202,
+        headers={"Location": f"/api/jobs/{job.id}"}
+    )
+
+@router.get("/api/jobs/{job_id}")
+async def get_job(job_id: int, db: Session = Depends(get_db)):
+    """ジョブの状態を取得"""
+    job = db.query(jobs.Job).filter(jobs.Job.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return jobs.job_to_dict(job)
+
+@router.get("/api/videos")
+async def list_videos(
+    cursor: Optional[str] = Query(None, description="前のページのnext_cursor"),
+    limit: int = Query(20, ge=1, le=library.MAX_PAGE_SIZE),
+    source: Optional[str] = Query(None, regex="^(upload|google_photos|ingest)$"),
+    status: Optional[str] = Query(None, regex="^(uploading|uploaded|segmenting|segmented|failed)$"),
+    db: Session = Depends(get_db)
+):
+    """動画ライブラリ（新しい順、カーソルでページング）。集計値はVideoに保持しているのでセグメントは読まない"""
+    try:
+        videos, next_cursor = library.list_videos(db, limit, cursor, source, status)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"videos": [library.video_to_dict(v) for v in videos], "next_cursor": next_cursor}
+
+@router.delete("/api/videos/{video_id}")
+async def delete_video_endpoint(video_id: int, db: Session = Depends(get_db)):
+    """動画とそのセグメント・ファイルをまとめて削除"""
+    video = db.query(Video).filter(Video.id == video_id).first()
+    if not video:
+        raise HTTPException(status_code=404, detail="Video not found")
+    # S3の場合はプレフィックス配下の一覧・削除で待たされるのでイベントループの外で行う
+    await profiling.to_thread(delete_video, db, video)
+    return {"status": "success"}
+
+@router.get("/api/file")
 async def serve_file(path: str = Query(...)):
-    """ローカルファイル配信"""
+    """ファイル配信（S3の場合は署名付きURLへリダイレクト）"""
+    url = blobstore.url(path)
+    if url:
+        return RedirectResponse(url, status_code=307)
     if not os.path.exists(path):
         raise HTTPException(status_code=404, detail="File not found")
     
     return FileResponse(path)
 
+# プロファイル（PROFILE_ADMIN_TOKEN設定時のみ）
+def require_admin(x_admin_token: Optional[str] = Header(None, alias="X-Admin-Token")):
+    """管理トークンを確認（プロファイリングが無効なら404）"""
+    if not profiling.ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not profiling.is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@router.get("/api/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """直近のプロファイル一覧（Python・ffmpeg待ち・I/O待ちの時間の内訳つき）"""
+    return {"sample_rate": profiling.SAMPLE_RATE, "profiles": profiling.list_profiles()}
+
+@router.get("/api/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def download_profile(profile_id: int):
+    """プロファイルをfolded stacks形式でダウンロード（flamegraph.pl・speedscopeで表示できる）"""
+    profile = profiling.get_profile(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return Response(
+        profile.folded(),
+        media_type="text/plain",
+        headers={"Content-Disposition": f'attachment; filename="profile_{profile_id}.folded"'}
+    )
+
 # Google Photos連携エンドポイント
-@app.get("/api/google-photos/auth-url")
-async def get_google_photos_auth_url():
+@router.get("/api/google-photos/auth-url")
+async def get_google_photos_auth_url(request: Request):
     """Google Photos認証URLを取得"""
+    user_id = google_user(request)
     try:
-        auth_url = google_photos_client.get_authorization_url()
+        auth_url = get_google_photos().get_authorization_url(user_id)
         return {"auth_url": auth_url}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get auth URL: {str(e)}")
 
-@app.get("/api/google-photos/callback")
-async def google_photos_callback(code: str = Query(...)):
-    """Google Photos認証コールバック"""
+@router.get("/api/google-photos/callback")
+async def google_photos_callback(code: str = Query(...), state: str = Query(...), db: Session = Depends(get_db)):
+    """Google Photos認証コールバック（stateからユーザーを特定し、認証情報を保存）"""
     try:
-        success = google_photos_client.authenticate_with_code(code)
-        if success:
-            return {"status": "success", "message": "Google Photos認証が完了しました"}
-        else:
-            raise HTTPException(status_code=400, detail="Authentication failed")
+        get_google_photos().authenticate_with_code(db, state, code)
+        return {"status": "success", "message": "Google Photos認証が完了しました"}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid or expired state")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Authentication error: {str(e)}")
 
-@app.get("/api/google-photos/videos")
-async def get_google_photos_videos(page_size: int = Query(25, ge=1, le=100)):
+@router.get("/api/google-photos/videos")
+async def get_google_photos_videos(
+    request: Request,
+    page_size: int = Query(25, ge=1, le=100),
+    db: Session = Depends(get_db)
+):
     """Google Photosの動画リストを取得"""
+    google_photos = google_photos_client(db, request)
     try:
-        videos = google_photos_client.get_video_list(page_size)
+        videos = google_photos.get_video_list(page_size)
         return {"videos": videos}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get videos: {str(e)}")
 
-@app.post("/api/google-photos/download")
+@router.post("/api/google-photos/download")
 async def download_google_photos_video(
+    request: Request,
     media_item_id: str = Query(...),
     chunk_sec: int = Query(60, description="分割秒数"),
     db: Session = Depends(get_db)
 ):
     """Google Photosから動画をダウンロードして分割"""
+    client = client_id(request)
+    admit(db, "segment", client)
+    google_photos = google_photos_client(db, request)
     try:
-        print(f"📤 Google Photos download started: {media_item_id}, chunk_sec: {chunk_sec}")
+        logger.info("📤 Google Photos download started: %s", media_item_id, extra={"chunk_sec": chunk_sec})
         
         # 動画のメタデータを取得
-        metadata = google_photos_client.get_video_metadata(media_item_id)
+        metadata = google_photos.get_video_metadata(media_item_id)
         filename = metadata['filename']
         
-        # 動画をダウンロード
-        file_path = google_photos_client.download_video(media_item_id, filename, UPLOAD_DIR)
-        print(f"✅ Video downloaded: {file_path}")
+        # データベースに記録（保存先は動画ごとのディレクトリ）
+        video = create_video(db, filename, source="google_photos", source_id=media_item_id)
         
-        # データベースに記録
-        video = Video(
-            filename=filename, 
-            original_path=file_path,
-            source="google_photos",
-            source_id=media_item_id
-        )
-        db.add(video)
-        db.commit()
-        db.refresh(video)
-        print(f"💾 Video record created: ID {video.id}")
-        
-        # 動画分割
-        print("🎬 Starting video segmentation...")
-        segments_data = split_video(file_path, SEGMENTS_DIR, chunk_sec)
-        print(f"✅ Video segmented into {len(segments_data)} segments")
-        
-        # セグメントをデータベースに記録
-        for i, (start_sec, end_sec, segment_path) in enumerate(segments_data):
-            segment = Segment(
-                video_id=video.id,
-                index=i,
-                path=segment_path,
-                start_sec=start_sec,
-                end_sec=end_sec,
-                decision="pending"
-            )
-            db.add(segment)
+        # 動画をダウンロード
+        with logs.stage(logger, "google_photos_download", logging.INFO, video_id=video.id):
+            file_path = google_photos.download_video(media_item_id, os.path.basename(video.original_path), storage.original_dir(video.id))
+        await profiling.to_thread(blobstore.publish, file_path)
         
-        db.commit()
-        print("✅ All segments saved to database")
+        # 動画分割（ワーカーに依頼）
+        job = enqueue_segmentation(db, video, chunk_sec, client)
         
         return {
             "video_id": video.id, 
-            "segments_count": len(segments_data),
+            "segments_count": 0,
+            "status": "queued",
+            "job_id": job.id,
             "filename": filename,
             "metadata": metadata
         }
     
     except Exception as e:
-        print(f"❌ Google Photos download error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ Google Photos download error: %s", e)
         raise HTTPException(status_code=500, detail=f"Download failed: {str(e)}")
 
+def mount_frontend(app: FastAPI):
+    """静的ファイル配信（フロントエンド用）"""
+    if os.path.exists("frontend/dist"):
+        # ルートパスでフロントエンドのindex.htmlを配信
+        @app.get("/")
+        async def serve_frontend():
+            return FileResponse("frontend/dist/index.html")
+        
+        # 静的ファイルを /static パスで配信（APIルートより後にマウント）
+        app.mount("/static", StaticFiles(directory="frontend/dist"), name="static")
+    else:
+        # フロントエンドがない場合のフォールバック
+        @app.get("/")
+        async def root():
+            return {"message": "SwipeCut API is running", "status": "healthy", "frontend": "not found"}
+
+def create_app() -> FastAPI:
+    """アプリケーションを組み立てる（DB接続やファイル走査などの重い処理はlifespanで行う）"""
+    logs.setup()
+    app = FastAPI(title="SwipeCut API", version="1.0.0", lifespan=lifespan)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=ALLOWED_ORIGINS,
+        allow_credentials=True,
+        allow_methods=["GET", "POST", "PUT", "PATCH", "HEAD", "DELETE"],
+        allow_headers=["*"],
+        expose_headers=["Upload-Offset", "Upload-Length", "Location", "Retry-After", "X-Profile-Id", "X-Request-Id"],
+    )
+    # 無効時はミドルウェア自体を組み込まない（リクエストごとのオーバーヘッドなし）
+    if profiling.ENABLED:
+        app.add_middleware(profiling.ProfilingMiddleware)
+    # request_idをログに付ける（プロファイル中のリクエストも含めて一番外側）
+    app.add_middleware(logs.RequestIdMiddleware)
+    app.include_router(router)
+    mount_frontend(app)
+    return app
+
+app = create_app()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+既存DBのスキーマを現在のモデルに合わせて変換する
+  - segments.decision を文字列（'pending'/'keep'/'drop'）から整数（models.DECISIONS の順）に変換し、CHECK制約を付ける
+  - モデルに追加された列・インデックスを作成し、不要になったインデックスを削除する
+  - 追加された列の値を既存の動画について埋める（集計値と、分割済みの動画の状態）
+何度実行しても安全（変換済みのDBでは変換の要否を確認するだけで何もしない）。start.py がAPI・ワーカーの起動前に実行する
+
+使い方: python migrate_schema.py [--dry-run]
+"""
+import argparse
+
+from sqlalchemy import inspect, text
+
+from db import SessionLocal, add_missing_columns, add_missing_indexes, engine, needs_schema_migration
+from library import backfill_stats
+from models import Base, DECISION_CODES, Segment
+
+# 複合インデックスに置き換えたインデックス
+OBSOLETE_INDEXES = ["ix_segments_dup_cluster"]
+
+DECISION_SQL = "CASE decision {} ELSE 0 END".format(
+    " ".join(f"WHEN '{decision}' THEN {code}" for decision, code in DECISION_CODES.items())
+)
+
+
+def convert_sqlite(conn):
+    """SQLiteは列の型を変えられないので、テーブルを作り直して行をコピーする"""
+    inspector = inspect(conn)
+    old_columns = {column["name"] for column in inspector.get_columns("segments")}
+    for index in inspector.get_indexes("segments"):
+        conn.execute(text(f'DROP INDEX "{index["name"]}"'))
+    conn.execute(text("ALTER TABLE segments RENAME TO segments_old"))
+    Segment.__table__.create(conn)
+    columns = [f'"{column.name}"' for column in Segment.__table__.columns if column.name in old_columns]
+    select = [DECISION_SQL if name == '"decision"' else name for name in columns]
+    conn.execute(text(f"INSERT INTO segments ({', '.join(columns)}) SELECT {', '.join(select)} FROM segments_old"))
+    conn.execute(text("DROP TABLE segments_old"))
+
+
+def convert_other(conn):
+    """PostgreSQLなどは列の型をその場で変換する"""
+    conn.execute(text("ALTER TABLE segments ALTER COLUMN decision DROP DEFAULT"))
+    conn.execute(text(f"ALTER TABLE segments ALTER COLUMN decision TYPE SMALLINT USING {DECISION_SQL}"))
+    conn.execute(text("ALTER TABLE segments ALTER COLUMN decision SET NOT NULL"))
+    conn.execute(text(
+        f"ALTER TABLE segments ADD CONSTRAINT ck_segments_decision CHECK (decision IN ({', '.join(map(str, DECISION_CODES.values()))}))"
+    ))
+
+
+def migrate(dry_run: bool = False) -> bool:
+    """変換が必要なら変換する（変換したらTrue）。変換済みのDBでは何もしない（起動のたびに実行されるため）"""
+    Base.metadata.create_all(bind=engine)
+    if not needs_schema_migration():
+        print("✅ Schema is up to date")
+        return False
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT COUNT(*) FROM segments")).scalar()
+    print(f"🔄 Converting segments.decision to integer ({rows} rows, {engine.dialect.name})")
+    existing = {index["name"] for index in inspect(engine).get_indexes("segments")}
+    obsolete = [name for name in OBSOLETE_INDEXES if name in existing]
+    for name in obsolete:
+        print(f"🧹 Dropping index {name}")
+    if dry_run:
+        print("✅ Dry run, nothing changed")
+        return False
+
+    add_missing_columns()
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            # テーブルを作り直すとインデックスも作り直される
+            convert_sqlite(conn)
+        else:
+            convert_other(conn)
+            for name in obsolete:
+                conn.execute(text(f'DROP INDEX "{name}"'))
+    add_missing_indexes()
+    db = SessionLocal()
+    try:
+        backfilled = backfill_stats(db)
+    finally:
+        db.close()
+    if backfilled:
+        print(f"📊 Backfilled library stats of {backfilled} videos")
+    if engine.dialect.name == "sqlite":
+        # 作り直す前のテーブルの領域を解放（DB全体を書き直すので、変換したときだけ）
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM"))
+    print("✅ Schema is up to date")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate the database schema to the current models")
+    parser.add_argument("--dry-run", action="store_true", help="変換せずに計画だけ表示")
+    args = parser.parse_args()
+    migrate(args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
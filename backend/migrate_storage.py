@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+旧フラットレイアウト（UPLOAD_DIR/<ファイル名>, SEGMENTS_DIR/<stem>_segment_NNN.mp4）から
+動画ごとのディレクトリ（storage.py）へファイルを移動し、DBのパスを書き換える
+何度実行しても安全（移行済みの行はスキップ）
+
+使い方: python migrate_storage.py [--dry-run]
+"""
+import argparse
+import os
+import shutil
+from collections import Counter
+
+from db import SessionLocal, create_tables
+from models import Video, Segment
+import storage
+
+
+def move_file(source: str, target: str, keep_source: bool, dry_run: bool) -> bool:
+    """ファイルを移動（他の行からも参照されている場合はコピーを残す）"""
+    if not os.path.exists(source):
+        print(f"⚠️ Missing file, skipped: {source}")
+        return False
+    print(f"  {'copy' if keep_source else 'move'} {source} -> {target}")
+    if dry_run:
+        return True
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if keep_source:
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+    else:
+        shutil.move(source, target)
+    return True
+
+
+def migrate(dry_run: bool = False):
+    create_tables()
+    db = SessionLocal()
+    try:
+        # 同名ファイルの上書きで複数の行が同じファイルを指している場合がある
+        original_refs = Counter(path for (path,) in db.query(Video.original_path).all())
+        segment_refs = Counter(path for (path,) in db.query(Segment.path).all())
+        migrated = 0
+
+        for video in db.query(Video).order_by(Video.id).all():
+            changed = False
+            if video.original_path and not storage.is_in_layout(video.original_path, video.id):
+                source = video.original_path
+                target = storage.original_path(video.id, source) if not dry_run else os.path.join(
+                    storage.original_dir(video.id), os.path.basename(source))
+                original_refs[source] -= 1
+                if move_file(source, target, original_refs[source] > 0, dry_run):
+                    video.original_path = target
+                    changed = True
+
+            segments = db.query(Segment).filter(Segment.video_id == video.id).all()
+            for segment in segments:
+                if storage.is_in_layout(segment.path, video.id):
+                    continue
+                source = segment.path
+                target = os.path.join(storage.segments_dir(video.id), os.path.basename(source))
+                segment_refs[source] -= 1
+                if move_file(source, target, segment_refs[source] > 0, dry_run):
+                    segment.path = target
+                    changed = True
+
+            if changed:
+                migrated += 1
+                if not dry_run:
+                    # 1動画ずつコミットするので、途中で止めても再実行で続きから移行できる
+                    db.commit()
+
+        if dry_run:
+            db.rollback()
+        print(f"✅ {'Would migrate' if dry_run else 'Migrated'} {migrated} videos")
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate flat storage layout to per-video directories")
+    parser.add_argument("--dry-run", action="store_true", help="移動せずに計画だけ表示")
+    args = parser.parse_args()
+    migrate(args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
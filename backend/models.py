@@ -1,21 +1,78 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import (
+    Column, Integer, String, Float, ForeignKey, DateTime, BigInteger, Text, Boolean, Index, SmallInteger,
+    CheckConstraint
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime
 
 Base = declarative_base()
 
+# 判定の値と保存する整数（順番を変えないこと）
+DECISIONS = ("pending", "keep", "drop")
+DECISION_CODES = {decision: code for code, decision in enumerate(DECISIONS)}
+
+class Decision(TypeDecorator):
+    """判定を小さな整数で保存する型（Python側・クエリでは "pending"/"keep"/"drop" のまま扱える）"""
+    impl = SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else DECISION_CODES[value]
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else DECISIONS[value]
+
 class Video(Base):
     __tablename__ = "videos"
     
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String, nullable=False)
     original_path = Column(String, nullable=False)
-    source = Column(String, default="upload")  # upload, google_photos
-    source_id = Column(String, nullable=True)  # Google Photos media item ID
+    source = Column(String, default="upload")  # upload, google_photos, ingest
+    source_id = Column(String, nullable=True)  # Google Photos media item ID / 取り込み元のパス（ingest）
+    content_hash = Column(String, nullable=True, index=True)  # 元動画のSHA-256（一括取り込みの重複判定）
     created_at = Column(DateTime, default=datetime.utcnow)
     
+    # 分割の状態（VIDEO_TRANSITIONS の順に遷移する）
+    status = Column(String, default="uploading", index=True)
+    chunk_sec = Column(Integer, nullable=True)  # 分割に使った秒数（再開時に同じ境界で切るため）
+    segments_total = Column(Integer, nullable=True)  # 分割後のセグメント数（分割前はNone）
+    
+    # ライブラリ一覧用の集計値（library.py が差分で更新する。Noneは集計列の追加前に作られた動画）
+    segment_count = Column(Integer, nullable=True, default=0)
+    kept_count = Column(Integer, nullable=True, default=0)
+    dropped_count = Column(Integer, nullable=True, default=0)
+    kept_duration_sec = Column(Float, nullable=True, default=0.0)  # トリム後の長さの合計
+    storage_bytes = Column(BigInteger, nullable=True, default=0)  # 元動画＋セグメントのサイズ
+    
     segments = relationship("Segment", back_populates="video")
+    
+    # ライブラリ一覧のキーセットページング用（新しい順、source・statusでの絞り込み）
+    __table_args__ = (
+        Index("ix_videos_created_id", "created_at", "id"),
+        Index("ix_videos_source_created_id", "source", "created_at", "id"),
+        Index("ix_videos_status_created_id", "status", "created_at", "id"),
+    )
+    
+    def set_status(self, status: str):
+        """状態を遷移（許可されていない遷移はValueError）"""
+        current = self.status or "uploading"
+        if status != current and status not in VIDEO_TRANSITIONS.get(current, ()):
+            raise ValueError(f"Invalid video status transition: {current} -> {status}")
+        self.status = status
+
+# uploading: 元動画を保存中 / uploaded: 保存が完了し分割待ち
+# segmenting: 分割中（中断しても続きから再開できる）/ segmented: 全セグメントの分割完了
+# failed: 再試行を使い切って失敗
+VIDEO_TRANSITIONS = {
+    "uploading": ("uploaded",),
+    "uploaded": ("segmenting",),
+    "segmenting": ("segmented", "failed"),
+    "segmented": ("segmenting",),
+    "failed": ("segmenting",),
+}
 
 class Segment(Base):
     __tablename__ = "segments"
@@ -26,8 +83,87 @@ class Segment(Base):
     path = Column(String, nullable=False)
     start_sec = Column(Float, nullable=False)
     end_sec = Column(Float, nullable=False)
-    decision = Column(String, default="pending")  # pending, keep, drop
+    decision = Column(Decision, nullable=False, default="pending")  # pending, keep, drop
     name = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
+    # 分割時に取得したメタデータ（エクスポート時にファイルを見に行かないため）
+    size_bytes = Column(BigInteger, nullable=True)
+    crc32 = Column(BigInteger, nullable=True)
+    duration_sec = Column(Float, nullable=True)  # 実際の長さ（キーフレーム境界でstart/endとずれる）
+    codec = Column(String, nullable=True)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    bitrate = Column(Integer, nullable=True)  # bps
+    keyframe_count = Column(Integer, nullable=True)
+    
+    # 音声・映像解析のスコア（analysis.py）
+    loudness_db = Column(Float, nullable=True)
+    black_ratio = Column(Float, nullable=True)
+    motion = Column(Float, nullable=True)
+    flagged = Column(Boolean, nullable=True)  # 無音・黒画面と判定されたセグメント
+    phash = Column(String, nullable=True)  # 知覚ハッシュ（phash.py）
+    dup_cluster = Column(Integer, nullable=True)  # 類似セグメントのクラスタ（先頭セグメントのID）
+    
+    # トリム（セグメント先頭からの秒。Noneなら端まで）とレンダリング結果（trim.py）
+    trim_in = Column(Float, nullable=True)
+    trim_out = Column(Float, nullable=True)
+    trim_size_bytes = Column(BigInteger, nullable=True)
+    trim_crc32 = Column(BigInteger, nullable=True)
+    
+    # 早見プレビュー（早回し・低解像度・音声なし。preview.py）
+    preview_path = Column(String, nullable=True)
+    
     video = relationship("Video", back_populates="segments")
+    
+    __table_args__ = (
+        CheckConstraint(f"decision IN ({', '.join(str(code) for code in DECISION_CODES.values())})", name="ck_segments_decision"),
+        # 次の未判定・Keep一覧（index順）・判定ごとの件数（video_id, decision だけで済むのでインデックスのみで集計）
+        Index("ix_segments_video_decision_index", "video_id", "decision", "index"),
+        # クラスタ内の未判定セグメント
+        Index("ix_segments_video_cluster_decision", "video_id", "dup_cluster", "decision"),
+    )
+
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+    
+    id = Column(String, primary_key=True)  # アップロードID（UUID）
+    filename = Column(String, nullable=False)
+    temp_path = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    chunk_sec = Column(Integer, default=60)
+    received = Column(Text, default="[]")  # 受信済みバイト範囲 [[start, end], ...] のJSON
+    status = Column(String, default="uploading")  # uploading, completed
+    video_id = Column(Integer, ForeignKey("videos.id"), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+class Job(Base):
+    __tablename__ = "jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)  # segment, analyze, rechunk, preview, export, concat, trim
+    video_id = Column(Integer, ForeignKey("videos.id"), nullable=False, index=True)
+    payload = Column(Text, default="{}")  # JSON
+    dedupe_key = Column(String, nullable=True, index=True)  # 同一内容のジョブを重複登録しないためのキー
+    status = Column(String, default="queued", index=True)  # queued, running, done, failed
+    priority = Column(Integer, default=1, index=True)  # 小さいほど先に実行（scheduler.KIND_PRIORITY）
+    client_id = Column(String, nullable=True, index=True)  # 依頼元（クライアントごとの同時実行数の制限用）
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    lease_owner = Column(String, nullable=True)  # 実行中のワーカーID
+    lease_expires_at = Column(DateTime, nullable=True)
+    progress_done = Column(Integer, default=0)
+    progress_total = Column(Integer, default=0)
+    result = Column(Text, nullable=True)  # JSON
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class GoogleCredential(Base):
+    __tablename__ = "google_credentials"
+    
+    user_id = Column(String, primary_key=True)  # X-Client-Id
+    encrypted = Column(Text, nullable=False)  # 認証情報のJSONをFernetで暗号化したもの
+    expires_at = Column(DateTime, nullable=True, index=True)  # アクセストークンの期限（UTC。事前更新の対象を引く）
+    updated_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,372 @@
+"""
+MP4/MOV（ISO-BMFF）コンテナのインデックスを読むパーサ
+ffprobeを起動せずに moov ボックスだけをシークで読み取り、
+再生時間・トラックのタイムスケール・キーフレーム（stss）・サンプルオフセットを取得する
+キーフレームの時刻はffmpegのpts_timeと同じく、編集リスト（elst）とコンポジション時刻のずれ（ctts）を反映する
+"""
+import os
+import struct
+from bisect import bisect_left
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+# このパーサで扱う拡張子（それ以外はffprobeにフォールバック）
+MP4_EXTENSIONS = {".mp4", ".mov", ".m4v", ".3gp"}
+
+# moov内で子ボックスを持つコンテナ
+_CONTAINER_BOXES = {b"trak", b"mdia", b"minf", b"stbl", b"edts", b"mvex"}
+
+# moovの読み取り上限（壊れたファイルで巨大な読み込みをしないため）
+_MAX_MOOV_SIZE = 256 * 1024 * 1024
+
+
+class Mp4ParseError(Exception):
+    """ISO-BMFFとして解釈できない場合の例外"""
+
+
+class Track:
+    """1トラック分のサンプルテーブル"""
+
+    def __init__(self):
+        self.track_id = 0
+        self.handler = ""  # vide, soun など
+        self.timescale = 0
+        self.duration = 0  # mdhd（トラックのタイムスケール単位）
+        self.codec = ""  # avc1, hvc1, mp4a など
+        self.width = 0
+        self.height = 0
+        self.stts: List[Tuple[int, int]] = []  # (sample_count, sample_delta)
+        self.ctts: List[Tuple[int, int]] = []  # (sample_count, composition_offset)。Bフレームがあるとき
+        self.edits: List[Tuple[int, int]] = []  # elst (segment_duration（ムービーのタイムスケール単位）, media_time)
+        self.movie_timescale = 0
+        self.stss: Optional[List[int]] = None  # 1始まりのサンプル番号（Noneは全サンプルがキーフレーム）
+        self.stsc: List[Tuple[int, int]] = []  # (first_chunk, samples_per_chunk)
+        self.stsz: List[int] = []
+        self.chunk_offsets: List[int] = []
+        self._sample_offsets: Optional[List[int]] = None
+        self._sample_times: Optional[List[int]] = None
+        self._composition_offsets: Optional[List[int]] = None
+
+    @property
+    def sample_count(self) -> int:
+        return len(self.stsz)
+
+    @property
+    def duration_sec(self) -> float:
+        return self.duration / self.timescale if self.timescale else 0.0
+
+    @property
+    def sample_times(self) -> List[int]:
+        """各サンプルのデコード時刻（タイムスケール単位）。初回アクセス時に展開"""
+        if self._sample_times is None:
+            times = []
+            t = 0
+            for count, delta in self.stts:
+                for _ in range(count):
+                    times.append(t)
+                    t += delta
+            self._sample_times = times
+        return self._sample_times
+
+    @property
+    def composition_offsets(self) -> List[int]:
+        """各サンプルの表示時刻とデコード時刻の差（タイムスケール単位）。cttsがなければすべて0"""
+        if self._composition_offsets is None:
+            offsets = []
+            for count, offset in self.ctts:
+                offsets.extend([offset] * count)
+            offsets.extend([0] * (self.sample_count - len(offsets)))
+            self._composition_offsets = offsets
+        return self._composition_offsets
+
+    @property
+    def presentation_shift(self) -> float:
+        """表示時刻（秒）への補正。先頭の空の編集の長さを足し、最初の編集のmedia_timeを引く
+        （Bフレームのある動画はmedia_timeでcttsの分を打ち消すので、補正しないとキーフレームが後ろにずれる）"""
+        shift = 0.0
+        for segment_duration, media_time in self.edits:
+            if media_time == -1:
+                if self.movie_timescale:
+                    shift += segment_duration / self.movie_timescale
+                continue
+            if self.timescale:
+                shift -= media_time / self.timescale
+            break
+        return shift
+
+    @property
+    def start_time(self) -> Optional[float]:
+        """最初に表示されるサンプルの表示時刻（秒）。サンプルがなければNone"""
+        if not self.timescale or not self.sample_count:
+            return None
+        first = min(t + o for t, o in zip(self.sample_times, self.composition_offsets))
+        return first / self.timescale + self.presentation_shift
+
+    @property
+    def sample_offsets(self) -> List[int]:
+        """各サンプルのファイル内バイトオフセット。初回アクセス時に展開"""
+        if self._sample_offsets is None:
+            offsets = []
+            sizes = self.stsz
+            sample = 0
+            n_chunks = len(self.chunk_offsets)
+            for i, (first_chunk, per_chunk) in enumerate(self.stsc):
+                last_chunk = self.stsc[i + 1][0] - 1 if i + 1 < len(self.stsc) else n_chunks
+                for chunk in range(first_chunk - 1, last_chunk):
+                    pos = self.chunk_offsets[chunk]
+                    for _ in range(per_chunk):
+                        if sample >= len(sizes):
+                            break
+                        offsets.append(pos)
+                        pos += sizes[sample]
+                        sample += 1
+            self._sample_offsets = offsets
+        return self._sample_offsets
+
+    @property
+    def sync_samples(self) -> List[int]:
+        """キーフレームのサンプル番号（0始まり）"""
+        if self.stss is None:
+            return list(range(self.sample_count))
+        return [n - 1 for n in self.stss]
+
+    def keyframe_times(self) -> List[float]:
+        """キーフレームの表示時刻（秒、ffprobeのpts_timeと同じ）"""
+        if not self.timescale:
+            return []
+        times = self.sample_times
+        offsets = self.composition_offsets
+        shift = self.presentation_shift
+        return sorted(
+            (times[n] + offsets[n]) / self.timescale + shift for n in self.sync_samples if n < len(times)
+        )
+
+    def keyframe_before(self, sec: float) -> float:
+        """指定秒以前で最も近いキーフレーム時刻"""
+        keyframes = self.keyframe_times()
+        if not keyframes:
+            return 0.0
+        i = bisect_left(keyframes, sec + 1e-6)
+        return keyframes[max(0, i - 1)]
+
+
+class Mp4Index:
+    """moovボックスから得たコンテナ全体のインデックス"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.timescale = 0
+        self.duration = 0  # mvhd（ムービーのタイムスケール単位）
+        self.fragment_duration = 0  # mvex/mehd（fragmented MP4用）
+        self.tracks: List[Track] = []
+
+    @property
+    def duration_sec(self) -> float:
+        if not self.timescale:
+            return 0.0
+        duration = self.duration or self.fragment_duration
+        return duration / self.timescale
+
+    @property
+    def video_track(self) -> Optional[Track]:
+        for track in self.tracks:
+            if track.handler == "vide":
+                return track
+        return None
+
+    @property
+    def audio_track(self) -> Optional[Track]:
+        for track in self.tracks:
+            if track.handler == "soun":
+                return track
+        return None
+
+    @property
+    def start_time(self) -> float:
+        """ファイルの開始時刻（ffprobeのformat start_time。ffmpegの -ss はここからの秒数）"""
+        starts = [t.start_time for t in self.tracks if t.start_time is not None]
+        return min(starts) if starts else 0.0
+
+    def keyframe_times(self) -> List[float]:
+        track = self.video_track
+        return track.keyframe_times() if track else []
+
+
+def _read_box_header(f, end: int) -> Optional[Tuple[bytes, int, int]]:
+    """ボックスヘッダを読み (type, ペイロード開始位置, ボックス終端) を返す"""
+    start = f.tell()
+    if start + 8 > end:
+        return None
+    header = f.read(8)
+    if len(header) < 8:
+        return None
+    size, box_type = struct.unpack(">I4s", header)
+    header_size = 8
+    if size == 1:
+        size = struct.unpack(">Q", f.read(8))[0]
+        header_size = 16
+    elif size == 0:
+        size = end - start
+    if size < header_size:
+        raise Mp4ParseError(f"Invalid box size for {box_type!r}")
+    return box_type, start + header_size, start + size
+
+
+def _find_moov(f, file_size: int) -> bytes:
+    """トップレベルのボックスを辿り、moovのペイロードだけを読む（mdatは読み飛ばす）"""
+    f.seek(0)
+    while True:
+        header = _read_box_header(f, file_size)
+        if header is None:
+            raise Mp4ParseError("moov box not found")
+        box_type, payload_start, box_end = header
+        if box_type == b"moov":
+            size = box_end - payload_start
+            if size > _MAX_MOOV_SIZE:
+                raise Mp4ParseError("moov box too large")
+            data = f.read(size)
+            if len(data) < size:
+                raise Mp4ParseError("Truncated moov box")
+            return data
+        f.seek(box_end)
+
+
+def _iter_boxes(data: bytes, start: int, end: int):
+    """メモリ上のボックス列を (type, ペイロード開始, 終端) で列挙"""
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, pos)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, pos + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size or pos + size > end:
+            raise Mp4ParseError(f"Invalid box size for {box_type!r}")
+        yield box_type, pos + header_size, pos + size
+        pos += size
+
+
+def _full_box_version(data: bytes, pos: int) -> int:
+    return data[pos]
+
+
+def _parse_mvhd(index: Mp4Index, data: bytes, pos: int):
+    if _full_box_version(data, pos) == 1:
+        index.timescale, index.duration = struct.unpack_from(">IQ", data, pos + 20)
+    else:
+        index.timescale, index.duration = struct.unpack_from(">II", data, pos + 12)
+
+
+def _parse_mdhd(track: Track, data: bytes, pos: int):
+    if _full_box_version(data, pos) == 1:
+        track.timescale, track.duration = struct.unpack_from(">IQ", data, pos + 20)
+    else:
+        track.timescale, track.duration = struct.unpack_from(">II", data, pos + 12)
+
+
+def _parse_stsd(track: Track, data: bytes, pos: int):
+    entry_count = struct.unpack_from(">I", data, pos + 4)[0]
+    if entry_count == 0:
+        return
+    entry = pos + 8
+    track.codec = data[entry + 4:entry + 8].decode("latin-1")
+    if track.handler == "vide":
+        # VisualSampleEntry: 8バイトのSampleEntry + 16バイトの予約領域の後に width/height
+        track.width, track.height = struct.unpack_from(">HH", data, entry + 8 + 24)
+
+
+def _parse_table(data: bytes, pos: int, fmt: str) -> List:
+    count = struct.unpack_from(">I", data, pos + 4)[0]
+    item = struct.Struct(">" + fmt)
+    return [item.unpack_from(data, pos + 8 + i * item.size) for i in range(count)]
+
+
+def _parse_stsz(track: Track, data: bytes, pos: int):
+    sample_size, count = struct.unpack_from(">II", data, pos + 4)
+    if sample_size:
+        track.stsz = [sample_size] * count
+    else:
+        track.stsz = list(struct.unpack_from(f">{count}I", data, pos + 12))
+
+
+def _parse_track(data: bytes, start: int, end: int) -> Track:
+    track = Track()
+
+    def walk(s: int, e: int):
+        for box_type, payload, box_end in _iter_boxes(data, s, e):
+            if box_type in _CONTAINER_BOXES:
+                walk(payload, box_end)
+            elif box_type == b"tkhd":
+                offset = 20 if _full_box_version(data, payload) == 1 else 12
+                track.track_id = struct.unpack_from(">I", data, payload + offset)[0]
+            elif box_type == b"mdhd":
+                _parse_mdhd(track, data, payload)
+            elif box_type == b"hdlr":
+                track.handler = data[payload + 8:payload + 12].decode("latin-1")
+            elif box_type == b"stsd":
+                _parse_stsd(track, data, payload)
+            elif box_type == b"stts":
+                track.stts = _parse_table(data, payload, "II")
+            elif box_type == b"ctts":
+                # version 0 でも負のオフセットを書くエンコーダがあるので、ffmpegと同じく常に符号付きで読む
+                track.ctts = _parse_table(data, payload, "Ii")
+            elif box_type == b"elst":
+                fmt = "Qqhh" if _full_box_version(data, payload) == 1 else "Iihh"
+                track.edits = [(duration, media_time) for duration, media_time, _, _ in _parse_table(data, payload, fmt)]
+            elif box_type == b"stss":
+                track.stss = [n for (n,) in _parse_table(data, payload, "I")]
+            elif box_type == b"stsc":
+                track.stsc = [(first, per) for first, per, _ in _parse_table(data, payload, "III")]
+            elif box_type == b"stsz":
+                _parse_stsz(track, data, payload)
+            elif box_type == b"stco":
+                track.chunk_offsets = [n for (n,) in _parse_table(data, payload, "I")]
+            elif box_type == b"co64":
+                track.chunk_offsets = [n for (n,) in _parse_table(data, payload, "Q")]
+
+    walk(start, end)
+    return track
+
+
+def _parse_moov(path: str, data: bytes) -> Mp4Index:
+    index = Mp4Index(path)
+    for box_type, payload, box_end in _iter_boxes(data, 0, len(data)):
+        if box_type == b"mvhd":
+            _parse_mvhd(index, data, payload)
+        elif box_type == b"trak":
+            index.tracks.append(_parse_track(data, payload, box_end))
+        elif box_type == b"mvex":
+            for child, child_payload, _ in _iter_boxes(data, payload, box_end):
+                if child == b"mehd":
+                    fmt = ">Q" if _full_box_version(data, child_payload) == 1 else ">I"
+                    index.fragment_duration = struct.unpack_from(fmt, data, child_payload + 4)[0]
+    for track in index.tracks:
+        track.movie_timescale = index.timescale
+    return index
+
+
+@lru_cache(maxsize=256)
+def _load_index(path: str, mtime_ns: int, size: int) -> Mp4Index:
+    try:
+        with open(path, "rb") as f:
+            data = _find_moov(f, size)
+        return _parse_moov(path, data)
+    except struct.error as e:
+        raise Mp4ParseError(f"Malformed box: {e}")
+
+
+def is_mp4_container(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in MP4_EXTENSIONS
+
+
+def read_index(path: str, cache: bool = True) -> Mp4Index:
+    """MP4/MOVのインデックスを取得（ファイルのmtime/サイズ単位でキャッシュ）"""
+    st = os.stat(path)
+    load = _load_index if cache else _load_index.__wrapped__
+    return load(os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+
+def clear_cache():
+    _load_index.cache_clear()
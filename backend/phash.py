@@ -0,0 +1,74 @@
+"""
+セグメントの知覚ハッシュ（dHash）と類似セグメントのクラスタリング
+解析用にデコード済みの輝度フレーム（analysis.DecodedMedia）を再利用し、追加のデコードは行わない
+"""
+import os
+from typing import List, Optional
+
+import numpy as np
+
+# 1セグメントあたりのサンプルフレーム数（各フレーム64bitのdHash）
+HASH_FRAMES = 3
+HASH_BITS = HASH_FRAMES * 64
+# この割合以下のビット差なら類似とみなす
+DUPLICATE_THRESHOLD = float(os.getenv("DUPLICATE_THRESHOLD", "0.1"))
+
+# 1バイトあたりの立っているビット数
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _downsample(frames: np.ndarray, width: int, height: int) -> np.ndarray:
+    """(n, h, w) のフレームをブロック平均で (n, height, width) に縮小"""
+    n, h, w = frames.shape
+    rows = np.linspace(0, h, height + 1).astype(int)[:-1]
+    cols = np.linspace(0, w, width + 1).astype(int)[:-1]
+    summed = np.add.reduceat(np.add.reduceat(frames.astype(np.float32), rows, axis=1), cols, axis=2)
+    counts = np.outer(np.diff(np.append(rows, h)), np.diff(np.append(cols, w)))
+    return summed / counts
+
+
+def dhash(frames: np.ndarray) -> np.ndarray:
+    """各フレームの64bit dHash（横方向の輝度勾配の符号）を (n, 8) のuint8で返す"""
+    small = _downsample(frames, 9, 8)
+    bits = small[:, :, 1:] > small[:, :, :-1]
+    return np.packbits(bits.reshape(len(frames), 64), axis=1)
+
+
+def segment_hash(frames: np.ndarray) -> Optional[str]:
+    """セグメントのフレームから等間隔にHASH_FRAMES枚を選び、連結したハッシュを16進文字列で返す"""
+    if len(frames) == 0:
+        return None
+    picks = np.linspace(0, len(frames) - 1, HASH_FRAMES).round().astype(int)
+    return dhash(frames[picks]).tobytes().hex()
+
+
+def cluster(hashes: List[Optional[str]], threshold: float = DUPLICATE_THRESHOLD) -> List[Optional[int]]:
+    """ハミング距離で類似セグメントをまとめる
+    先頭から順に、しきい値以内で最も近いクラスタ先頭のクラスタに入れ、なければ自分が先頭になる
+    （A~B~Cと連鎖しても、先頭Aから離れたCは別クラスタになる）
+    各セグメントについて、所属クラスタの先頭セグメントの位置（単独ならNone）を返す"""
+    valid = [i for i, h in enumerate(hashes) if h]
+    result: List[Optional[int]] = [None] * len(hashes)
+    if len(valid) < 2:
+        return result
+
+    packed = np.frombuffer(b"".join(bytes.fromhex(hashes[i]) for i in valid), dtype=np.uint8).reshape(len(valid), -1)
+    max_distance = int(packed.shape[1] * 8 * threshold)
+
+    heads: List[int] = []  # packed の行番号
+    assigned = [0] * len(valid)
+    for k in range(len(valid)):
+        if heads:
+            distances = _POPCOUNT[packed[heads] ^ packed[k]].sum(axis=1, dtype=np.int32)
+            nearest = int(np.argmin(distances))
+            if distances[nearest] <= max_distance:
+                assigned[k] = heads[nearest]
+                continue
+        heads.append(k)
+        assigned[k] = k
+
+    sizes = np.bincount(assigned, minlength=len(valid))
+    for k, head in enumerate(assigned):
+        if sizes[head] > 1:
+            result[valid[k]] = valid[head]
+    return result
@@ -0,0 +1,87 @@
+"""
+早見プレビュー（セグメントごとの短い早回し・低解像度・音声なしのクリップ）
+元動画を1回だけデコードし、全セグメントのプレビューを1本のffmpegで書き出す
+（setptsで早回し→fpsで間引き→縮小してエンコードし、segmentマクサでセグメントの境界ごとにファイルを分ける）
+"""
+import bisect
+import csv
+import os
+import subprocess
+import tempfile
+from typing import List, Optional, Tuple
+
+import blobstore
+import scheduler
+import storage
+from models import Segment
+from video import DEFAULT_CODEC, ENCODERS
+
+# 再生速度（倍）・高さ（px。元動画より大きくはしない）・フレームレート
+SPEED = float(os.getenv("PREVIEW_SPEED", "8"))
+HEIGHT = int(os.getenv("PREVIEW_HEIGHT", "360"))
+FPS = int(os.getenv("PREVIEW_FPS", "15"))
+CRF = int(os.getenv("PREVIEW_CRF", "30"))
+
+
+def preview_path(segment: Segment, job_id: int) -> str:
+    """書き出したジョブごとのファイル
+    切り直してもSQLiteは削除した行IDを再利用するので、行IDだけでは旧セグメントのプレビューや
+    結果を捨てる途中の旧ジョブのファイルと同じ名前になる。参照はSegment.preview_pathに記録したパスだけ"""
+    return os.path.join(storage.previews_dir(segment.video_id), f"preview_{segment.id}_j{job_id}.mp4")
+
+
+def is_ready(segment: Segment) -> bool:
+    """作成済み（S3の場合は保存済みなので、このマシンにファイルがなくてもよい）"""
+    return bool(segment.preview_path) and (blobstore.is_remote() or os.path.exists(segment.preview_path))
+
+
+def render(video_path: str, ranges: List[Tuple[float, float]], destinations: List[str]) -> List[bool]:
+    """ranges [(開始秒, 終了秒), ...]（連続した区間）のプレビューを1回のデコードで書き出し、destinationsに置く
+    区間ごとに書き出せたかを返す（早回しで1フレームに満たない区間はファイルができない）"""
+    first_start, last_end = ranges[0][0], ranges[-1][1]
+    # 出力（早回し後）の時刻での区間の切れ目
+    cuts = [(start - first_start) / SPEED for start, _ in ranges[1:]]
+    os.makedirs(os.path.dirname(destinations[0]), exist_ok=True)
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(destinations[0])) as work_dir:
+        list_path = os.path.join(work_dir, "list.csv")
+        cmd = [
+            "ffmpeg", "-v", "error",
+            "-ss", str(first_start), "-t", str(last_end - first_start), "-i", video_path,
+            "-an", "-sn", "-dn",
+            "-vf", f"setpts=(PTS-STARTPTS)/{SPEED},fps={FPS},scale=-2:'min({HEIGHT},ih)'",
+        ]
+        cmd += ENCODERS[DEFAULT_CODEC] + ["-preset", "veryfast", "-crf", str(CRF), "-pix_fmt", "yuv420p"]
+        if cuts:
+            # 切れ目にキーフレームを置き、segmentマクサがちょうどそこで分けられるようにする
+            times = ",".join(f"{t:.6f}" for t in cuts)
+            cmd += [
+                "-force_key_frames", times, "-f", "segment", "-segment_times", times, "-reset_timestamps", "1",
+                "-segment_format", "mp4", "-segment_format_options", "movflags=+faststart",
+                "-segment_list", list_path, "-segment_list_type", "csv",
+                os.path.join(work_dir, "part_%05d.mp4"), "-y"
+            ]
+        else:
+            # 区間が1つならそのままMP4に書く（segmentマクサは segment_times がないと既定の2秒ごとに分けてしまう）
+            single_path = os.path.join(work_dir, "part.mp4")
+            cmd += ["-movflags", "+faststart", "-f", "mp4", single_path, "-y"]
+        try:
+            scheduler.run(cmd, check=True, capture_output=True)
+        except subprocess.CalledProcessError as e:
+            raise Exception(f"Failed to render previews: {e.stderr.decode(errors='ignore')[-500:]}")
+
+        if not cuts:
+            os.replace(single_path, destinations[0])
+            return [True]
+
+        # 書き出されたファイルを開始時刻で区間に対応付ける（空の区間があっても番号がずれない）
+        written: List[Optional[str]] = [None] * len(ranges)
+        with open(list_path, newline="") as f:
+            for name, start, _ in csv.reader(f):
+                index = bisect.bisect_right(cuts, float(start) + 0.5 / FPS)
+                if written[index] is None:
+                    written[index] = os.path.join(work_dir, name)
+        for path, destination in zip(written, destinations):
+            if path:
+                os.replace(path, destination)
+        return [path is not None for path in written]
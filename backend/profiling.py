@@ -0,0 +1,269 @@
+"""
+本番リクエストのオンデマンドプロファイリング
+PROFILE_ADMIN_TOKEN を設定したときだけ有効（未設定ならミドルウェアを組み込まないのでオーバーヘッドはない）
+対象は X-Profile ヘッダ＋管理トークン付きのリクエストか、PROFILE_SAMPLE_RATE の割合で無作為に選んだリクエスト
+対象リクエストのスレッドのスタックを一定間隔でサンプリングし、ffmpegの待ち時間と合わせて記録する
+直近 PROFILE_BUFFER_SIZE 件をfolded stacks形式（flamegraph.pl・speedscopeで読める）でダウンロードできる
+"""
+import asyncio
+import contextlib
+import contextvars
+import hmac
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from typing import Callable, Deque, Dict, Iterator, List, Optional, TypeVar
+
+ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN", "")
+ENABLED = bool(ADMIN_TOKEN)
+# 無作為にプロファイルするリクエストの割合（0〜1）
+SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# スタックのサンプリング間隔
+INTERVAL_SEC = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+# 保持するプロファイル数（古いものから捨てる）
+BUFFER_SIZE = int(os.getenv("PROFILE_BUFFER_SIZE", "20"))
+
+# ffmpegの終了・出力を待っている間のサンプルに付ける葉フレーム
+FFMPEG_FRAME = "[ffmpeg]"
+
+_active: contextvars.ContextVar[Optional["Profile"]] = contextvars.ContextVar("profile", default=None)
+_ids = itertools.count(1)
+_lock = threading.Lock()
+_running: List["Profile"] = []
+_finished: Deque["Profile"] = deque(maxlen=BUFFER_SIZE)
+_sampler: Optional[threading.Thread] = None
+
+T = TypeVar("T")
+
+
+class Profile:
+    """1リクエスト分のサンプルと時間の内訳"""
+
+    def __init__(self, method: str, path: str, root_frame):
+        self.id = next(_ids)
+        self.method = method
+        self.path = path
+        self.started_at = datetime.utcnow()
+        self.status_code: Optional[int] = None
+        self.samples: Counter = Counter()  # folded stack -> サンプル数
+        self.python_samples = 0
+        self.ffmpeg_samples = 0
+        self.ffmpeg_sec = 0.0  # ffmpegの実行を待っていた時間
+        self.ffmpeg_queue_sec = 0.0  # ffmpegの実行枠（scheduler.slot）を待っていた時間
+        self.ffmpeg_calls = 0
+        self.wall_sec = 0.0
+        self._started = time.monotonic()
+        self._root_frame = root_frame  # イベントループ上ではこのフレームを含むスタックだけがこのリクエスト
+        self._loop_thread = threading.get_ident()
+        self._threads: Counter = Counter()  # スレッドプールでこのリクエストの処理をしているスレッド
+        self._waiting: Counter = Counter()  # ffmpegを待っているスレッド
+
+    @contextlib.contextmanager
+    def child_wait(self, new_process: bool = True):
+        """ffmpegを待つ区間を記録。yieldした関数を呼んだ時点までを実行枠の待ち時間とする"""
+        thread = threading.get_ident()
+        started = time.monotonic()
+        acquired = [started]
+        self._waiting[thread] += 1
+        try:
+            yield lambda: acquired.__setitem__(0, time.monotonic())
+        finally:
+            self._waiting[thread] -= 1
+            self.ffmpeg_queue_sec += acquired[0] - started
+            self.ffmpeg_sec += time.monotonic() - acquired[0]
+            if new_process:
+                self.ffmpeg_calls += 1
+
+    def sample(self, frames: Dict[int, object]):
+        for thread, frame in frames.items():
+            if thread == self._loop_thread:
+                stack = _stack(frame, self._root_frame)
+            elif self._threads[thread] > 0:
+                stack = _stack(frame)
+            else:
+                continue
+            if stack is None:
+                continue
+            if self._waiting[thread] > 0:
+                stack.append(FFMPEG_FRAME)
+                self.ffmpeg_samples += 1
+            else:
+                self.python_samples += 1
+            self.samples[";".join([f"{self.method} {self.path}"] + stack)] += 1
+
+    def summary(self) -> dict:
+        python_sec = self.python_samples * INTERVAL_SEC
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status_code": self.status_code,
+            "started_at": self.started_at.isoformat(),
+            "wall_ms": round(self.wall_sec * 1000, 1),
+            "python_ms": round(python_sec * 1000, 1),
+            "ffmpeg_ms": round(self.ffmpeg_sec * 1000, 1),
+            "ffmpeg_queue_ms": round(self.ffmpeg_queue_sec * 1000, 1),
+            "ffmpeg_calls": self.ffmpeg_calls,
+            # I/O待ち（アップロードの受信・クライアントへの送信など）
+            "idle_ms": round(max(0.0, self.wall_sec - python_sec - self.ffmpeg_sec - self.ffmpeg_queue_sec) * 1000, 1),
+            "samples": self.python_samples + self.ffmpeg_samples,
+            "interval_ms": INTERVAL_SEC * 1000,
+        }
+
+    def folded(self) -> str:
+        """folded stacks形式（1行に「フレーム;フレーム;... サンプル数」）"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+def _stack(frame, root=None) -> Optional[List[str]]:
+    """根から葉の順のフレーム名。rootを指定した場合はrootより上だけを返し、rootを含まなければNone"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        if frame is root:
+            break
+        frame = frame.f_back
+    else:
+        if root is not None:
+            return None
+    names.reverse()
+    return names
+
+
+def _sample_loop():
+    global _sampler
+    while True:
+        with _lock:
+            running = list(_running)
+            if not running:
+                _sampler = None
+                return
+        frames = sys._current_frames()
+        for profile in running:
+            profile.sample(frames)
+        del frames
+        time.sleep(INTERVAL_SEC)
+
+
+def _start(profile: Profile):
+    global _sampler
+    with _lock:
+        _running.append(profile)
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_loop, name="profiler", daemon=True)
+            _sampler.start()
+
+
+def _finish(profile: Profile):
+    profile.wall_sec = time.monotonic() - profile._started
+    profile._root_frame = None
+    with _lock:
+        _running.remove(profile)
+        _finished.append(profile)
+
+
+def current() -> Optional[Profile]:
+    """実行中のリクエストのプロファイル（対象外ならNone）"""
+    return _active.get() if ENABLED else None
+
+
+@contextlib.contextmanager
+def _attached(profile: Profile):
+    """このスレッドでの処理をprofileのリクエストのものとしてサンプリングする"""
+    thread = threading.get_ident()
+    profile._threads[thread] += 1
+    token = _active.set(profile)
+    try:
+        yield
+    finally:
+        _active.reset(token)
+        profile._threads[thread] -= 1
+
+
+def traced(iterator: Iterator) -> Iterator:
+    """スレッドプールで回されるイテレータ（StreamingResponseの本体など）もサンプリング対象にする"""
+    profile = current()
+    if profile is None:
+        return iterator
+    return _traced(iterator, profile)
+
+
+def _traced(iterator: Iterator, profile: Profile) -> Iterator:
+    # next() のたびに呼び出し元のスレッドが変わるので、毎回登録し直す
+    while True:
+        with _attached(profile):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+async def to_thread(func: Callable[..., T], *args, **kwargs) -> T:
+    """asyncio.to_thread と同じ。対象リクエストなら、スレッドで実行している間もサンプリングする
+    （そのままではイベントループのスレッドが待っているだけなので、処理時間がidle_msに入ってしまう）"""
+    profile = current()
+    if profile is None:
+        return await asyncio.to_thread(func, *args, **kwargs)
+    return await asyncio.to_thread(_run_attached, profile, func, args, kwargs)
+
+
+def _run_attached(profile: Profile, func: Callable[..., T], args, kwargs) -> T:
+    with _attached(profile):
+        return func(*args, **kwargs)
+
+
+def is_admin(token: Optional[str]) -> bool:
+    return ENABLED and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def list_profiles() -> List[dict]:
+    with _lock:
+        return [p.summary() for p in reversed(_finished)]
+
+
+def get_profile(profile_id: int) -> Optional[Profile]:
+    with _lock:
+        return next((p for p in _finished if p.id == profile_id), None)
+
+
+class ProfilingMiddleware:
+    """対象リクエストをプロファイルするASGIミドルウェア（レスポンス本体の送信完了までを計測）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def _selected(self, scope) -> bool:
+        if scope["path"].startswith("/api/admin/"):
+            return False
+        headers = dict(scope["headers"])
+        if headers.get(b"x-profile") == b"1":
+            return is_admin(headers.get(b"x-admin-token", b"").decode("latin-1"))
+        return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._selected(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(scope["method"], scope["path"], sys._getframe())
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", str(profile.id).encode())]}
+            await send(message)
+
+        token = _active.set(profile)
+        _start(profile)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _finish(profile)
+            _active.reset(token)
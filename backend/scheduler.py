@@ -0,0 +1,159 @@
+"""
+ffmpeg/ffprobe の実行スケジューラ
+同じマシン上の全プロセス（API・ワーカー）で同時実行数を制限し、優先度の高い処理のために枠を残す
+  interactive（画面でトリムを設定した直後の先行レンダリング） > ingest（分割・解析・早見プレビュー） > export
+実行枠はファイルロック（flock）で表すので、プロセスが落ちても枠は自動で解放される
+（枠を取ったプロセスはロックファイルにPIDを書き、実行数はロックを取らずにPIDから数える）
+ffmpegは低いOS優先度（nice）で起動し、APIの応答を妨げないようにする
+"""
+import contextlib
+import contextvars
+import fcntl
+import os
+import subprocess
+import tempfile
+import time
+from typing import Optional
+
+import profiling
+
+INTERACTIVE = 0
+INGEST = 1
+EXPORT = 2
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", INGEST: "ingest", EXPORT: "export"}
+
+# ジョブ種別ごとの優先度
+KIND_PRIORITY = {
+    # 画面でトリムを設定した直後に先行レンダリング（エクスポート時に待たせない）
+    "trim": INTERACTIVE,
+    # 早見プレビューは動画全体の再エンコードなので、interactiveの枠を使わない
+    "preview": INGEST,
+    "segment": INGEST,
+    "rechunk": INGEST,
+    "analyze": INGEST,
+    "export": EXPORT,
+    "concat": EXPORT,
+}
+
+# マシン全体でのffmpeg同時実行数
+MAX_CONCURRENCY = int(os.getenv("FFMPEG_MAX_CONCURRENCY", str(os.cpu_count() or 2)))
+# interactive専用に残しておく枠の数
+RESERVED_INTERACTIVE = int(os.getenv("FFMPEG_RESERVED_INTERACTIVE", "1"))
+# ingest・exportのffmpegに付けるnice値（interactiveは0）
+FFMPEG_NICE = int(os.getenv("FFMPEG_NICE", "10"))
+SLOT_DIR = os.getenv("FFMPEG_SLOT_DIR", os.path.join(tempfile.gettempdir(), "swipecut-ffmpeg-slots"))
+
+# 枠が空くのを待つ間隔（優先度が高いほど短く、空いた枠を先に取れる）
+_POLL_INTERVAL = {INTERACTIVE: 0.02, INGEST: 0.1, EXPORT: 0.25}
+
+_current_priority = contextvars.ContextVar("ffmpeg_priority", default=INGEST)
+
+
+def slot_limit(priority: int) -> int:
+    """その優先度が使える枠の数（低い優先度ほど少ない枠しか使えない）"""
+    if priority == INTERACTIVE:
+        return MAX_CONCURRENCY
+    bulk = max(1, MAX_CONCURRENCY - RESERVED_INTERACTIVE)
+    if priority == INGEST:
+        return bulk
+    return max(1, bulk // 2)
+
+
+def nice_level(priority: int) -> int:
+    return 0 if priority == INTERACTIVE else min(19, FFMPEG_NICE + (5 if priority == EXPORT else 0))
+
+
+@contextlib.contextmanager
+def priority(value: int):
+    """このブロック内で実行するffmpegの優先度を指定（ワーカーはジョブ種別ごとに設定する）"""
+    token = _current_priority.set(value)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def current_priority() -> int:
+    return _current_priority.get()
+
+
+@contextlib.contextmanager
+def slot(priority: Optional[int] = None):
+    """実行枠を1つ確保（空くまで待つ）"""
+    priority = current_priority() if priority is None else priority
+    os.makedirs(SLOT_DIR, exist_ok=True)
+    limit = slot_limit(priority)
+    while True:
+        for index in range(limit):
+            fd = os.open(_slot_path(index), os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            try:
+                os.ftruncate(fd, 0)
+                os.pwrite(fd, str(os.getpid()).encode(), 0)
+                yield index
+            finally:
+                os.ftruncate(fd, 0)
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+            return
+        time.sleep(_POLL_INTERVAL.get(priority, 0.1))
+
+
+def _slot_path(index: int) -> str:
+    return os.path.join(SLOT_DIR, f"slot_{index}.lock")
+
+
+def preexec(priority: Optional[int] = None):
+    """子プロセスのOS優先度を下げる preexec_fn"""
+    level = nice_level(current_priority() if priority is None else priority)
+
+    def lower_priority():
+        current = os.getpriority(os.PRIO_PROCESS, 0)
+        if level > current:
+            os.setpriority(os.PRIO_PROCESS, 0, level)
+
+    return lower_priority
+
+
+def run(cmd, priority: Optional[int] = None, **kwargs) -> subprocess.CompletedProcess:
+    """subprocess.run と同じ使い方で、実行枠を確保してから低優先度で実行"""
+    priority = current_priority() if priority is None else priority
+    profile = profiling.current()
+    if profile is None:
+        with slot(priority):
+            return subprocess.run(cmd, preexec_fn=preexec(priority), **kwargs)
+    # プロファイル中のリクエストでは枠の待ち時間とffmpegの実行時間を記録する
+    with profile.child_wait() as acquired:
+        with slot(priority):
+            acquired()
+            return subprocess.run(cmd, preexec_fn=preexec(priority), **kwargs)
+
+
+def running_count() -> int:
+    """実行中のffmpegの数（枠を持っているプロセスのPIDから数える。ロックは取らないので実行中のジョブを邪魔しない）"""
+    busy = 0
+    for index in range(MAX_CONCURRENCY):
+        try:
+            with open(_slot_path(index), "rb") as f:
+                pid = int(f.read(16) or 0)
+        except (OSError, ValueError):
+            continue
+        if pid and _is_alive(pid):
+            busy += 1
+    return busy
+
+
+def _is_alive(pid: int) -> bool:
+    """落ちたプロセスのPIDが残っていても数えない"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
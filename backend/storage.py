@@ -0,0 +1,93 @@
+"""
+動画ごとのストレージレイアウト
+  STORAGE_DIR/<シャード>/<video_id>/original/<元のファイル名>
+  STORAGE_DIR/<シャード>/<video_id>/segments/<stem>_segment_NNN.mp4
+  STORAGE_DIR/<シャード>/<video_id>/export/
+  STORAGE_DIR/<シャード>/<video_id>/previews/preview_<segment_id>_j<job_id>.mp4（早見プレビュー）
+  STORAGE_DIR/<シャード>/<video_id>/analysis.npz（解析用デコード結果のキャッシュ）
+シャードはvideo_idのハッシュ先頭2桁（256ディレクトリ）で、1ディレクトリのエントリ数を抑える
+動画の削除は trash/ へのリネーム1回で完了し、実体の削除はバックグラウンドで行う
+"""
+import hashlib
+import os
+import shutil
+import uuid
+from typing import Optional
+
+from config import STORAGE_DIR
+
+TRASH_DIR = os.path.join(STORAGE_DIR, "trash")
+
+
+def shard(video_id: int) -> str:
+    return hashlib.md5(str(video_id).encode()).hexdigest()[:2]
+
+
+def video_dir(video_id: int) -> str:
+    return os.path.join(STORAGE_DIR, shard(video_id), str(video_id))
+
+
+def original_dir(video_id: int) -> str:
+    return os.path.join(video_dir(video_id), "original")
+
+
+def segments_dir(video_id: int) -> str:
+    return os.path.join(video_dir(video_id), "segments")
+
+
+def export_dir(video_id: int) -> str:
+    return os.path.join(video_dir(video_id), "export")
+
+
+def previews_dir(video_id: int) -> str:
+    return os.path.join(video_dir(video_id), "previews")
+
+
+def analysis_cache_path(video_id: int) -> str:
+    """解析用デコード結果のキャッシュ"""
+    return os.path.join(video_dir(video_id), "analysis.npz")
+
+
+def original_path(video_id: int, filename: str) -> str:
+    """アップロードされた元動画の保存先（ディレクトリは作成済みにする）"""
+    directory = original_dir(video_id)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, os.path.basename(filename) or "video.mp4")
+
+
+def prepare_video_dirs(video_id: int):
+    for directory in (original_dir(video_id), segments_dir(video_id), export_dir(video_id)):
+        os.makedirs(directory, exist_ok=True)
+
+
+def video_path(video) -> str:
+    """Video行から元動画のパスを解決"""
+    return video.original_path
+
+
+def segment_path(segment) -> str:
+    """Segment行からセグメントファイルのパスを解決"""
+    return segment.path
+
+
+def is_in_layout(path: str, video_id: int) -> bool:
+    return os.path.abspath(path).startswith(os.path.abspath(video_dir(video_id)) + os.sep)
+
+
+def delete_video_files(video_id: int) -> Optional[str]:
+    """動画ディレクトリを trash/ へ移動（O(1)）。移動先を返す"""
+    source = video_dir(video_id)
+    if not os.path.isdir(source):
+        return None
+    os.makedirs(TRASH_DIR, exist_ok=True)
+    target = os.path.join(TRASH_DIR, f"{video_id}-{uuid.uuid4().hex[:8]}")
+    os.rename(source, target)
+    return target
+
+
+def purge_trash():
+    """trash/ の中身を実際に削除（バックグラウンド処理用）"""
+    if not os.path.isdir(TRASH_DIR):
+        return
+    for entry in os.scandir(TRASH_DIR):
+        shutil.rmtree(entry.path, ignore_errors=True)
@@ -0,0 +1,481 @@
+"""
+ワーカーが実行するジョブ処理（分割・ZIPエクスポート）
+どちらも再実行しても結果が変わらない（冪等）ように実装する
+"""
+import hashlib
+import json
+import logging
+import os
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+
+import blobstore
+import concat
+import jobs
+import library
+import preview
+import storage
+import trim
+from models import Job, Segment, Video
+from video import (
+    boundaries_from_cuts, create_zip_archive, cut_segments, get_video_duration, is_valid_segment,
+    read_segment_info, segment_boundaries, segment_output_path, split_video
+)
+
+logger = logging.getLogger(__name__)
+
+# (done, total) で進捗を報告するコールバック
+ProgressReporter = Callable[[Optional[int], Optional[int]], None]
+
+
+def valid_segment_prefix(db: Session, video: Video, chunk_sec: int) -> List[Segment]:
+    """前回までに作成済みのセグメントのうち、先頭から途切れずに使えるものを返す
+    境界がずれている（chunk_secが変わった）・ファイルが欠けている/壊れている行以降は削除する"""
+    boundaries = segment_boundaries(get_video_duration(storage.video_path(video)), chunk_sec)
+    segments = db.query(Segment).filter(Segment.video_id == video.id).order_by(Segment.index).all()
+    valid = []
+    for segment in segments:
+        if (
+            segment.index != len(valid)
+            or segment.index >= len(boundaries)
+            or (segment.start_sec, segment.end_sec) != boundaries[segment.index]
+            # 別のマシンで作られたセグメントは保存先から取得して確かめる
+            or not is_valid_segment(blobstore.fetch(storage.segment_path(segment)), segment.size_bytes)
+        ):
+            break
+        valid.append(segment)
+
+    stale = segments[len(valid):]
+    for segment in stale:
+        db.delete(segment)
+    library.segments_removed(db, video.id, stale)
+    db.commit()
+    for segment in stale:
+        # 作り直すので、壊れている可能性のあるファイルは消しておく
+        if os.path.exists(storage.segment_path(segment)):
+            os.remove(storage.segment_path(segment))
+        blobstore.delete(storage.segment_path(segment))
+    if stale:
+        logger.info("🧹 Discarded %d incomplete segments", len(stale), extra={"video_id": video.id})
+    return valid
+
+
+def adopt_orphan_segment(db: Session, video: Video, chunk_sec: int, valid: List[Segment]) -> int:
+    """ファイルの書き出し後・行の登録前に中断したセグメント（最大1件）を取り込む。次に作成すべき index を返す"""
+    start_index = len(valid)
+    if start_index == 0:
+        return 0
+    video_path = storage.video_path(video)
+    segment_path = segment_output_path(video_path, storage.segments_dir(video.id), start_index)
+    boundaries = segment_boundaries(get_video_duration(video_path), chunk_sec)
+    # 直前のセグメントより後に書かれたファイルだけが今回の分割の続き（古いchunk_secの残骸を拾わない）
+    if (
+        start_index >= len(boundaries)
+        or not is_valid_segment(segment_path)
+        or os.path.getmtime(segment_path) < os.path.getmtime(storage.segment_path(valid[-1]))
+    ):
+        return start_index
+    start_sec, end_sec = boundaries[start_index]
+    blobstore.publish(segment_path)
+    add_segment(db, video, start_index, (start_sec, end_sec, segment_path, read_segment_info(segment_path)))
+    logger.info("♻️ Recovered already written segment %d", start_index, extra={"video_id": video.id})
+    return start_index + 1
+
+
+def insert_segments(db: Session, rows: List[dict]):
+    """セグメント行をまとめて挿入（ORMのunit of workもORMのbulk処理も通さず、Coreの1回のexecutemanyで書き込む）"""
+    if rows:
+        # executemanyは全行が同じ列を持つ必要がある（メタデータを読めなかったセグメントは列が欠ける）
+        columns = set().union(*rows)
+        db.execute(Segment.__table__.insert(), [{column: row.get(column) for column in columns} for row in rows])
+
+
+def add_segment(db: Session, video: Video, index: int, segment_data: tuple):
+    """セグメント1件を登録してすぐにコミット（中断しても完成済みの分は残る）"""
+    start_sec, end_sec, segment_path, info = segment_data
+    segment = Segment(
+        video_id=video.id,
+        index=index,
+        path=segment_path,
+        start_sec=start_sec,
+        end_sec=end_sec,
+        decision="pending",
+        **info
+    )
+    db.add(segment)
+    library.segments_added(db, video.id, [segment])
+    db.commit()
+
+
+def run_segment_job(db: Session, job: Job, report: ProgressReporter) -> dict:
+    """動画を分割し、セグメントを1件ずつデータベースに記録（中断した場合は続きから再開）"""
+    payload = json.loads(job.payload or "{}")
+    chunk_sec = int(payload.get("chunk_sec", 60))
+    video = db.query(Video).filter(Video.id == job.video_id).first()
+    if not video:
+        raise Exception(f"Video {job.video_id} not found")
+
+    video.chunk_sec = chunk_sec
+    video.set_status("segmenting")
+    db.commit()
+
+    try:
+        blobstore.fetch(storage.video_path(video))
+        start_index = adopt_orphan_segment(db, video, chunk_sec, valid_segment_prefix(db, video, chunk_sec))
+        if start_index:
+            logger.info("⏩ Resuming segmentation from segment %d", start_index, extra={"video_id": video.id})
+        else:
+            logger.info("🎬 Starting video segmentation", extra={"video_id": video.id})
+
+        def on_segment(index, total, segment_data):
+            # 保存先に置いてから行を登録する（行があればファイルはどのマシンからも読める）
+            blobstore.publish(segment_data[2])
+            add_segment(db, video, index, segment_data)
+            report(index + 1, total)
+
+        split_video(
+            storage.video_path(video),
+            storage.segments_dir(video.id),
+            chunk_sec,
+            on_segment,
+            start_index=start_index
+        )
+    except Exception:
+        db.rollback()
+        if job.attempts >= job.max_attempts:
+            video.set_status("failed")
+            db.commit()
+        raise
+
+    segments_count = db.query(Segment).filter(Segment.video_id == video.id).count()
+    video.segments_total = segments_count
+    video.set_status("segmented")
+    db.commit()
+    report(segments_count, segments_count)
+    logger.info("✅ Video segmented into %d segments", segments_count, extra={"video_id": video.id})
+    jobs.enqueue(db, "preview", video.id, dedupe_key=f"preview:{video.id}")
+    jobs.enqueue(db, "analyze", video.id, dedupe_key=f"analyze:{video.id}")
+    return {"segments_count": segments_count, "resumed_from": start_index}
+
+
+def resume_interrupted_segmentation(db: Session) -> int:
+    """分割が終わっていない動画のうち、実行待ちの分割ジョブがないものを再登録（起動時に呼ぶ）"""
+    resumed = 0
+    for video in db.query(Video).filter(Video.status.in_(["uploaded", "segmenting"])).all():
+        if jobs.latest_job(db, "segment", video.id, ["queued", "running"]):
+            continue
+        if video.segments_total is not None:
+            # 切り直しの途中で止まった動画（旧セグメントは差し替え前のまま残っている）
+            if not jobs.latest_job(db, "rechunk", video.id, ["queued", "running"]):
+                video.set_status("segmented")
+                db.commit()
+            continue
+        jobs.enqueue(db, "segment", video.id, {"chunk_sec": video.chunk_sec or 60}, dedupe_key=f"segment:{video.id}")
+        resumed += 1
+    if resumed:
+        logger.info("⏩ Re-queued segmentation for %d interrupted videos", resumed)
+    return resumed
+
+
+def commit_unless_rechunked(db: Session, video_id: int, segments: List[Segment]) -> bool:
+    """読み込んだセグメントが切り直されていなければコミットし、切り直されていたら変更を捨ててFalseを返す
+    flushで書き込みのロックを取ってから比べるので、比べた後にコミットまでの間で差し替えられることはない
+    （SQLiteは削除した行IDを再利用するので、IDだけでなくファイルのパスも比べる）"""
+    try:
+        db.flush()
+        current = dict(db.query(Segment.id, Segment.path).filter(Segment.video_id == video_id).all())
+    except StaleDataError:
+        # 更新しようとした行が既に削除されていた
+        current = None
+    if current != {s.id: s.path for s in segments}:
+        db.rollback()
+        logger.info("⏭️ Segments were re-chunked while the job was running; results discarded",
+                    extra={"video_id": video_id})
+        return False
+    db.commit()
+    return True
+
+
+def run_analyze_job(db: Session, job: Job, report: ProgressReporter) -> dict:
+    """元動画を1回デコードし、全セグメントの音量・黒画面率・動き量と知覚ハッシュを計算"""
+    # NumPyの読み込みはAPIプロセスの起動時間に影響するので、解析ジョブの実行時まで遅延
+    import analysis
+    import phash
+
+    video = db.query(Video).filter(Video.id == job.video_id).first()
+    if not video:
+        raise Exception(f"Video {job.video_id} not found")
+    segments = db.query(Segment).filter(Segment.video_id == video.id).order_by(Segment.index).all()
+    if not segments:
+        return {"analyzed": 0}
+
+    media = analysis.decode_cached(blobstore.fetch(storage.video_path(video)), storage.analysis_cache_path(video.id))
+    scores = analysis.analyze(media, [(s.start_sec, s.end_sec) for s in segments])
+    flagged = 0
+    for segment, score in zip(segments, scores):
+        segment.loudness_db = score["loudness_db"]
+        segment.black_ratio = score["black_ratio"]
+        segment.motion = score["motion"]
+        segment.flagged = analysis.is_dead(score)
+        flagged += segment.flagged
+        # 解析でデコード済みのフレームからハッシュを計算（追加のデコードなし）
+        first, last = media.frame_range(segment.start_sec, segment.end_sec)
+        segment.phash = phash.segment_hash(media.frames[first:last])
+
+    heads = phash.cluster([s.phash for s in segments])
+    for segment, head in zip(segments, heads):
+        segment.dup_cluster = segments[head].id if head is not None else None
+    if not commit_unless_rechunked(db, video.id, segments):
+        # 新しいセグメントは切り直しのジョブが登録し直した解析に任せる
+        return {"analyzed": 0, "superseded": True}
+    report(len(segments), len(segments))
+    clusters = len({head for head in heads if head is not None})
+    logger.info("✅ Analyzed %d segments, %d flagged, %d duplicate clusters", len(segments), flagged, clusters,
+                extra={"video_id": video.id})
+    return {"analyzed": len(segments), "flagged": flagged, "clusters": clusters}
+
+
+def run_preview_job(db: Session, job: Job, report: ProgressReporter) -> dict:
+    """早見プレビューを元動画の1回のデコードで作成（前回の続きから。作成済みのセグメントは飛ばす）"""
+    video = db.query(Video).filter(Video.id == job.video_id).first()
+    if not video:
+        raise Exception(f"Video {job.video_id} not found")
+    segments = db.query(Segment).filter(Segment.video_id == video.id).order_by(Segment.index).all()
+    missing = [i for i, s in enumerate(segments) if not preview.is_ready(s)]
+    if not missing:
+        return {"previews": 0}
+
+    todo = segments[missing[0]:]
+    destinations = [preview.preview_path(s, job.id) for s in todo]
+    written = preview.render(
+        blobstore.fetch(storage.video_path(video)), [(s.start_sec, s.end_sec) for s in todo], destinations
+    )
+    for segment, destination, ok in zip(todo, destinations, written):
+        if ok:
+            blobstore.publish(destination)
+            segment.preview_path = destination
+    if not commit_unless_rechunked(db, video.id, segments):
+        for destination, ok in zip(destinations, written):
+            if ok:
+                if os.path.exists(destination):
+                    os.remove(destination)
+                blobstore.delete(destination)
+        return {"previews": 0, "superseded": True}
+    report(len(segments), len(segments))
+    logger.info("✅ Rendered %d previews", sum(written), extra={"video_id": video.id})
+    return {"previews": sum(written)}
+
+
+def run_trim_job(db: Session, job: Job, report: ProgressReporter) -> dict:
+    """画面で設定されたトリムを先行レンダリング（interactiveの枠で実行し、エクスポート時に待たせない）"""
+    payload = json.loads(job.payload or "{}")
+    segment = db.query(Segment).filter(Segment.id == payload.get("segment_id")).first()
+    if not segment or not trim.is_trimmed(segment) or trim.is_rendered(segment):
+        return {"rendered": False}
+
+    trim_in, trim_out = segment.trim_in, segment.trim_out
+    path = trim.render_trim(segment)
+    size, crc = segment.trim_size_bytes, segment.trim_crc32
+    # レンダリング中にイン・アウト点が変わっていたら記録しない（次のトリムのジョブに任せる）
+    db.expunge(segment)
+    db.query(Segment).filter(
+        Segment.id == segment.id, Segment.trim_in == trim_in, Segment.trim_out == trim_out
+    ).update({"trim_size_bytes": size, "trim_crc32": crc}, synchronize_session=False)
+    db.commit()
+    report(1, 1)
+    return {"rendered": True, "path": path}
+
+
+def carry_decision(old_segments: List[Segment], start_sec: float, end_sec: float) -> Tuple[str, Optional[str]]:
+    """新しいセグメントに引き継ぐ (判定, 名前)
+    重なる旧セグメントの判定がすべて同じときだけ判定を引き継ぎ、名前は境界が完全に一致するときだけ引き継ぐ"""
+    overlapping = [s for s in old_segments if min(end_sec, s.end_sec) - max(start_sec, s.start_sec) > 0]
+    decisions = {s.decision for s in overlapping}
+    decision = decisions.pop() if len(decisions) == 1 else "pending"
+    name = None
+    if len(overlapping) == 1 and (overlapping[0].start_sec, overlapping[0].end_sec) == (start_sec, end_sec):
+        name = overlapping[0].name
+    return decision, name
+
+
+def _cut_rechunk(video: Video, job: Job, payload: dict, report: ProgressReporter):
+    """新しい境界でジョブのタグ付きのファイルに切り出す（旧セグメントのファイル・行には触れない）"""
+    video_path = blobstore.fetch(storage.video_path(video))
+    duration = get_video_duration(video_path)  # MP4のインデックスはプロセス内でキャッシュ済み
+    if payload.get("cuts"):
+        chunk_sec = None
+        boundaries = boundaries_from_cuts(duration, payload["cuts"])
+    else:
+        chunk_sec = int(payload["chunk_sec"])
+        boundaries = segment_boundaries(duration, chunk_sec)
+
+    output_dir = storage.segments_dir(video.id)
+    tag = f"_r{job.id}"
+    # 前回の試行で書き出した分（同じジョブのタグ付きファイル）は切り直さない
+    reused = []
+    for index in range(len(boundaries)):
+        segment_path = segment_output_path(video_path, output_dir, index, tag)
+        if not is_valid_segment(segment_path):
+            break
+        reused.append((*boundaries[index], segment_path, read_segment_info(segment_path)))
+
+    logger.info("✂️ Re-chunking into %d segments", len(boundaries), extra={"video_id": video.id})
+    new_segments = reused + cut_segments(
+        video_path, output_dir, boundaries,
+        lambda index, total, segment: report(index + 1, total),
+        start_index=len(reused),
+        tag=tag
+    )
+    for _, _, segment_path, _ in new_segments:
+        blobstore.publish(segment_path)
+    return new_segments, chunk_sec
+
+
+def run_rechunk_job(db: Session, job: Job, report: ProgressReporter) -> dict:
+    """保存済みの元動画を新しい境界で切り直し、セグメントを1トランザクションで差し替える
+    新しいファイルは別名で書き出すので、差し替えのコミットまでは旧セグメントがそのまま使える"""
+    payload = json.loads(job.payload or "{}")
+    video = db.query(Video).filter(Video.id == job.video_id).first()
+    if not video:
+        raise Exception(f"Video {job.video_id} not found")
+
+    # 差し替えまでは分割中にして判定を受け付けない（判定は切り直しの途中で失われるか、別のセグメントに付く）
+    video.set_status("segmenting")
+    db.commit()
+    # 旧セグメントに対する実行待ちの解析・プレビュー・トリムは不要（差し替え後に登録し直す）
+    jobs.cancel_queued(db, video.id, ["analyze", "preview", "trim"], f"Superseded by re-chunk job {job.id}")
+    try:
+        new_segments, chunk_sec = _cut_rechunk(video, job, payload, report)
+    except Exception:
+        # 旧セグメントはそのまま残っているので分割済みに戻す（再試行では改めて分割中にする）
+        db.rollback()
+        video.set_status("segmented")
+        db.commit()
+        raise
+
+    old_segments = db.query(Segment).filter(Segment.video_id == video.id).order_by(Segment.index).all()
+    old_paths = {storage.segment_path(s) for s in old_segments}
+    # プレビューは旧セグメントの区間のものなので、切り直した後は全部作り直す
+    old_previews = [s.preview_path for s in old_segments if s.preview_path]
+    rows = []
+    for index, (start_sec, end_sec, segment_path, info) in enumerate(new_segments):
+        decision, name = carry_decision(old_segments, start_sec, end_sec)
+        rows.append({
+            "video_id": video.id,
+            "index": index,
+            "path": segment_path,
+            "start_sec": start_sec,
+            "end_sec": end_sec,
+            "decision": decision,
+            "name": name,
+            **info
+        })
+    carried = sum(row["decision"] != "pending" for row in rows)
+    # 旧セグメントのオブジェクトもセッションから外す（SQLiteは削除したIDを新しい行に再利用することがある）
+    db.query(Segment).filter(Segment.video_id == video.id).delete(synchronize_session="evaluate")
+    insert_segments(db, rows)
+    video.chunk_sec = chunk_sec
+    video.segments_total = len(new_segments)
+    video.set_status("segmented")
+    library.refresh_stats(db, video)
+    db.commit()
+
+    # 差し替え後は旧セグメントのファイルを消す
+    new_paths = {path for _, _, path, _ in new_segments}
+    for path in (old_paths - new_paths) | set(old_previews):
+        if os.path.exists(path):
+            os.remove(path)
+        blobstore.delete(path)
+    # トリム・再エンコードのキャッシュも旧セグメントのもの
+    trim.discard_renders(video.id)
+    concat.discard_normalized(video.id)
+
+    logger.info("✅ Re-chunked into %d segments, %d decisions carried over", len(new_segments), carried,
+                extra={"video_id": video.id})
+    # 旧セグメントに対して実行中のジョブは結果を捨てる（commit_unless_rechunked）ので、それとは別に登録する
+    jobs.enqueue(db, "preview", video.id, dedupe_key=f"preview:{video.id}:r{job.id}")
+    jobs.enqueue(db, "analyze", video.id, dedupe_key=f"analyze:{video.id}:r{job.id}")
+    return {"segments_count": len(new_segments), "carried_decisions": carried}
+
+
+def export_fingerprint(segments: List[Segment]) -> str:
+    """Keepセグメントの構成を表すキー（同じ構成ならZIPを使い回す）"""
+    key = json.dumps([(s.id, s.name, s.path, s.trim_in, s.trim_out) for s in segments])
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def export_zip_path(video_id: int, fingerprint: str) -> str:
+    return os.path.join(storage.export_dir(video_id), f"kept_segments_{fingerprint}.zip")
+
+
+def run_export_job(db: Session, job: Job, report: ProgressReporter) -> dict:
+    """KeepされたセグメントをZIPにまとめる（一時ファイルに書いてから置き換える）"""
+    segments = db.query(Segment).filter(
+        Segment.video_id == job.video_id,
+        Segment.decision == "keep"
+    ).order_by(Segment.index).all()
+    if not segments:
+        raise Exception("No kept segments found")
+
+    # トリムを先にレンダリングし、サイズとCRCを記録（以降のZIPはストリーミングで返せる）
+    for i, segment in enumerate(segments):
+        blobstore.fetch(storage.segment_path(segment))
+        if trim.is_trimmed(segment) and not trim.is_rendered(segment):
+            trim.render_trim(segment)
+            db.commit()
+            report(i, len(segments))
+
+    fingerprint = export_fingerprint(segments)
+    zip_path = export_zip_path(job.video_id, fingerprint)
+    os.makedirs(storage.export_dir(job.video_id), exist_ok=True)
+    if not blobstore.exists(zip_path):
+        if not os.path.exists(zip_path):
+            temp_path = f"{zip_path}.{os.getpid()}.tmp"
+            create_zip_archive(job.video_id, segments, temp_path)
+            os.replace(temp_path, zip_path)
+        blobstore.publish(zip_path)
+    report(len(segments), len(segments))
+    return {"path": zip_path, "fingerprint": fingerprint}
+
+
+def run_concat_job(db: Session, job: Job, report: ProgressReporter) -> dict:
+    """連結ダウンロードの準備（トリムのレンダリングと形式の違うセグメントの再エンコード）
+    保存先がS3のときはAPIのマシンにファイルがないので、連結した動画まで書き出して保存する"""
+    segments = db.query(Segment).filter(
+        Segment.video_id == job.video_id,
+        Segment.decision == "keep"
+    ).order_by(Segment.index).all()
+    if not segments:
+        raise Exception("No kept segments found")
+
+    report(0, len(segments))
+    paths = concat.prepare_sources(segments)
+    # レンダリングしたトリムのサイズとCRCを記録（ZIPのストリーミングにも使われる）
+    db.commit()
+    report(len(segments), len(segments))
+
+    fingerprint = export_fingerprint(segments)
+    if not blobstore.is_remote():
+        return {"fingerprint": fingerprint}
+    output_path = concat.concat_path(job.video_id, fingerprint)
+    if not blobstore.exists(output_path):
+        temp_path = f"{output_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            for block in concat.iter_concat(job.video_id, paths):
+                f.write(block)
+        os.replace(temp_path, output_path)
+        blobstore.publish(output_path)
+    return {"path": output_path, "fingerprint": fingerprint}
+
+
+HANDLERS = {
+    "segment": run_segment_job,
+    "export": run_export_job,
+    "concat": run_concat_job,
+    "trim": run_trim_job,
+    "analyze": run_analyze_job,
+    "rechunk": run_rechunk_job,
+    "preview": run_preview_job,
+}
@@ -0,0 +1,43 @@
+"""
+テスト共通の設定
+DB・保存先は一時ディレクトリに向ける（db.py・config.py が読み込み時に環境変数を見るので、モジュールのimportより前に設定する）
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_DIR = tempfile.mkdtemp(prefix="swipecut-test-")
+
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TEST_DIR, 'swipecut.db')}"
+os.environ["STORAGE_DIR"] = os.path.join(TEST_DIR, "videos")
+os.environ["UPLOAD_DIR"] = os.path.join(TEST_DIR, "original")
+os.environ["STORAGE_BACKEND"] = "local"
+sys.path.insert(0, BACKEND_DIR)
+
+from db import SessionLocal, engine  # noqa: E402
+from models import Base  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    """テストごとに空のテーブルを作り直したセッション"""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def client(db):
+    """lifespan（テーブル作成・バックグラウンドタスク）込みのAPIクライアント"""
+    from fastapi.testclient import TestClient
+
+    import main
+    with TestClient(main.app) as test_client:
+        yield test_client
@@ -0,0 +1,131 @@
+"""jobs: リース付きのジョブキュー（取得・ハートビート・完了・失敗・リース切れ）"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import jobs
+import scheduler
+from models import Job, Video
+
+
+@pytest.fixture
+def video(db):
+    video = Video(filename="clip.mp4", original_path="clip.mp4")
+    db.add(video)
+    db.commit()
+    return video
+
+
+def expire_lease(db, job: Job):
+    db.query(Job).filter(Job.id == job.id).update({"lease_expires_at": datetime.utcnow() - timedelta(seconds=1)})
+    db.commit()
+
+
+def test_enqueue_dedupes_unfinished_jobs(db, video):
+    first = jobs.enqueue(db, "export", video.id, dedupe_key="export:1")
+    assert jobs.enqueue(db, "export", video.id, dedupe_key="export:1").id == first.id
+    assert first.priority == scheduler.EXPORT
+
+    jobs.claim(db, "w1")
+    jobs.complete(db, first.id, "w1")
+    # 完了後は同じキーでも新しいジョブになる
+    assert jobs.enqueue(db, "export", video.id, dedupe_key="export:1").id != first.id
+
+
+def test_claim_order_and_exclusivity(db, video):
+    export = jobs.enqueue(db, "export", video.id)
+    segment = jobs.enqueue(db, "segment", video.id)
+
+    # 優先度の高い（値の小さい）ジョブから
+    job = jobs.claim(db, "w1")
+    assert job.id == segment.id
+    assert (job.status, job.lease_owner, job.attempts) == ("running", "w1", 1)
+    # 実行中のジョブは他のワーカーが取得できない
+    assert jobs.claim_job(db, segment.id, "w2") is None
+    assert jobs.claim(db, "w2").id == export.id
+    assert jobs.claim(db, "w3") is None
+
+
+def test_claim_filters_kinds(db, video):
+    jobs.enqueue(db, "segment", video.id)
+    export = jobs.enqueue(db, "export", video.id)
+    assert jobs.claim(db, "w1", kinds=["export"]).id == export.id
+
+
+def test_claim_limits_running_jobs_per_client(db, video, monkeypatch):
+    monkeypatch.setattr(jobs, "MAX_RUNNING_PER_CLIENT", 1)
+    jobs.enqueue(db, "segment", video.id, client_id="a")
+    jobs.enqueue(db, "segment", video.id, client_id="a")
+    other = jobs.enqueue(db, "segment", video.id, client_id="b")
+
+    assert jobs.claim(db, "w1").client_id == "a"
+    # aのジョブは実行中が上限なので後回し
+    assert jobs.claim(db, "w2").id == other.id
+    assert jobs.claim(db, "w3") is None
+
+
+def test_heartbeat_and_complete_require_lease(db, video):
+    job = jobs.enqueue(db, "segment", video.id)
+    jobs.claim(db, "w1")
+
+    assert jobs.heartbeat(db, job.id, "w1", done=2, total=5)
+    assert not jobs.heartbeat(db, job.id, "w2")
+    assert not jobs.complete(db, job.id, "w2")
+    assert jobs.complete(db, job.id, "w1", {"segments_count": 5})
+
+    db.refresh(job)
+    assert jobs.job_to_dict(job) == {
+        "job_id": job.id, "kind": "segment", "video_id": video.id, "status": "done", "attempts": 1,
+        "done": 2, "total": 5, "result": {"segments_count": 5}, "error": None
+    }
+    # 完了後はハートビートしてもリースは戻らない
+    assert not jobs.heartbeat(db, job.id, "w1")
+
+
+def test_fail_retries_until_max_attempts(db, video):
+    job = jobs.enqueue(db, "segment", video.id, max_attempts=2)
+
+    jobs.claim(db, "w1")
+    assert not jobs.fail(db, job.id, "w2", "not mine")
+    assert jobs.fail(db, job.id, "w1", "boom")
+    db.refresh(job)
+    assert (job.status, job.error, job.lease_owner) == ("queued", "boom", None)
+
+    assert jobs.claim(db, "w1").attempts == 2
+    assert jobs.fail(db, job.id, "w1", "boom again")
+    db.refresh(job)
+    assert job.status == "failed"
+    assert jobs.claim(db, "w1") is None
+
+
+def test_expired_lease_is_requeued(db, video):
+    job = jobs.enqueue(db, "segment", video.id, max_attempts=2)
+    jobs.claim(db, "w1")
+    expire_lease(db, job)
+
+    # リースの切れたジョブは別のワーカーが取り直し、元のワーカーは完了を記録できない
+    assert jobs.claim(db, "w2").id == job.id
+    assert not jobs.complete(db, job.id, "w1")
+    assert not jobs.fail(db, job.id, "w1", "late")
+
+    # 試行回数を使い切ったジョブはリース切れで失敗にする
+    expire_lease(db, job)
+    assert jobs.requeue_expired(db) == 1
+    db.refresh(job)
+    assert (job.status, job.error) == ("failed", "Lease expired")
+
+
+def test_admission_limits(db, video, monkeypatch):
+    monkeypatch.setitem(jobs.MAX_QUEUED, scheduler.EXPORT, 2)
+    monkeypatch.setattr(jobs, "MAX_PENDING_PER_CLIENT", 3)
+    jobs.enqueue(db, "export", video.id, client_id="a", admit=True)
+    jobs.enqueue(db, "export", video.id, client_id="a", admit=True, dedupe_key="export:2")
+    with pytest.raises(jobs.Backpressure) as e:
+        jobs.enqueue(db, "export", video.id, client_id="b", admit=True)
+    assert e.value.retry_after == jobs.DEFAULT_RETRY_AFTER
+    # 登録済みのジョブは混雑時でも返す
+    assert jobs.enqueue(db, "export", video.id, client_id="a", admit=True, dedupe_key="export:2")
+
+    jobs.enqueue(db, "segment", video.id, client_id="a", admit=True)
+    with pytest.raises(jobs.Backpressure, match="this client"):
+        jobs.enqueue(db, "segment", video.id, client_id="a", admit=True)
@@ -0,0 +1,93 @@
+"""migrate_schema: 旧スキーマのDB（判定が文字列・状態や集計の列がない）の変換と値の埋め戻し"""
+import pytest
+from sqlalchemy import event, inspect, text
+
+import migrate_schema
+from db import SessionLocal, engine, needs_schema_migration
+from models import Base, Segment, Video
+
+LEGACY_SCHEMA = [
+    """CREATE TABLE videos (
+        id INTEGER PRIMARY KEY, filename VARCHAR NOT NULL, original_path VARCHAR NOT NULL,
+        source VARCHAR, source_id VARCHAR, created_at DATETIME
+    )""",
+    """CREATE TABLE segments (
+        id INTEGER PRIMARY KEY, video_id INTEGER NOT NULL REFERENCES videos (id), "index" INTEGER NOT NULL,
+        path VARCHAR NOT NULL, start_sec FLOAT NOT NULL, end_sec FLOAT NOT NULL,
+        decision VARCHAR DEFAULT 'pending', name VARCHAR, created_at DATETIME, size_bytes BIGINT
+    )""",
+    'CREATE INDEX ix_segments_dup_cluster ON segments (video_id)',
+]
+
+
+@pytest.fixture
+def legacy_db():
+    Base.metadata.drop_all(bind=engine)
+    with engine.begin() as conn:
+        for statement in LEGACY_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text(
+            "INSERT INTO videos (id, filename, original_path, source, created_at) VALUES "
+            "(1, 'segmented.mp4', '/nonexistent/segmented.mp4', 'upload', '2024-01-01 00:00:00'), "
+            "(2, 'empty.mp4', '/nonexistent/empty.mp4', 'upload', '2024-01-02 00:00:00')"
+        ))
+        conn.execute(text(
+            'INSERT INTO segments (video_id, "index", path, start_sec, end_sec, decision, size_bytes) VALUES '
+            "(1, 0, 'a.mp4', 0, 60, 'keep', 100), (1, 1, 'b.mp4', 60, 120, 'drop', 200), "
+            "(1, 2, 'c.mp4', 120, 150, 'pending', 300), (1, 3, 'd.mp4', 150, 160, 'keep', 400)"
+        ))
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+def test_migrate_legacy_database(legacy_db):
+    assert needs_schema_migration()
+    migrate_schema.migrate()
+    assert not needs_schema_migration()
+
+    indexes = {index["name"] for index in inspect(engine).get_indexes("segments")}
+    assert "ix_segments_dup_cluster" not in indexes
+    assert "ix_segments_video_decision_index" in indexes
+
+    db = SessionLocal()
+    try:
+        decisions = [s.decision for s in db.query(Segment).order_by(Segment.index)]
+        assert decisions == ["keep", "drop", "pending", "keep"]
+
+        segmented, empty = db.query(Video).order_by(Video.id).all()
+        # 状態の列の追加前に分割された動画は segmented（再分割・ライブラリの絞り込みの対象になる）
+        assert segmented.status == "segmented"
+        assert empty.status is None
+        assert (segmented.segment_count, segmented.kept_count, segmented.dropped_count) == (4, 2, 1)
+        assert segmented.kept_duration_sec == 70
+        assert segmented.storage_bytes == 1000
+        assert empty.segment_count == 0
+    finally:
+        db.close()
+
+
+def test_migrate_is_idempotent(legacy_db, capsys):
+    assert migrate_schema.migrate()
+    capsys.readouterr()
+
+    # 変換済みのDBでは何も書かない（起動のたびにDB全体をVACUUMで書き直さない）
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement.lstrip().upper())
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        assert not migrate_schema.migrate()
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert statements
+    assert not [s for s in statements if s.startswith(("VACUUM", "ALTER", "CREATE", "DROP", "INSERT", "UPDATE"))]
+    assert "Converting" not in capsys.readouterr().out
+
+
+def test_dry_run_changes_nothing(legacy_db):
+    assert not migrate_schema.migrate(dry_run=True)
+    assert needs_schema_migration()
+    columns = {column["name"] for column in inspect(engine).get_columns("videos")}
+    assert "status" not in columns
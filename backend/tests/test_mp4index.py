@@ -0,0 +1,140 @@
+"""mp4index: moovだけを読むパーサ（壊れた・途中で切れたファイルは Mp4ParseError にする）"""
+import struct
+
+import pytest
+
+from mp4index import Mp4ParseError, read_index
+
+TIMESCALE = 1000
+SAMPLE_DELTA = 500  # 0.5秒ごとのサンプル
+SAMPLE_COUNT = 8
+KEYFRAMES = [1, 5]  # stssは1始まり
+
+
+def box(box_type: bytes, *payload: bytes) -> bytes:
+    body = b"".join(payload)
+    return struct.pack(">I4s", 8 + len(body), box_type) + body
+
+
+def full_box(box_type: bytes, *payload: bytes, version: int = 0) -> bytes:
+    return box(box_type, struct.pack(">I", version << 24), *payload)
+
+
+def video_track(mdat_offset: int, ctts=None, edits=None) -> bytes:
+    """ctts: [(サンプル数, オフセット), ...]、edits: [(長さ（ムービーのタイムスケール）, media_time), ...]"""
+    duration = SAMPLE_DELTA * SAMPLE_COUNT
+    sample_entry = b"\0" * 6 + struct.pack(">H", 1) + b"\0" * 16 + struct.pack(">HH", 320, 240)
+    composition = []
+    if ctts:
+        entries = b"".join(struct.pack(">Ii", count, offset) for count, offset in ctts)
+        composition.append(full_box(b"ctts", struct.pack(">I", len(ctts)), entries))
+    edit_list = []
+    if edits:
+        entries = b"".join(struct.pack(">Iihh", length, media_time, 1, 0) for length, media_time in edits)
+        edit_list.append(box(b"edts", full_box(b"elst", struct.pack(">I", len(edits)), entries)))
+    stbl = box(
+        b"stbl",
+        full_box(b"stsd", struct.pack(">I", 1), box(b"avc1", sample_entry)),
+        full_box(b"stts", struct.pack(">III", 1, SAMPLE_COUNT, SAMPLE_DELTA)),
+        *composition,
+        full_box(b"stss", struct.pack(">I", len(KEYFRAMES)), *(struct.pack(">I", n) for n in KEYFRAMES)),
+        full_box(b"stsc", struct.pack(">IIII", 1, 1, SAMPLE_COUNT, 1)),
+        full_box(b"stsz", struct.pack(">II", 100, SAMPLE_COUNT)),
+        full_box(b"stco", struct.pack(">II", 1, mdat_offset)),
+    )
+    return box(
+        b"trak",
+        full_box(b"tkhd", b"\0" * 8, struct.pack(">I", 1), b"\0" * 68),
+        *edit_list,
+        box(
+            b"mdia",
+            full_box(b"mdhd", b"\0" * 8, struct.pack(">II", TIMESCALE, duration), b"\0" * 4),
+            full_box(b"hdlr", b"\0" * 4, b"vide", b"\0" * 13),
+            box(b"minf", stbl),
+        ),
+    )
+
+
+def build_mp4(moov_first: bool = True, **track) -> bytes:
+    """ftyp・moov・mdat（100バイトのサンプル×8）の最小限のMP4"""
+    ftyp = box(b"ftyp", b"isom", struct.pack(">I", 512), b"isomavc1")
+    mdat = box(b"mdat", b"\0" * (100 * SAMPLE_COUNT))
+
+    def moov(mdat_offset: int) -> bytes:
+        mvhd = full_box(b"mvhd", b"\0" * 8, struct.pack(">II", TIMESCALE, SAMPLE_DELTA * SAMPLE_COUNT), b"\0" * 80)
+        return box(b"moov", mvhd, video_track(mdat_offset, **track))
+
+    if moov_first:
+        size = len(moov(0))
+        return ftyp + moov(len(ftyp) + size + 8) + mdat
+    return ftyp + mdat + moov(len(ftyp) + 8)
+
+
+def write(tmp_path, data: bytes) -> str:
+    path = tmp_path / "video.mp4"
+    path.write_bytes(data)
+    return str(path)
+
+
+@pytest.mark.parametrize("moov_first", [True, False])
+def test_reads_index(tmp_path, moov_first):
+    index = read_index(write(tmp_path, build_mp4(moov_first)), cache=False)
+    track = index.video_track
+    assert index.duration_sec == 4.0
+    assert (track.codec, track.width, track.height) == ("avc1", 320, 240)
+    assert track.keyframe_times() == [0.0, 2.0]
+    assert track.keyframe_before(3.9) == 2.0
+    assert track.sample_offsets[1] - track.sample_offsets[0] == 100
+
+
+def test_truncated_moov(tmp_path):
+    data = build_mp4(moov_first=True)
+    moov_start = data.index(b"moov") - 4
+    path = write(tmp_path, data[:moov_start + 200])
+    with pytest.raises(Mp4ParseError):
+        read_index(path, cache=False)
+
+
+def test_truncated_before_moov(tmp_path):
+    """moovが末尾にある動画がアップロード途中で切れた場合（mdatの途中まで）"""
+    data = build_mp4(moov_first=False)
+    path = write(tmp_path, data[:data.index(b"mdat") + 300])
+    with pytest.raises(Mp4ParseError, match="moov box not found"):
+        read_index(path, cache=False)
+
+
+def test_not_mp4(tmp_path):
+    path = write(tmp_path, b"\0\0\0\x04junk" + b"\xff" * 64)
+    with pytest.raises(Mp4ParseError):
+        read_index(path, cache=False)
+
+
+def test_cache_follows_file_changes(tmp_path):
+    path = write(tmp_path, build_mp4())
+    assert read_index(path).duration_sec == 4.0
+    # 同じパスのファイルが途中で切れたものに置き換わったらキャッシュを使わない
+    data = build_mp4()
+    write(tmp_path, data[:data.index(b"moov") + 100])
+    with pytest.raises(Mp4ParseError):
+        read_index(path)
+
+
+# Bフレームあり: デコード順 I P B B ...（表示はIの後にB B P）。cttsで表示時刻をずらし、elstのmedia_timeで打ち消す
+B_FRAME_CTTS = [(1, 500), (1, 1500), (2, 0), (1, 500), (1, 1500), (2, 0)]
+
+
+def test_keyframes_apply_edit_list_and_composition_offsets(tmp_path):
+    index = read_index(write(tmp_path, build_mp4(ctts=B_FRAME_CTTS, edits=[(4000, 500)])), cache=False)
+    assert index.video_track.keyframe_times() == [0.0, 2.0]
+    assert index.start_time == 0.0
+    # elstがなければffmpegと同じくcttsの分だけ後ろにずれる
+    index = read_index(write(tmp_path, build_mp4(ctts=B_FRAME_CTTS)), cache=False)
+    assert index.video_track.keyframe_times() == [0.5, 2.5]
+    assert index.start_time == 0.5
+
+
+def test_keyframes_after_empty_edit(tmp_path):
+    """先頭の空の編集（media_time -1）の分だけ表示が遅れる"""
+    index = read_index(write(tmp_path, build_mp4(edits=[(250, -1), (4000, 0)])), cache=False)
+    assert index.video_track.keyframe_times() == [0.25, 2.25]
+    assert index.start_time == 0.25
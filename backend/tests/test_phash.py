@@ -0,0 +1,32 @@
+"""類似セグメントのクラスタリング"""
+import numpy as np
+
+import phash
+
+
+def flipped(bits: int) -> str:
+    """全ビット0のハッシュの先頭bitsビットを立てたもの"""
+    hashed = np.zeros(phash.HASH_BITS, dtype=bool)
+    hashed[:bits] = True
+    return np.packbits(hashed).tobytes().hex()
+
+
+def test_cluster_groups_near_duplicates():
+    hashes = [flipped(0), flipped(150), flipped(3), None, flipped(152)]
+    assert phash.cluster(hashes, threshold=0.1) == [0, 1, 0, None, 1]
+
+
+def test_cluster_does_not_chain_through_intermediate_segments():
+    # A~B, B~C（それぞれ12bit差）だが A と C は24bit差でしきい値（19bit）を超える
+    a, b, c = flipped(0), flipped(12), flipped(24)
+    assert phash.cluster([a, b, c], threshold=0.1) == [0, 0, None]
+    assert phash.cluster([a, c], threshold=0.1) == [None, None]
+
+
+def test_cluster_joins_nearest_head():
+    # 1つ目の先頭(0)にも2つ目の先頭(30)にもしきい値内の16は、近い方の30へ
+    assert phash.cluster([flipped(0), flipped(30), flipped(16)], threshold=0.1) == [None, 1, 1]
+
+
+def test_cluster_needs_two_hashes():
+    assert phash.cluster([flipped(0), None]) == [None, None]
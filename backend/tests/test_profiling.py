@@ -0,0 +1,48 @@
+"""プロファイリング: スレッドに逃がした処理もリクエストの時間として数える"""
+import asyncio
+import sys
+import time
+
+import profiling
+
+
+def busy(seconds: float) -> str:
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+    return "done"
+
+
+def profile_request(monkeypatch, handler) -> profiling.Profile:
+    monkeypatch.setattr(profiling, "ENABLED", True)
+    profile = profiling.Profile("POST", "/api/upload", sys._getframe())
+    token = profiling._active.set(profile)
+    profiling._start(profile)
+    try:
+        asyncio.run(handler())
+    finally:
+        profiling._finish(profile)
+        profiling._active.reset(token)
+    return profile
+
+
+def test_to_thread_is_sampled(monkeypatch):
+    async def handler():
+        assert await profiling.to_thread(busy, 0.2) == "done"
+
+    profile = profile_request(monkeypatch, handler)
+    summary = profile.summary()
+    assert any("busy (test_profiling.py" in stack for stack in profile.samples)
+    assert summary["python_ms"] > summary["idle_ms"]
+
+
+def test_plain_to_thread_counts_as_idle(monkeypatch):
+    async def handler():
+        await asyncio.to_thread(busy, 0.2)
+
+    profile = profile_request(monkeypatch, handler)
+    assert not any("busy" in stack for stack in profile.samples)
+
+
+def test_to_thread_without_profile():
+    assert asyncio.run(profiling.to_thread(busy, 0)) == "done"
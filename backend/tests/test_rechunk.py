@@ -0,0 +1,161 @@
+"""再分割: 同じ動画への重複した依頼・分割中の判定・旧セグメントに対するジョブの扱い
+（ffmpegでの切り出しは _cut_rechunk を差し替えて省く）"""
+import os
+
+import pytest
+
+from db import SessionLocal
+
+import jobs
+import tasks
+from models import Job, Segment, Video
+
+
+@pytest.fixture
+def video(db):
+    video = Video(filename="clip.mp4", original_path="/nonexistent/clip.mp4", status="segmented",
+                  chunk_sec=60, segments_total=2)
+    db.add(video)
+    db.flush()
+    db.add_all([
+        Segment(video_id=video.id, index=0, path="/nonexistent/s0.mp4", start_sec=0, end_sec=60, decision="keep"),
+        Segment(video_id=video.id, index=1, path="/nonexistent/s1.mp4", start_sec=60, end_sec=120),
+    ])
+    db.commit()
+    return video
+
+
+def new_segments(job_id: int):
+    info = {"size_bytes": 1, "duration_sec": 30.0}
+    return [(start, start + 30.0, f"/nonexistent/s{start:g}_r{job_id}.mp4", info) for start in (0.0, 30.0, 60.0, 90.0)]
+
+
+def test_rechunk_request_is_deduped_by_parameters(client, video):
+    first = client.post(f"/api/videos/{video.id}/rechunk?chunk_sec=30")
+    assert first.status_code == 202
+    # 同じ指定は同じジョブ
+    again = client.post(f"/api/videos/{video.id}/rechunk?chunk_sec=30")
+    assert again.json()["job_id"] == first.json()["job_id"]
+    # 違う指定は古い設定のジョブを黙って返さずに断る
+    other = client.post(f"/api/videos/{video.id}/rechunk?cuts=10,20")
+    assert other.status_code == 409
+    assert other.headers["Location"] == f"/api/jobs/{first.json()['job_id']}"
+
+
+def test_rechunk_blocks_decisions_and_replaces_jobs(client, db, video, monkeypatch):
+    stale_analyze = jobs.enqueue(db, "analyze", video.id, dedupe_key=f"analyze:{video.id}")
+    job = jobs.enqueue(db, "rechunk", video.id, {"chunk_sec": 30}, dedupe_key=f"rechunk:{video.id}")
+    job = jobs.claim_job(db, job.id, "w1")
+    segment_id = db.query(Segment.id).filter(Segment.index == 1).scalar()
+    seen = {}
+
+    def cut(video, job, payload, report):
+        db.refresh(video)
+        seen["status"] = video.status
+        # 差し替え前の判定・表示は受け付けない
+        seen["decide"] = client.post(f"/api/decide?segment_id={segment_id}&decision=drop").status_code
+        seen["next"] = client.get(f"/api/next_segment?video_id={video.id}").status_code
+        return new_segments(job.id), 30
+
+    monkeypatch.setattr(tasks, "_cut_rechunk", cut)
+    result = tasks.run_rechunk_job(db, job, lambda done, total: None)
+
+    assert seen == {"status": "segmenting", "decide": 409, "next": 409}
+    assert result == {"segments_count": 4, "carried_decisions": 2}
+    db.refresh(video)
+    assert (video.status, video.segments_total, video.chunk_sec) == ("segmented", 4, 30)
+    assert [s.decision for s in db.query(Segment).order_by(Segment.index)] == ["keep", "keep", "pending", "pending"]
+
+    db.refresh(stale_analyze)
+    assert stale_analyze.status == "failed"
+    queued = db.query(Job).filter(Job.status == "queued").all()
+    assert sorted(j.kind for j in queued) == ["analyze", "preview"]
+    jobs.complete(db, job.id, "w1", result)
+    assert client.post(f"/api/decide?segment_id={segment_id}&decision=drop").status_code == 200
+
+
+def test_failed_rechunk_restores_status(db, video, monkeypatch):
+    job = jobs.enqueue(db, "rechunk", video.id, {"chunk_sec": 30})
+    job = jobs.claim_job(db, job.id, "w1")
+
+    def cut(video, job, payload, report):
+        raise RuntimeError("ffmpeg failed")
+
+    monkeypatch.setattr(tasks, "_cut_rechunk", cut)
+    with pytest.raises(RuntimeError):
+        tasks.run_rechunk_job(db, job, lambda done, total: None)
+    db.refresh(video)
+    assert video.status == "segmented"
+    assert db.query(Segment).count() == 2
+
+
+def test_results_for_replaced_segments_are_discarded(db, video):
+    """解析・プレビューのジョブの実行中に切り直されたら（行IDが再利用されても）結果を書かない"""
+    segments = db.query(Segment).filter(Segment.video_id == video.id).order_by(Segment.index).all()
+    ids = [s.id for s in segments]
+
+    other = SessionLocal()
+    try:
+        other.query(Segment).filter(Segment.video_id == video.id).delete()
+        tasks.insert_segments(other, [
+            {"id": segment_id, "video_id": video.id, "index": i, "path": f"/nonexistent/new{i}.mp4",
+             "start_sec": i * 60.0, "end_sec": (i + 1) * 60.0, "decision": "pending"}
+            for i, segment_id in enumerate(ids)
+        ])
+        other.commit()
+    finally:
+        other.close()
+
+    for segment in segments:
+        segment.loudness_db = -20.0
+    assert not tasks.commit_unless_rechunked(db, video.id, segments)
+    assert db.query(Segment).filter(Segment.loudness_db.isnot(None)).count() == 0
+
+    segments = db.query(Segment).filter(Segment.video_id == video.id).all()
+    for segment in segments:
+        segment.loudness_db = -20.0
+    assert tasks.commit_unless_rechunked(db, video.id, segments)
+    assert db.query(Segment).filter(Segment.loudness_db.isnot(None)).count() == 2
+
+
+def test_superseded_previews_do_not_touch_new_previews(db, video, monkeypatch):
+    """切り直しで行IDが再利用されても、結果を捨てる旧ジョブのプレビューと新しいジョブのプレビューは別ファイル"""
+    import blobstore
+    import preview
+
+    old_job = jobs.enqueue(db, "preview", video.id)
+    new_job = jobs.enqueue(db, "preview", video.id, dedupe_key=f"preview:{video.id}:r1")
+    monkeypatch.setattr(blobstore, "fetch", lambda path: path)
+
+    def render(video_path, ranges, destinations):
+        for destination in destinations:
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            open(destination, "wb").close()
+        return [True] * len(destinations)
+
+    monkeypatch.setattr(preview, "render", render)
+    segments = db.query(Segment).filter(Segment.video_id == video.id).order_by(Segment.index).all()
+    new_paths = [preview.preview_path(s, new_job.id) for s in segments]
+    assert set(new_paths).isdisjoint(preview.preview_path(s, old_job.id) for s in segments)
+    render(None, None, new_paths)
+
+    def render_then_rechunk(video_path, ranges, destinations):
+        written = render(video_path, ranges, destinations)
+        other = SessionLocal()
+        try:
+            ids = [s.id for s in other.query(Segment).filter(Segment.video_id == video.id).order_by(Segment.index)]
+            other.query(Segment).filter(Segment.video_id == video.id).delete()
+            tasks.insert_segments(other, [
+                {"id": segment_id, "video_id": video.id, "index": i, "path": f"/nonexistent/new{i}.mp4",
+                 "start_sec": i * 60.0, "end_sec": (i + 1) * 60.0, "decision": "pending"}
+                for i, segment_id in enumerate(ids)
+            ])
+            other.commit()
+        finally:
+            other.close()
+        return written
+
+    monkeypatch.setattr(preview, "render", render_then_rechunk)
+    assert tasks.run_preview_job(db, old_job, lambda done, total: None) == {"previews": 0, "superseded": True}
+    assert not any(os.path.exists(preview.preview_path(s, old_job.id)) for s in segments)
+    assert all(os.path.exists(path) for path in new_paths)
@@ -0,0 +1,43 @@
+"""scheduler: ffmpegの実行枠（優先度ごとの枠数と、ロックを取らない実行数の確認）"""
+import fcntl
+import os
+
+import pytest
+
+import scheduler
+
+
+@pytest.fixture(autouse=True)
+def slot_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(scheduler, "SLOT_DIR", str(tmp_path))
+    monkeypatch.setattr(scheduler, "MAX_CONCURRENCY", 4)
+    monkeypatch.setattr(scheduler, "RESERVED_INTERACTIVE", 1)
+    return tmp_path
+
+
+def test_slot_limits():
+    assert scheduler.slot_limit(scheduler.INTERACTIVE) == 4
+    assert scheduler.slot_limit(scheduler.INGEST) == 3
+    assert scheduler.slot_limit(scheduler.EXPORT) == 1
+
+
+def test_running_count_does_not_take_slots(slot_dir):
+    assert scheduler.running_count() == 0
+    with scheduler.slot(scheduler.INGEST) as first, scheduler.slot(scheduler.INGEST) as second:
+        assert (first, second) == (0, 1)
+        assert scheduler.running_count() == 2
+        # 数えている間も枠は空かない（別プロセスが取ろうとしても取れない）
+        fd = os.open(os.path.join(slot_dir, "slot_0.lock"), os.O_RDWR)
+        try:
+            with pytest.raises(BlockingIOError):
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        finally:
+            os.close(fd)
+    assert scheduler.running_count() == 0
+
+
+def test_running_count_ignores_dead_processes(slot_dir):
+    # 落ちたプロセスの枠はロックが外れていて、PIDだけが残る
+    (slot_dir / "slot_0.lock").write_text("999999999")
+    (slot_dir / "slot_1.lock").write_text(str(os.getpid()))
+    assert scheduler.running_count() == 1
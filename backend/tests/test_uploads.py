@@ -0,0 +1,156 @@
+"""再開可能なチャンクアップロード（/api/uploads）"""
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import jobs
+import uploads
+from db import SessionLocal, refresh_for_update
+from models import UploadSession, Video
+
+DATA = os.urandom(300_000)
+
+
+def checksum(data: bytes, algorithm: str = "sha256") -> str:
+    return f"{algorithm} {base64.b64encode(hashlib.new(algorithm, data).digest()).decode()}"
+
+
+def create(client, size: int = len(DATA)) -> str:
+    r = client.post("/api/uploads", params={"filename": "clip.mp4", "size": size, "chunk_sec": 20})
+    assert r.status_code == 201
+    assert r.headers["Upload-Offset"] == "0"
+    return r.json()["upload_id"]
+
+
+def patch(client, upload_id: str, offset: int, data: bytes, **headers):
+    return client.patch(f"/api/uploads/{upload_id}", content=data, headers={"Upload-Offset": str(offset), **headers})
+
+
+def test_merge_range():
+    assert uploads.merge_range([(0, 10), (20, 30)], 10, 20) == [(0, 30)]
+    assert uploads.merge_range([(20, 30)], 0, 5) == [(0, 5), (20, 30)]
+    assert uploads.merge_range([(0, 10)], 5, 8) == [(0, 10)]
+
+
+def test_out_of_order_chunks(client, db):
+    upload_id = create(client)
+    chunks = [(200_000, DATA[200_000:]), (0, DATA[:100_000]), (100_000, DATA[100_000:200_000])]
+
+    r = patch(client, upload_id, *chunks[0])
+    assert r.status_code == 204
+    # 先頭が届くまでは Upload-Offset は進まない
+    assert r.headers["Upload-Offset"] == "0"
+    r = patch(client, upload_id, *chunks[1])
+    assert r.headers["Upload-Offset"] == "100000"
+    status = client.get(f"/api/uploads/{upload_id}").json()
+    assert status["ranges"] == [[0, 100_000], [200_000, len(DATA)]]
+    assert status["received"] == len(DATA) - 100_000
+
+    # 欠けがあるうちは完了できない
+    assert client.post(f"/api/uploads/{upload_id}/complete").status_code == 409
+
+    r = patch(client, upload_id, *chunks[2])
+    assert r.headers["Upload-Offset"] == str(len(DATA))
+    r = client.post(f"/api/uploads/{upload_id}/complete")
+    assert r.status_code == 200
+    video = db.get(Video, r.json()["video_id"])
+    with open(video.original_path, "rb") as f:
+        assert f.read() == DATA
+
+
+def test_resend_same_chunk(client):
+    """再送（同じ範囲の二重送信）は受信済み範囲を増やさない"""
+    upload_id = create(client)
+    patch(client, upload_id, 0, DATA[:1000])
+    r = patch(client, upload_id, 0, DATA[:1000])
+    assert r.status_code == 204
+    assert client.get(f"/api/uploads/{upload_id}").json()["received"] == 1000
+
+
+def test_checksum_mismatch(client, db):
+    upload_id = create(client)
+    good = DATA[:100_000]
+    assert patch(client, upload_id, 0, good, **{"Upload-Checksum": checksum(good)}).status_code == 204
+
+    # 受信済みの範囲へ壊れたデータを送っても上書きされず、範囲も増えない
+    corrupted = b"\0" * 200_000
+    r = patch(client, upload_id, 0, corrupted, **{"Upload-Checksum": checksum(DATA[:200_000])})
+    assert r.status_code == 460
+    status = client.get(f"/api/uploads/{upload_id}").json()
+    assert status["ranges"] == [[0, 100_000]]
+
+    rest = DATA[100_000:]
+    assert patch(client, upload_id, 100_000, rest, **{"Upload-Checksum": checksum(rest, "md5")}).status_code == 204
+    r = client.post(f"/api/uploads/{upload_id}/complete")
+    assert r.status_code == 200
+    with open(db.get(Video, r.json()["video_id"]).original_path, "rb") as f:
+        assert f.read() == DATA
+
+
+@pytest.mark.parametrize("header", ["sha256", "crc32 AAAA", "sha256 not-base64!"])
+def test_malformed_checksum(client, header):
+    upload_id = create(client)
+    assert patch(client, upload_id, 0, DATA[:10], **{"Upload-Checksum": header}).status_code == 400
+
+
+def test_chunk_beyond_length(client):
+    upload_id = create(client, size=1000)
+    assert patch(client, upload_id, 500, DATA[:1000]).status_code == 413
+    assert patch(client, upload_id, 1000, DATA[:1]).status_code == 400
+
+
+def test_complete_is_idempotent(client, db):
+    upload_id = create(client)
+    patch(client, upload_id, 0, DATA)
+    first = client.post(f"/api/uploads/{upload_id}/complete")
+    second = client.post(f"/api/uploads/{upload_id}/complete")
+    assert first.status_code == second.status_code == 200
+    assert second.json()["video_id"] == first.json()["video_id"]
+    assert second.json()["job_id"] == first.json()["job_id"]
+    # 動画・分割ジョブは1件だけ
+    assert db.query(Video).count() == 1
+    assert db.query(jobs.Job).filter(jobs.Job.kind == "segment").count() == 1
+    # 完了後のチャンクは受け付けない
+    assert patch(client, upload_id, 0, DATA[:10]).status_code == 409
+
+
+def test_abort_removes_temp_file(client, db):
+    upload_id = create(client)
+    temp_path = db.get(UploadSession, upload_id).temp_path
+    assert os.path.exists(temp_path)
+    assert client.delete(f"/api/uploads/{upload_id}").status_code == 204
+    assert not os.path.exists(temp_path)
+    assert client.get(f"/api/uploads/{upload_id}").status_code == 404
+
+
+def test_concurrent_ranges_are_not_lost(client):
+    """別プロセスのチャンクが読み込み〜コミットの間に受信範囲を更新しても、どちらの範囲も失われない"""
+    upload_id = create(client)
+    first, second = SessionLocal(), SessionLocal()
+    try:
+        held = first.get(UploadSession, upload_id)
+        refresh_for_update(first, held)
+        ranges = uploads.get_ranges(held)
+
+        other = threading.Thread(
+            target=uploads.record_range, args=(second, second.get(UploadSession, upload_id), 100, 200)
+        )
+        other.start()
+        time.sleep(0.3)
+        # ロックを持っている間は、もう一方は読み込みの前で待っている
+        assert other.is_alive()
+        held.received = json.dumps(uploads.merge_range(ranges, 0, 100))
+        first.commit()
+        other.join(timeout=10)
+        assert not other.is_alive()
+
+        first.refresh(held)
+        assert uploads.get_ranges(held) == [(0, 200)]
+    finally:
+        first.close()
+        second.close()
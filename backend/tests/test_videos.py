@@ -0,0 +1,30 @@
+"""動画の削除"""
+import asyncio
+
+import blobstore
+import storage
+from models import Segment, Video
+
+
+def test_delete_video_keeps_blob_deletion_off_the_event_loop(client, db, monkeypatch):
+    video = Video(filename="clip.mp4", original_path="/nonexistent/clip.mp4", status="segmented")
+    db.add(video)
+    db.flush()
+    db.add(Segment(video_id=video.id, index=0, path="/nonexistent/s0.mp4", start_sec=0, end_sec=10))
+    db.commit()
+    video_id = video.id
+    deleted = []
+
+    def delete_tree(prefix):
+        try:
+            asyncio.get_running_loop()
+            deleted.append(("event loop", prefix))
+        except RuntimeError:
+            deleted.append(("thread", prefix))
+
+    monkeypatch.setattr(blobstore, "delete_tree", delete_tree)
+    assert client.delete(f"/api/videos/{video_id}").status_code == 200
+    assert deleted == [("thread", storage.video_dir(video_id))]
+    db.expire_all()
+    assert db.query(Video).count() == 0 and db.query(Segment).count() == 0
+    assert client.delete(f"/api/videos/{video_id}").status_code == 404
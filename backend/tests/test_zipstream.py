@@ -0,0 +1,73 @@
+"""zipstream: archive_size（Content-Length）が実際に出力されるバイト数と一致すること"""
+import io
+import os
+import zipfile
+import zlib
+from datetime import datetime
+
+import zipstream
+
+
+def entry(tmp_path, name: str, data: bytes, arcname: str = None, modified: datetime = None) -> zipstream.ZipEntry:
+    path = tmp_path / name
+    path.write_bytes(data)
+    return zipstream.ZipEntry(str(path), arcname or name, len(data), zlib.crc32(data), modified)
+
+
+def stream(entries) -> bytes:
+    return b"".join(zipstream.iter_archive(entries))
+
+
+def test_archive_size_matches_stream(tmp_path):
+    contents = {
+        "segment_000.mp4": os.urandom(zipstream.READ_BLOCK + 123),
+        "empty.mp4": b"",
+        "small.mp4": b"abc",
+    }
+    entries = [entry(tmp_path, name, data, modified=datetime(2024, 5, 6, 7, 8, 9)) for name, data in contents.items()]
+    # 日本語のファイル名（UTF-8フラグ）
+    entries.append(entry(tmp_path, "named.mp4", b"keep", arcname="乾杯のシーン.mp4"))
+    contents["乾杯のシーン.mp4"] = b"keep"
+
+    data = stream(entries)
+    assert zipstream.archive_size(entries) == len(data)
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        assert {info.filename: archive.read(info) for info in archive.infolist()} == contents
+        assert archive.getinfo("segment_000.mp4").date_time == (2024, 5, 6, 7, 8, 8)
+        assert all(info.compress_type == zipfile.ZIP_STORED for info in archive.infolist())
+
+
+def test_archive_size_without_entries():
+    assert zipstream.archive_size([]) == len(stream([])) == 22
+
+
+def test_archive_size_with_zip64_end_records(tmp_path):
+    """エントリ数が65535以上になるとZIP64の終端レコードが付く"""
+    path = tmp_path / "empty.mp4"
+    path.write_bytes(b"")
+    entries = [
+        zipstream.ZipEntry(str(path), f"segment_{i:05d}.mp4", 0, 0)
+        for i in range(zipstream.ZIP_FILECOUNT_LIMIT)
+    ]
+    data = stream(entries)
+    assert zipstream.archive_size(entries) == len(data)
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert len(archive.infolist()) == zipstream.ZIP_FILECOUNT_LIMIT
+
+
+def test_zip64_entry_headers():
+    """4GiB以上のエントリはZIP64の拡張フィールドにサイズを入れる（ファイルは読まずにヘッダだけ確認）"""
+    size = zipstream.ZIP64_LIMIT + 10
+    entry = zipstream.ZipEntry("/nonexistent", "large.mp4", size, 0)
+    local = entry.local_header()
+    assert len(local) == 30 + len("large.mp4") + 20
+    assert local.endswith(size.to_bytes(8, "little") * 2)
+
+    second = zipstream.ZipEntry("/nonexistent", "next.mp4", 1, 0)
+    central_offset, central_size = zipstream._layout([entry, second])
+    assert second.offset == len(local) + size
+    # 4GiBを超えたオフセットもZIP64の拡張フィールドに入る
+    assert second.central_header().endswith(second.offset.to_bytes(8, "little"))
+    assert central_offset == second.offset + len(second.local_header()) + 1
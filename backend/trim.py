@@ -0,0 +1,176 @@
+"""
+セグメントのトリム（イン・アウト点）のスマートレンダリング
+端の不完全なGOPだけを再エンコードし、キーフレーム間の中央部分はストリームコピーする
+結果は (セグメントのファイル, イン点, アウト点) ごとにキャッシュする
+"""
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import zlib
+from typing import List, Optional, Tuple
+
+import blobstore
+import scheduler
+import storage
+from models import Segment
+from mp4index import Mp4ParseError, read_index
+from video import DEFAULT_CODEC, ENCODERS
+
+# キーフレームとの差がこれ未満なら再エンコードせずキーフレームで切る（秒）
+KEYFRAME_TOLERANCE = 0.02
+
+logger = logging.getLogger(__name__)
+
+
+def is_trimmed(segment: Segment) -> bool:
+    return segment.trim_in is not None or segment.trim_out is not None
+
+
+def trim_range(segment: Segment) -> Tuple[float, float]:
+    """セグメント先頭からの (イン点, アウト点) 秒"""
+    length = segment.duration_sec or (segment.end_sec - segment.start_sec)
+    trim_in = segment.trim_in or 0.0
+    trim_out = segment.trim_out if segment.trim_out is not None else length
+    return trim_in, min(trim_out, length)
+
+
+def source_key(segment: Segment) -> str:
+    """セグメントのファイルを表すキー（切り直すとSQLiteは削除した行IDを再利用するので、IDだけでは区別できない）"""
+    return f"{zlib.crc32(segment.path.encode()):08x}{segment.crc32 or 0:08x}"
+
+
+def trim_dir(video_id: int) -> str:
+    return os.path.join(storage.export_dir(video_id), "trim")
+
+
+def trim_path(segment: Segment) -> str:
+    trim_in, trim_out = trim_range(segment)
+    return os.path.join(
+        trim_dir(segment.video_id),
+        f"trim_{segment.id}_{source_key(segment)}_{int(trim_in * 1000)}_{int(trim_out * 1000)}.mp4"
+    )
+
+
+def discard_renders(video_id: int):
+    """トリム結果のキャッシュを消す（セグメントを切り直したとき）"""
+    shutil.rmtree(trim_dir(video_id), ignore_errors=True)
+
+
+def export_source(segment: Segment) -> str:
+    """エクスポートに使うファイル（トリムされていればレンダリング済みのファイル）"""
+    return trim_path(segment) if is_trimmed(segment) else storage.segment_path(segment)
+
+
+def is_rendered(segment: Segment) -> bool:
+    return (
+        not is_trimmed(segment)
+        or (segment.trim_size_bytes is not None and os.path.exists(trim_path(segment)))
+    )
+
+
+def plan(keyframes: List[float], trim_in: float, trim_out: float) -> List[Tuple[float, float, bool]]:
+    """切り出し計画 [(開始, 終了, ストリームコピーするか), ...]
+    イン点以降の最初のキーフレームからアウト点以前の最後のキーフレームまでをコピーし、前後だけ再エンコードする"""
+    inner = [k for k in keyframes if trim_in - KEYFRAME_TOLERANCE <= k <= trim_out + KEYFRAME_TOLERANCE]
+    if len(inner) < 2:
+        # 範囲内に完全なGOPがない場合は範囲全体を再エンコード（短いので安い）
+        return [(trim_in, trim_out, False)]
+
+    first, last = inner[0], inner[-1]
+    if trim_out - last < KEYFRAME_TOLERANCE:
+        last = trim_out
+    parts = []
+    if first - trim_in >= KEYFRAME_TOLERANCE:
+        parts.append((trim_in, first, False))
+    parts.append((max(first, trim_in), last, True))
+    if trim_out - last >= KEYFRAME_TOLERANCE:
+        parts.append((last, trim_out, False))
+    return parts
+
+
+def _cut_part(source: str, start: float, end: float, copy: bool, encoder: List[str], output_path: str):
+    """部分をAnnex B形式のまま書き出す。各部分の先頭にSPS/PPSを帯域内で持たせ、
+    再エンコード部分とコピー部分でパラメータセットが違っても連結後に正しくデコードできるようにする"""
+    cmd = ["ffmpeg", "-v", "error"]
+    if copy:
+        # キーフレームから始まるので入力側シークで正確に切れる
+        cmd += ["-ss", f"{start:.6f}", "-i", source, "-t", f"{end - start:.6f}", "-map", "0", "-c", "copy"]
+        cmd += ["-bsf:v", "h264_mp4toannexb" if "libx264" in encoder else "hevc_mp4toannexb"]
+    else:
+        cmd += ["-i", source, "-ss", f"{start:.6f}", "-t", f"{end - start:.6f}", "-map", "0"]
+        cmd += encoder + ["-preset", "veryfast", "-c:a", "aac", "-bsf:v", "dump_extra"]
+    # NUTはAnnex Bのパケットをそのまま保持できる（ffmpegのconcat demuxerで連結する中間形式）
+    cmd += ["-f", "nut", output_path, "-y"]
+    scheduler.run(cmd, check=True, capture_output=True)
+
+
+def render_trim(segment: Segment) -> str:
+    """トリム結果を書き出し（キャッシュ済みならそのまま返す）。サイズとCRC32をSegmentに記録する"""
+    output_path = trim_path(segment)
+    if os.path.exists(output_path):
+        if segment.trim_size_bytes is None:
+            _record_checksum(segment, output_path)
+        return output_path
+
+    source = blobstore.fetch(storage.segment_path(segment))
+    trim_in, trim_out = trim_range(segment)
+    try:
+        index = read_index(source)
+        track = index.video_track
+    except (Mp4ParseError, OSError):
+        index = track = None
+    # イン点・アウト点と -ss はファイルの開始時刻からの秒数なので、キーフレームの表示時刻もそれに合わせる
+    keyframes = [k - index.start_time for k in track.keyframe_times()] if track else []
+    encoder = ENCODERS.get(track.codec if track else None, ENCODERS[DEFAULT_CODEC])
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(output_path)) as work_dir:
+        parts = plan(keyframes, trim_in, trim_out)
+        list_path = os.path.join(work_dir, "parts.txt")
+        with open(list_path, "w") as f:
+            for i, (start, end, copy) in enumerate(parts):
+                part_path = os.path.join(work_dir, f"part_{i}.nut")
+                _cut_part(source, start, end, copy, encoder, part_path)
+                f.write(f"file '{os.path.abspath(part_path)}'\n")
+
+        temp_path = os.path.join(work_dir, "trimmed.mp4")
+        cmd = [
+            "ffmpeg", "-v", "error",
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            "-map", "0", "-c", "copy",
+            "-movflags", "+faststart",
+            temp_path, "-y"
+        ]
+        try:
+            scheduler.run(cmd, check=True, capture_output=True)
+        except subprocess.CalledProcessError as e:
+            raise Exception(f"Failed to trim segment {segment.index}: {e.stderr.decode(errors='ignore')[-500:]}")
+        os.replace(temp_path, output_path)
+
+    encoded = sum(end - start for start, end, copy in parts if not copy)
+    logger.info("✂️ Trimmed segment %d (%.2f-%.2fs, re-encoded %.2fs)", segment.index, trim_in, trim_out, encoded,
+                extra={"video_id": segment.video_id})
+    _record_checksum(segment, output_path)
+    return output_path
+
+
+def _record_checksum(segment: Segment, path: str):
+    """ZIPをストリーミングするためのサイズとCRC32"""
+    crc = 0
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(1024 * 1024)
+            if not block:
+                break
+            crc = zlib.crc32(block, crc)
+    segment.trim_size_bytes = os.path.getsize(path)
+    segment.trim_crc32 = crc
+
+
+def trimmed_duration(segment: Segment) -> Optional[float]:
+    if not is_trimmed(segment):
+        return segment.duration_sec
+    trim_in, trim_out = trim_range(segment)
+    return trim_out - trim_in
@@ -0,0 +1,222 @@
+"""
+再開可能なチャンクアップロード（tus方式）
+事前確保したファイルにpwriteでチャンクを書き込み、受信済み範囲をDBで管理する
+"""
+import base64
+import hashlib
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+import profiling
+from db import refresh_for_update
+from models import UploadSession, Video
+
+# 放置されたアップロードセッションの有効期限（秒）
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", str(24 * 60 * 60)))
+# クライアントに推奨するチャンクサイズ
+RECOMMENDED_CHUNK_SIZE = 8 * 1024 * 1024
+# 1リクエストで受け付けるチャンクの上限
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+# チェックサムなしのチャンクをスレッドで書き込む単位
+WRITE_BLOCK = 1024 * 1024
+
+CHECKSUM_ALGORITHMS = {"md5", "sha1", "sha256"}
+
+logger = logging.getLogger(__name__)
+
+
+class UploadError(Exception):
+    """アップロードプロトコル上のエラー（status_codeをHTTPレスポンスに使う）"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def get_ranges(session: UploadSession) -> List[Tuple[int, int]]:
+    return [tuple(r) for r in json.loads(session.received or "[]")]
+
+
+def merge_range(ranges: List[Tuple[int, int]], start: int, end: int) -> List[Tuple[int, int]]:
+    """受信済み範囲 [start, end) を追加して隣接・重複をまとめる"""
+    merged = []
+    for r_start, r_end in sorted(ranges + [(start, end)]):
+        if merged and r_start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], r_end))
+        else:
+            merged.append((r_start, r_end))
+    return merged
+
+
+def contiguous_offset(ranges: List[Tuple[int, int]]) -> int:
+    """先頭から途切れずに受信できているバイト数（HEADのUpload-Offset）"""
+    if ranges and ranges[0][0] == 0:
+        return ranges[0][1]
+    return 0
+
+
+def received_bytes(ranges: List[Tuple[int, int]]) -> int:
+    return sum(end - start for start, end in ranges)
+
+
+def parse_checksum(header: Optional[str]) -> Optional[Tuple[str, bytes]]:
+    """Upload-Checksumヘッダ（"<algorithm> <base64>"）を解析"""
+    if not header:
+        return None
+    try:
+        algorithm, encoded = header.strip().split(" ", 1)
+        digest = base64.b64decode(encoded.strip(), validate=True)
+    except ValueError:
+        raise UploadError(400, "Malformed Upload-Checksum header")
+    algorithm = algorithm.lower()
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise UploadError(400, f"Unsupported checksum algorithm: {algorithm}")
+    return algorithm, digest
+
+
+def create_session(db: Session, filename: str, size: int, chunk_sec: int, upload_dir: str) -> UploadSession:
+    """アップロードセッションを作成し、最終サイズのファイルを事前確保"""
+    if size <= 0:
+        raise UploadError(400, "Upload-Length must be positive")
+
+    upload_id = uuid.uuid4().hex
+    temp_path = os.path.join(upload_dir, f"{upload_id}.part")
+
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        if hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(fd, 0, size)
+            except OSError:
+                os.ftruncate(fd, size)
+        else:
+            os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+
+    session = UploadSession(
+        id=upload_id,
+        filename=os.path.basename(filename),
+        temp_path=temp_path,
+        size=size,
+        chunk_sec=chunk_sec,
+        received="[]",
+        expires_at=datetime.utcnow() + timedelta(seconds=UPLOAD_SESSION_TTL)
+    )
+    db.add(session)
+    db.commit()
+    db.refresh(session)
+    return session
+
+
+def get_session(db: Session, upload_id: str) -> UploadSession:
+    session = db.query(UploadSession).filter(UploadSession.id == upload_id).first()
+    if not session or session.expires_at < datetime.utcnow():
+        raise UploadError(404, "Upload session not found or expired")
+    return session
+
+
+def _pwrite_all(fd: int, data: bytes, offset: int) -> int:
+    view = memoryview(data)
+    total = len(view)
+    while view:
+        n = os.pwrite(fd, view, offset)
+        view = view[n:]
+        offset += n
+    return total
+
+
+async def write_chunk(
+    db: Session,
+    session: UploadSession,
+    offset: int,
+    body: AsyncIterator[bytes],
+    checksum: Optional[Tuple[str, bytes]] = None
+) -> int:
+    """チャンクを指定オフセットへpwriteし、チェックサムが一致した範囲だけを受信済みにする"""
+    if session.status != "uploading":
+        raise UploadError(409, "Upload already completed")
+    if offset < 0 or offset >= session.size:
+        raise UploadError(400, "Upload-Offset out of range")
+
+    # チェックサム付きのチャンクは検証してから書き込む（受信済みの範囲を壊さないため）
+    # 書き込みはイベントループを止めないようスレッドで行う（チェックサムなしはWRITE_BLOCKずつ）
+    hasher = hashlib.new(checksum[0]) if checksum else None
+    pending = bytearray()
+    written = 0
+    fd = os.open(session.temp_path, os.O_WRONLY)
+    try:
+        async for data in body:
+            if not data:
+                continue
+            received = written + len(pending) + len(data)
+            if offset + received > session.size or received > MAX_CHUNK_SIZE:
+                raise UploadError(413, "Chunk exceeds upload length or chunk size limit")
+            if hasher:
+                hasher.update(data)
+            pending += data
+            if not hasher and len(pending) >= WRITE_BLOCK:
+                written += await profiling.to_thread(_pwrite_all, fd, bytes(pending), offset + written)
+                pending.clear()
+        if hasher and hasher.digest() != checksum[1]:
+            raise UploadError(460, "Checksum mismatch")
+        if pending:
+            written += await profiling.to_thread(_pwrite_all, fd, bytes(pending), offset + written)
+    finally:
+        os.close(fd)
+
+    if written:
+        record_range(db, session, offset, offset + written)
+    return written
+
+
+def record_range(db: Session, session: UploadSession, start: int, end: int):
+    """受信範囲に [start, end) を加える
+    別プロセスで並列に受けたチャンクの範囲を上書きしないよう、読み込みからコミットまで行をロックする"""
+    refresh_for_update(db, session)
+    session.received = json.dumps(merge_range(get_ranges(session), start, end))
+    session.expires_at = datetime.utcnow() + timedelta(seconds=UPLOAD_SESSION_TTL)
+    db.commit()
+
+
+def check_complete(session: UploadSession):
+    """全バイト受信済みであることを確認"""
+    ranges = get_ranges(session)
+    if contiguous_offset(ranges) != session.size:
+        raise UploadError(409, f"Upload incomplete: {received_bytes(ranges)}/{session.size} bytes received")
+
+
+def finalize_session(db: Session, session: UploadSession, video: Video) -> str:
+    """受信したファイルを動画の保存先へ移動し、セッションを完了にする"""
+    check_complete(session)
+    os.replace(session.temp_path, video.original_path)
+    session.status = "completed"
+    session.temp_path = video.original_path
+    session.video_id = video.id
+    db.commit()
+    return video.original_path
+
+
+def delete_session(db: Session, session: UploadSession):
+    if session.status == "uploading" and os.path.exists(session.temp_path):
+        os.remove(session.temp_path)
+    db.delete(session)
+    db.commit()
+
+
+def expire_sessions(db: Session) -> int:
+    """期限切れのセッションと一時ファイルを削除"""
+    expired = db.query(UploadSession).filter(UploadSession.expires_at < datetime.utcnow()).all()
+    for session in expired:
+        try:
+            delete_session(db, session)
+        except OSError as e:
+            logger.warning("⚠️ Failed to remove expired upload %s: %s", session.id, e)
+    return len(expired)
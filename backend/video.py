@@ -1,11 +1,38 @@
 import subprocess
 import os
 import json
+import logging
+import zlib
 from pathlib import Path
-from typing import List, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
+import logs
+import scheduler
 from models import Video, Segment
+from mp4index import Mp4ParseError, is_mp4_container, read_index
+
+# 再エンコード時に使うエンコーダ（コンテナのコーデック名 → ffmpegの引数）
+ENCODERS = {
+    "avc1": ["-c:v", "libx264"],
+    "avc3": ["-c:v", "libx264"],
+    "hvc1": ["-c:v", "libx265", "-tag:v", "hvc1"],
+    "hev1": ["-c:v", "libx265", "-tag:v", "hvc1"],
+}
+DEFAULT_CODEC = "avc1"
+
+logger = logging.getLogger(__name__)
 
 def get_video_duration(video_path: str) -> float:
+    """動画の長さを取得（MP4/MOVはコンテナを直接読み、それ以外はffprobe）"""
+    if is_mp4_container(video_path):
+        try:
+            duration = read_index(video_path).duration_sec
+            if duration > 0:
+                return duration
+        except (Mp4ParseError, OSError) as e:
+            logger.warning("⚠️ MP4 index parse failed, falling back to ffprobe: %s", e)
+    return probe_duration(video_path)
+
+def probe_duration(video_path: str) -> float:
     """ffprobeで動画の長さを取得"""
     cmd = [
         "ffprobe",
@@ -16,29 +43,116 @@ def get_video_duration(video_path: str) -> float:
     ]
     
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        result = scheduler.run(cmd, capture_output=True, text=True, check=True)
         data = json.loads(result.stdout)
         return float(data["format"]["duration"])
     except Exception as e:
         raise Exception(f"Failed to get video duration: {e}")
 
-def split_video(video_path: str, output_dir: str, chunk_sec: int = 60) -> List[Tuple[float, float, str]]:
-    """動画を指定秒数で分割"""
-    duration = get_video_duration(video_path)
+def read_segment_info(segment_path: str) -> Dict:
+    """書き出したセグメントのメタデータを取得（ffprobeは使わず、コンテナを直接読む）"""
+    # サイズとCRC32（ZIPのヘッダを事前に組み立てるため）。書き出した直後なのでページキャッシュから読める
+    crc = 0
+    size = 0
+    with open(segment_path, "rb") as f:
+        while True:
+            block = f.read(1024 * 1024)
+            if not block:
+                break
+            crc = zlib.crc32(block, crc)
+            size += len(block)
+    
+    info = {"size_bytes": size, "crc32": crc}
+    try:
+        index = read_index(segment_path, cache=False)
+    except (Mp4ParseError, OSError) as e:
+        logger.warning("⚠️ Failed to read segment index %s: %s", segment_path, e)
+        return info
+    
+    track = index.video_track
+    duration = index.duration_sec
+    info.update({
+        "duration_sec": duration,
+        "bitrate": int(size * 8 / duration) if duration else None,
+        "codec": track.codec if track else None,
+        "width": track.width if track else None,
+        "height": track.height if track else None,
+        "keyframe_count": len(track.sync_samples) if track else 0
+    })
+    return info
+
+def has_audio_stream(video_path: str) -> bool:
+    """音声トラックの有無（MP4/MOVはコンテナを直接読み、それ以外はffprobe）"""
+    if is_mp4_container(video_path):
+        try:
+            return read_index(video_path).audio_track is not None
+        except (Mp4ParseError, OSError):
+            pass
+    cmd = ["ffprobe", "-v", "quiet", "-select_streams", "a", "-show_entries", "stream=index", "-of", "csv=p=0", video_path]
+    result = scheduler.run(cmd, capture_output=True, text=True)
+    return bool(result.stdout.strip())
+
+def segment_boundaries(duration: float, chunk_sec: int) -> List[Tuple[float, float]]:
+    """分割境界 [(開始秒, 終了秒), ...]（再開時も同じ境界になるよう長さとchunk_secだけで決める）"""
+    return [(start_sec, min(start_sec + chunk_sec, duration)) for start_sec in range(0, int(duration), chunk_sec)]
+
+def segment_output_path(video_path: str, output_dir: str, index: int, tag: str = "") -> str:
+    """セグメントの出力先（tagを付けると既存のセグメントと別名で書き出せる）"""
+    return os.path.join(output_dir, f"{Path(video_path).stem}{tag}_segment_{index:03d}.mp4")
+
+def parse_cut_points(cuts: str) -> List[float]:
+    """カンマ区切りの分割位置（秒）をパース（昇順・正の値でなければValueError）"""
+    points = [float(value) for value in cuts.split(",") if value.strip()]
+    if not points or any(point <= 0 for point in points) or points != sorted(set(points)):
+        raise ValueError("cuts must be increasing positive seconds")
+    return points
+
+def boundaries_from_cuts(duration: float, points: List[float]) -> List[Tuple[float, float]]:
+    """分割位置から境界を作る（動画の長さを超える位置は無視）"""
+    edges = [0.0] + [point for point in points if point < duration] + [duration]
+    return list(zip(edges[:-1], edges[1:]))
+
+def is_valid_segment(segment_path: str, size_bytes: Optional[int] = None) -> bool:
+    """セグメントファイルが最後まで書き出されているか（サイズとMP4のインデックスで確認）"""
+    try:
+        if size_bytes is not None and os.path.getsize(segment_path) != size_bytes:
+            return False
+        return read_index(segment_path, cache=False).duration_sec > 0
+    except (Mp4ParseError, OSError):
+        return False
+
+def split_video(
+    video_path: str,
+    output_dir: str,
+    chunk_sec: int = 60,
+    on_segment: Optional[Callable[[int, int, Tuple[float, float, str, Dict]], None]] = None,
+    start_index: int = 0
+) -> List[Tuple[float, float, str, Dict]]:
+    """動画を指定秒数で分割（on_segmentはセグメント完成ごとに (index, 総数, セグメント) で呼ばれる）
+    各セグメントは (開始秒, 終了秒, パス, メタデータ) のタプル。start_indexより前のセグメントは作成済みとして飛ばす"""
+    boundaries = segment_boundaries(get_video_duration(video_path), chunk_sec)
+    return cut_segments(video_path, output_dir, boundaries, on_segment, start_index)
+
+def cut_segments(
+    video_path: str,
+    output_dir: str,
+    boundaries: List[Tuple[float, float]],
+    on_segment: Optional[Callable[[int, int, Tuple[float, float, str, Dict]], None]] = None,
+    start_index: int = 0,
+    tag: str = ""
+) -> List[Tuple[float, float, str, Dict]]:
+    """指定した境界 [(開始秒, 終了秒), ...] で動画を切り出す"""
+    total = len(boundaries)
     segments = []
     
     # 出力ディレクトリを作成
     Path(output_dir).mkdir(parents=True, exist_ok=True)
     
-    video_name = Path(video_path).stem
-    segment_index = 0
-    
-    for start_sec in range(0, int(duration), chunk_sec):
-        end_sec = min(start_sec + chunk_sec, duration)
-        
-        # セグメントファイル名
-        segment_filename = f"{video_name}_segment_{segment_index:03d}.mp4"
-        segment_path = os.path.join(output_dir, segment_filename)
+    for segment_index in range(start_index, total):
+        start_sec, end_sec = boundaries[segment_index]
+        segment_path = segment_output_path(video_path, output_dir, segment_index, tag)
+        # 一時ファイルに書いてからリネーム（途中で落ちても書きかけのファイルが残らない）
+        temp_path = f"{segment_path}.tmp"
         
         # ffmpegで分割（-c copyを優先、失敗時はTODOコメント）
         cmd = [
@@ -48,32 +162,43 @@ def split_video(video_path: str, output_dir: str, chunk_sec: int = 60) -> List[T
             "-to", str(end_sec),
             "-c", "copy",  # コピーコーデック（高速）
             "-avoid_negative_ts", "make_zero",
-            segment_path,
+            "-f", "mp4",
+            temp_path,
             "-y"  # 上書き許可
         ]
         
         try:
-            subprocess.run(cmd, check=True, capture_output=True)
-            segments.append((start_sec, end_sec, segment_path))
-            segment_index += 1
+            # セグメントごとの所要時間（DEBUGのときだけ計測）
+            with logs.stage(logger, "cut_segment", segment=segment_index, total=total):
+                scheduler.run(cmd, check=True, capture_output=True)
+            os.replace(temp_path, segment_path)
+            segments.append((start_sec, end_sec, segment_path, read_segment_info(segment_path)))
+            if on_segment:
+                on_segment(segment_index, total, segments[-1])
         except subprocess.CalledProcessError:
             # TODO: -c copyで失敗した場合のフォールバック処理
             # エンコードが必要な場合の処理をここに実装
-            print(f"Warning: Failed to create segment {segment_index} with -c copy")
+            logger.warning("Failed to create segment %d with -c copy", segment_index)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
             # フォールバック処理（エンコード版）は必要に応じて実装
             raise Exception(f"Failed to create segment {segment_index}")
     
     return segments
 
 def create_zip_archive(video_id: int, segments: List[Segment], output_path: str) -> str:
-    """KeepされたセグメントをZIPで圧縮（ZIP_STORED）"""
+    """KeepされたセグメントをZIPで圧縮（ZIP_STORED）。トリムされたセグメントはトリム結果を入れる"""
     import zipfile
+    import trim
     
     with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_STORED) as zipf:
         for segment in segments:
-            if segment.decision == "keep" and os.path.exists(segment.path):
+            if segment.decision != "keep":
+                continue
+            source = trim.render_trim(segment) if trim.is_trimmed(segment) else segment.path
+            if os.path.exists(source):
                 # ZIP内のファイル名
                 arcname = f"{segment.name or f'segment_{segment.index:03d}'}.mp4"
-                zipf.write(segment.path, arcname)
+                zipf.write(source, arcname)
     
     return output_path
@@ -0,0 +1,122 @@
+"""
+無圧縮（STORED）ZIPのストリーミング出力
+セグメントのサイズとCRC32はDBに保存済みなので、ヘッダを先に組み立てられ、
+出力サイズもファイルを読まずに正確に計算できる（Content-Length用）
+"""
+import struct
+from datetime import datetime
+from typing import Iterator, List, Tuple
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+READ_BLOCK = 1024 * 1024
+
+_FLAG_UTF8 = 0x800
+_VERSION_ZIP64 = 45
+_VERSION_DEFAULT = 20
+
+
+class ZipEntry:
+    def __init__(self, path: str, arcname: str, size: int, crc32: int, modified: datetime = None):
+        self.path = path
+        self.arcname = arcname.encode("utf-8")
+        self.size = size
+        self.crc32 = crc32 & 0xFFFFFFFF
+        self.modified = modified or datetime(1980, 1, 1)
+        self.offset = 0
+
+    @property
+    def zip64(self) -> bool:
+        return self.size >= ZIP64_LIMIT
+
+    @property
+    def flags(self) -> int:
+        try:
+            self.arcname.decode("ascii")
+            return 0
+        except UnicodeDecodeError:
+            return _FLAG_UTF8
+
+    def _dos_datetime(self) -> Tuple[int, int]:
+        dt = max(self.modified, datetime(1980, 1, 1))
+        dos_date = (dt.year - 1980) << 9 | dt.month << 5 | dt.day
+        dos_time = dt.hour << 11 | dt.minute << 5 | dt.second // 2
+        return dos_time, dos_date
+
+    def local_header(self) -> bytes:
+        version = _VERSION_ZIP64 if self.zip64 else _VERSION_DEFAULT
+        extra = struct.pack("<HHQQ", 1, 16, self.size, self.size) if self.zip64 else b""
+        size = ZIP64_LIMIT if self.zip64 else self.size
+        dos_time, dos_date = self._dos_datetime()
+        return struct.pack(
+            "<4sHHHHHIIIHH", b"PK\x03\x04", version, self.flags, 0, dos_time, dos_date,
+            self.crc32, size, size, len(self.arcname), len(extra)
+        ) + self.arcname + extra
+
+    def central_header(self) -> bytes:
+        large_offset = self.offset >= ZIP64_LIMIT
+        fields = []
+        if self.zip64:
+            fields += [self.size, self.size]
+        if large_offset:
+            fields.append(self.offset)
+        extra = struct.pack(f"<HH{len(fields)}Q", 1, 8 * len(fields), *fields) if fields else b""
+        version = _VERSION_ZIP64 if fields else _VERSION_DEFAULT
+        size = ZIP64_LIMIT if self.zip64 else self.size
+        dos_time, dos_date = self._dos_datetime()
+        return struct.pack(
+            "<4sHHHHHHIIIHHHHHII", b"PK\x01\x02", version, version, self.flags, 0, dos_time, dos_date,
+            self.crc32, size, size, len(self.arcname), len(extra), 0, 0, 0, 0,
+            min(self.offset, ZIP64_LIMIT)
+        ) + self.arcname + extra
+
+
+def _layout(entries: List[ZipEntry]) -> Tuple[int, int]:
+    """各エントリのオフセットを確定し、(セントラルディレクトリ開始位置, サイズ) を返す"""
+    offset = 0
+    for entry in entries:
+        entry.offset = offset
+        offset += len(entry.local_header()) + entry.size
+    central_size = sum(len(entry.central_header()) for entry in entries)
+    return offset, central_size
+
+
+def _end_records(entries: List[ZipEntry], central_offset: int, central_size: int) -> bytes:
+    count = len(entries)
+    records = b""
+    if count >= ZIP_FILECOUNT_LIMIT or central_offset >= ZIP64_LIMIT or central_size >= ZIP64_LIMIT:
+        zip64_end_offset = central_offset + central_size
+        records += struct.pack(
+            "<4sQHHIIQQQQ", b"PK\x06\x06", 44, _VERSION_ZIP64, _VERSION_ZIP64, 0, 0,
+            count, count, central_size, central_offset
+        )
+        records += struct.pack("<4sIQI", b"PK\x06\x07", 0, zip64_end_offset, 1)
+    records += struct.pack(
+        "<4sHHHHIIH", b"PK\x05\x06", 0, 0,
+        min(count, ZIP_FILECOUNT_LIMIT), min(count, ZIP_FILECOUNT_LIMIT),
+        min(central_size, ZIP64_LIMIT), min(central_offset, ZIP64_LIMIT), 0
+    )
+    return records
+
+
+def archive_size(entries: List[ZipEntry]) -> int:
+    """出力されるZIPの正確なバイト数"""
+    central_offset, central_size = _layout(entries)
+    return central_offset + central_size + len(_end_records(entries, central_offset, central_size))
+
+
+def iter_archive(entries: List[ZipEntry]) -> Iterator[bytes]:
+    """ZIPをチャンク単位で生成（一時ファイルを作らない）"""
+    central_offset, central_size = _layout(entries)
+    for entry in entries:
+        yield entry.local_header()
+        remaining = entry.size
+        with open(entry.path, "rb") as f:
+            while remaining > 0:
+                block = f.read(min(READ_BLOCK, remaining))
+                if not block:
+                    raise IOError(f"File shrank while streaming: {entry.path}")
+                remaining -= len(block)
+                yield block
+    yield b"".join(entry.central_header() for entry in entries)
+    yield _end_records(entries, central_offset, central_size)
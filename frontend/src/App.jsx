@@ -1,12 +1,16 @@
 import React, { useState, useEffect, useCallback } from 'react';
 import {
-  uploadVideo,
+  uploadVideoResumable,
   nextSegment,
   decide,
+  dropFlagged,
   setName,
+  trimSegment,
   progress,
+  subscribeEvents,
   exportKept,
   downloadZip,
+  downloadConcatenated,
   getGooglePhotosAuthUrl,
   getGooglePhotosVideos,
   downloadGooglePhotosVideo
@@ -17,6 +21,12 @@ function App() {
   const [currentSegment, setCurrentSegment] = useState(null);
   const [progressData, setProgressData] = useState(null);
   const [segmentName, setSegmentName] = useState('');
+  const [trimIn, setTrimIn] = useState('');
+  const [trimOut, setTrimOut] = useState('');
+  const [applyToCluster, setApplyToCluster] = useState(true);
+  // 早見モード（早回しのプレビューで確認し、タップしたときだけ元のセグメントを読み込む）
+  const [fastScan, setFastScan] = useState(false);
+  const [showFull, setShowFull] = useState(false);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
   const [success, setSuccess] = useState(null);
@@ -37,6 +47,25 @@ function App() {
     }
   }, [currentSegment]);
 
+  // 進捗はポーリングせずサーバーからのプッシュで更新
+  useEffect(() => {
+    if (!currentVideo) return;
+    return subscribeEvents(currentVideo.id, {
+      progress: setProgressData,
+      resync: () => loadProgress(currentVideo.id),
+      job: (job) => {
+        if (job.kind !== 'segment') return;
+        if (job.stage === 'ready' && currentVideo.processing) {
+          setCurrentVideo({ ...currentVideo, processing: false });
+          setSuccess(`動画の分割が完了しました。${job.done}個のセグメントに分割されました。`);
+          loadNextSegment(currentVideo.id);
+        } else if (job.stage === 'failed') {
+          setError('動画の分割に失敗しました: ' + (job.error || ''));
+        }
+      },
+    });
+  }, [currentVideo]);
+
   useEffect(() => {
     document.addEventListener('keydown', handleKeyPress);
     return () => {
@@ -68,24 +97,13 @@ function App() {
     window.addEventListener('beforeunload', beforeUnloadHandler);
 
     try {
-      // 進捗シミュレーション
-      const progressInterval = setInterval(() => {
-        setUploadProgress(prev => {
-          if (prev >= 90) return prev;
-          return prev + Math.random() * 10;
-        });
-      }, 1000);
-      
-      const result = await uploadVideo(file, 60);
+      const result = await uploadVideoResumable(file, 60, setUploadProgress);
       
-      clearInterval(progressInterval);
       setUploadProgress(100);
       
-      setCurrentVideo({ id: result.video_id, filename: file.name });
-      setSuccess(`動画をアップロードしました。${result.segments_count}個のセグメントに分割されました。`);
-      
-      // 最初のセグメントを取得
-      await loadNextSegment(result.video_id);
+      // 分割はワーカーで行われ、完了はjobイベントで通知される
+      setCurrentVideo({ id: result.video_id, filename: file.name, processing: true });
+      setSuccess('動画をアップロードしました。分割しています...');
     } catch (err) {
       setError('アップロードに失敗しました: ' + err.message);
     } finally {
@@ -98,15 +116,17 @@ function App() {
 
   const loadNextSegment = async (videoId) => {
     try {
-      const segment = await nextSegment(videoId);
+      const segment = await nextSegment(videoId, fastScan ? 'preview' : 'full');
+      setShowFull(false);
       if (segment.done) {
         setCurrentSegment(null);
         setSuccess('すべてのセグメントの判定が完了しました！');
       } else {
         setCurrentSegment(segment);
         setSegmentName(segment.name || '');
+        setTrimIn(segment.trim_in ?? '');
+        setTrimOut(segment.trim_out ?? '');
       }
-      await loadProgress(videoId);
     } catch (err) {
       setError('セグメントの読み込みに失敗しました: ' + err.message);
     }
@@ -129,12 +149,20 @@ function App() {
 
     try {
       // 判定を保存
-      await decide(currentSegment.segment_id, decision);
+      const cluster = applyToCluster && currentSegment.cluster_pending > 1;
+      await decide(currentSegment.segment_id, decision, cluster);
       
-      // Keepの場合は名前も保存
+      // Keepの場合は名前とトリムも保存
       if (decision === 'keep' && segmentName.trim()) {
         await setName(currentSegment.segment_id, segmentName.trim());
       }
+      if (decision === 'keep' && (trimIn !== '' || trimOut !== '')) {
+        await trimSegment(
+          currentSegment.segment_id,
+          trimIn === '' ? null : Number(trimIn),
+          trimOut === '' ? null : Number(trimOut)
+        );
+      }
       
       setSuccess(`セグメントを${decision === 'keep' ? '残す' : '捨てる'}に設定しました。`);
       
@@ -147,6 +175,23 @@ function App() {
     }
   };
 
+  const handleDropFlagged = async () => {
+    if (!currentVideo) return;
+
+    setLoading(true);
+    setError(null);
+
+    try {
+      const { dropped } = await dropFlagged(currentVideo.id);
+      setSuccess(`無音・黒画面のセグメントを${dropped}個まとめて捨てました。`);
+      await loadNextSegment(currentVideo.id);
+    } catch (err) {
+      setError('一括判定に失敗しました: ' + err.message);
+    } finally {
+      setLoading(false);
+    }
+  };
+
   const handleExport = async () => {
     if (!currentVideo) return;
 
@@ -191,6 +236,22 @@ function App() {
     }
   };
 
+  const handleDownloadConcatenated = async () => {
+    if (!currentVideo) return;
+
+    setLoading(true);
+    setError(null);
+
+    try {
+      await downloadConcatenated(currentVideo.id);
+      setSuccess('連結動画のダウンロードを開始しました。');
+    } catch (err) {
+      setError('連結動画のダウンロードに失敗しました: ' + err.message);
+    } finally {
+      setLoading(false);
+    }
+  };
+
   // Google Photos関連の関数
   const handleGooglePhotosAuth = async () => {
     try {
@@ -222,11 +283,8 @@ function App() {
     try {
       const result = await downloadGooglePhotosVideo(mediaItemId, 60);
       
-      setCurrentVideo({ id: result.video_id, filename: result.filename });
-      setSuccess(`Google Photosから動画をダウンロードしました。${result.segments_count}個のセグメントに分割されました。`);
-      
-      // 最初のセグメントを取得
-      await loadNextSegment(result.video_id);
+      setCurrentVideo({ id: result.video_id, filename: result.filename, processing: true });
+      setSuccess('Google Photosから動画をダウンロードしました。分割しています...');
       setShowGooglePhotos(false);
     } catch (err) {
       setError('Google Photos動画のダウンロードに失敗しました: ' + err.message);
@@ -237,7 +295,7 @@ function App() {
     }
   };
 
-  const isAllDone = progressData && progressData.pending === 0;
+  const isAllDone = currentVideo && !currentVideo.processing && progressData && progressData.total > 0 && progressData.pending === 0;
 
   return (
     <div className="container">
@@ -347,12 +405,45 @@ function App() {
           {currentSegment && !isAllDone ? (
             <div className="card">
               <h2>セグメント {currentSegment.index + 1}</h2>
-              <video
-                className="video-player"
-                controls
-                src={`/api/file?path=${encodeURIComponent(currentSegment.path)}`}
-                key={currentSegment.segment_id}
-              />
+              <label className="keyboard-hint">
+                <input
+                  type="checkbox"
+                  checked={fastScan}
+                  onChange={(e) => setFastScan(e.target.checked)}
+                />
+                早見モード（早回し・音声なしのプレビュー）
+              </label>
+              {currentSegment.rendition === 'preview' && !showFull ? (
+                <video
+                  className="video-player"
+                  autoPlay
+                  muted
+                  loop
+                  playsInline
+                  src={currentSegment.media_url || `/api/file?path=${encodeURIComponent(currentSegment.media_path)}`}
+                  key={`preview-${currentSegment.segment_id}`}
+                  onClick={() => setShowFull(true)}
+                  title="タップで元の動画を再生"
+                />
+              ) : (
+                <video
+                  className="video-player"
+                  controls
+                  src={currentSegment.url || `/api/file?path=${encodeURIComponent(currentSegment.path)}`}
+                  key={currentSegment.segment_id}
+                />
+              )}
+              
+              {currentSegment.cluster_pending > 1 && (
+                <label className="keyboard-hint">
+                  <input
+                    type="checkbox"
+                    checked={applyToCluster}
+                    onChange={(e) => setApplyToCluster(e.target.checked)}
+                  />
+                  類似セグメント{currentSegment.cluster_pending - 1}個にも同じ判定を適用
+                </label>
+              )}
               
               <input
                 type="text"
@@ -362,6 +453,27 @@ function App() {
                 onChange={(e) => setSegmentName(e.target.value)}
               />
               
+              <div className="trim-inputs">
+                <input
+                  type="number"
+                  className="name-input"
+                  min="0"
+                  step="0.1"
+                  placeholder="開始（秒）"
+                  value={trimIn}
+                  onChange={(e) => setTrimIn(e.target.value)}
+                />
+                <input
+                  type="number"
+                  className="name-input"
+                  min="0"
+                  step="0.1"
+                  placeholder="終了（秒）"
+                  value={trimOut}
+                  onChange={(e) => setTrimOut(e.target.value)}
+                />
+              </div>
+              
               <div className="controls">
                 <button
                   className="control-button drop-button"
@@ -382,6 +494,14 @@ function App() {
               <div className="keyboard-hint">
                 キーボード: ← 捨てる / → 残す
               </div>
+              
+              <button
+                className="back-button"
+                onClick={handleDropFlagged}
+                disabled={loading}
+              >
+                無音・黒画面をまとめて捨てる
+              </button>
             </div>
           ) : isAllDone ? (
             <div className="card">
@@ -402,10 +522,17 @@ function App() {
                 >
                   ZIPダウンロード
                 </button>
+                <button
+                  className="export-button"
+                  onClick={handleDownloadConcatenated}
+                  disabled={loading}
+                >
+                  1本の動画でダウンロード
+                </button>
               </div>
             </div>
           ) : (
-            <div className="loading">セグメントを読み込み中...</div>
+            <div className="loading">{currentVideo.processing ? '動画を分割中...' : 'セグメントを読み込み中...'}</div>
           )}
 
           {progressData && (
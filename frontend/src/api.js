@@ -16,8 +16,94 @@ export const uploadVideo = async (file, chunkSec = 60) => {
   return response.json();
 };
 
-export const nextSegment = async (videoId) => {
-  const response = await fetch(`${API_BASE}/next_segment?video_id=${videoId}`);
+// 再開可能なチャンクアップロード（並列送信・チェックサム付き）
+const UPLOAD_CONCURRENCY = 3;
+
+const sha256Base64 = async (buffer) => {
+  const digest = await crypto.subtle.digest('SHA-256', buffer);
+  return btoa(String.fromCharCode(...new Uint8Array(digest)));
+};
+
+const isReceived = (ranges, start, end) =>
+  ranges.some(([rangeStart, rangeEnd]) => rangeStart <= start && end <= rangeEnd);
+
+export const uploadVideoResumable = async (file, chunkSec = 60, onProgress = () => {}) => {
+  const storageKey = `swipecut-upload:${file.name}:${file.size}:${file.lastModified}`;
+  let uploadId = localStorage.getItem(storageKey);
+  let ranges = [];
+  let chunkSize = 8 * 1024 * 1024;
+
+  // 途中まで送信済みのセッションがあれば再開
+  if (uploadId) {
+    const response = await fetch(`${API_BASE}/uploads/${uploadId}`);
+    if (response.ok) {
+      ranges = (await response.json()).ranges;
+    } else {
+      uploadId = null;
+    }
+  }
+
+  if (!uploadId) {
+    const response = await fetch(
+      `${API_BASE}/uploads?filename=${encodeURIComponent(file.name)}&size=${file.size}&chunk_sec=${chunkSec}`,
+      { method: 'POST' }
+    );
+    if (!response.ok) {
+      throw new Error('Upload failed');
+    }
+    const session = await response.json();
+    uploadId = session.upload_id;
+    chunkSize = session.chunk_size;
+    localStorage.setItem(storageKey, uploadId);
+  }
+
+  const offsets = [];
+  for (let offset = 0; offset < file.size; offset += chunkSize) {
+    if (!isReceived(ranges, offset, Math.min(offset + chunkSize, file.size))) {
+      offsets.push(offset);
+    }
+  }
+
+  let uploaded = Math.max(0, file.size - offsets.length * chunkSize);
+  const sendChunk = async (offset) => {
+    const buffer = await file.slice(offset, offset + chunkSize).arrayBuffer();
+    const checksum = await sha256Base64(buffer);
+    for (let attempt = 0; attempt < 3; attempt++) {
+      const response = await fetch(`${API_BASE}/uploads/${uploadId}`, {
+        method: 'PATCH',
+        headers: {
+          'Upload-Offset': String(offset),
+          'Upload-Checksum': `sha256 ${checksum}`,
+          'Content-Type': 'application/offset+octet-stream',
+        },
+        body: buffer,
+      });
+      if (response.ok) {
+        uploaded += buffer.byteLength;
+        onProgress(Math.min(100, (uploaded / file.size) * 100));
+        return;
+      }
+    }
+    throw new Error('Upload failed');
+  };
+
+  const workers = Array.from({ length: UPLOAD_CONCURRENCY }, async () => {
+    while (offsets.length) {
+      await sendChunk(offsets.shift());
+    }
+  });
+  await Promise.all(workers);
+
+  const response = await fetch(`${API_BASE}/uploads/${uploadId}/complete`, { method: 'POST' });
+  if (!response.ok) {
+    throw new Error('Upload failed');
+  }
+  localStorage.removeItem(storageKey);
+  return response.json();
+};
+
+export const nextSegment = async (videoId, rendition = 'full') => {
+  const response = await fetch(`${API_BASE}/next_segment?video_id=${videoId}&rendition=${rendition}`);
   
   if (!response.ok) {
     throw new Error('Failed to get next segment');
@@ -26,8 +112,8 @@ export const nextSegment = async (videoId) => {
   return response.json();
 };
 
-export const decide = async (segmentId, decision) => {
-  const response = await fetch(`${API_BASE}/decide?segment_id=${segmentId}&decision=${decision}`, {
+export const decide = async (segmentId, decision, cluster = false) => {
+  const response = await fetch(`${API_BASE}/decide?segment_id=${segmentId}&decision=${decision}&cluster=${cluster}`, {
     method: 'POST',
   });
   
@@ -38,6 +124,18 @@ export const decide = async (segmentId, decision) => {
   return response.json();
 };
 
+export const dropFlagged = async (videoId) => {
+  const response = await fetch(`${API_BASE}/drop_flagged?video_id=${videoId}`, {
+    method: 'POST',
+  });
+  
+  if (!response.ok) {
+    throw new Error('Failed to drop flagged segments');
+  }
+  
+  return response.json();
+};
+
 export const setName = async (segmentId, name) => {
   const response = await fetch(`${API_BASE}/name?segment_id=${segmentId}&name=${encodeURIComponent(name)}`, {
     method: 'POST',
@@ -50,6 +148,22 @@ export const setName = async (segmentId, name) => {
   return response.json();
 };
 
+export const trimSegment = async (segmentId, trimIn, trimOut) => {
+  const params = new URLSearchParams({ segment_id: segmentId });
+  if (trimIn !== null) params.set('trim_in', trimIn);
+  if (trimOut !== null) params.set('trim_out', trimOut);
+  const response = await fetch(`${API_BASE}/trim?${params}`, {
+    method: 'POST',
+  });
+  
+  if (!response.ok) {
+    const error = await response.json().catch(() => ({}));
+    throw new Error(error.detail || 'Failed to trim segment');
+  }
+  
+  return response.json();
+};
+
 export const progress = async (videoId) => {
   const response = await fetch(`${API_BASE}/progress?video_id=${videoId}`);
   
@@ -60,6 +174,35 @@ export const progress = async (videoId) => {
   return response.json();
 };
 
+// 動画ライブラリ（次のページはnext_cursorを渡して取得）
+export const listVideos = async ({ cursor = null, limit = 20, source = null, status = null } = {}) => {
+  const params = new URLSearchParams({ limit });
+  if (cursor) params.set('cursor', cursor);
+  if (source) params.set('source', source);
+  if (status) params.set('status', status);
+  const response = await fetch(`${API_BASE}/videos?${params}`);
+
+  if (!response.ok) {
+    throw new Error('Failed to list videos');
+  }
+
+  return response.json();
+};
+
+// 進捗・セグメント準備完了・ジョブ状況をServer-Sent Eventsで購読
+export const subscribeEvents = (videoId, handlers, jobId = null) => {
+  const query = jobId === null ? '' : `&job_id=${jobId}`;
+  const source = new EventSource(`${API_BASE}/events?video_id=${videoId}${query}`);
+  
+  ['progress', 'segment_ready', 'job', 'resync'].forEach((eventName) => {
+    if (handlers[eventName]) {
+      source.addEventListener(eventName, (e) => handlers[eventName](JSON.parse(e.data)));
+    }
+  });
+  
+  return () => source.close();
+};
+
 export const exportKept = async (videoId) => {
   const response = await fetch(`${API_BASE}/export?video_id=${videoId}`);
   
@@ -70,8 +213,64 @@ export const exportKept = async (videoId) => {
   return response.json();
 };
 
+// ワーカーのジョブ完了をServer-Sent Eventsで待つ
+// 購読の開始前に終わったジョブは配信されないので、初期状態にジョブを含めてもらい、
+// 購読開始後（最初のprogressイベント）にもジョブの状態を1回確認する
+export const waitForJob = (videoId, jobId) => new Promise((resolve, reject) => {
+  let settled = false;
+  let checked = false;
+  const settle = (job) => {
+    if (settled) return;
+    if (job.status === 'done') {
+      settled = true;
+      unsubscribe();
+      resolve(job);
+    } else if (job.status === 'failed') {
+      settled = true;
+      unsubscribe();
+      reject(new Error(job.error || 'Job failed'));
+    }
+  };
+  const unsubscribe = subscribeEvents(videoId, {
+    job: (job) => {
+      if (job.job_id === jobId) settle(job);
+    },
+    progress: async () => {
+      if (checked) return;
+      checked = true;
+      const response = await fetch(`${API_BASE}/jobs/${jobId}`);
+      if (response.ok) settle(await response.json());
+    },
+  }, jobId);
+});
+
+// ブラウザに直接ダウンロードさせる（S3の署名付きURLへのリダイレクトもそのまま辿れる）
+const navigateDownload = (href, filename) => {
+  const a = document.createElement('a');
+  a.href = href;
+  a.download = filename;
+  document.body.appendChild(a);
+  a.click();
+  document.body.removeChild(a);
+};
+
 export const downloadZip = async (videoId) => {
-  const response = await fetch(`${API_BASE}/export_zip?video_id=${videoId}`);
+  const zipUrl = `${API_BASE}/export_zip?video_id=${videoId}`;
+  const filename = `video_${videoId}_kept_segments.zip`;
+  let response = await fetch(zipUrl, { redirect: 'manual' });
+  
+  // ZIPが未作成の場合はワーカーの処理完了を待って再取得
+  if (response.status === 202) {
+    const { job_id } = await response.json();
+    await waitForJob(videoId, job_id);
+    response = await fetch(zipUrl, { redirect: 'manual' });
+  }
+  
+  // 保存先（S3）へのリダイレクトはfetchで読まず（CORS不要）、ブラウザのダウンロードに任せる
+  if (response.type === 'opaqueredirect') {
+    navigateDownload(zipUrl, filename);
+    return;
+  }
   
   if (!response.ok) {
     throw new Error('Failed to download zip');
@@ -81,16 +280,46 @@ export const downloadZip = async (videoId) => {
   const url = window.URL.createObjectURL(blob);
   const a = document.createElement('a');
   a.href = url;
-  a.download = `video_${videoId}_kept_segments.zip`;
+  a.download = filename;
   document.body.appendChild(a);
   a.click();
   window.URL.revokeObjectURL(url);
   document.body.removeChild(a);
 };
 
+// 連結動画はストリーミングで返るので、ブラウザに直接ダウンロードさせる
+export const downloadConcatenated = async (videoId) => {
+  const videoUrl = `${API_BASE}/export_video?video_id=${videoId}`;
+  const filename = `video_${videoId}_kept.mp4`;
+  const response = await fetch(videoUrl, { redirect: 'manual' });
+  
+  // トリム・再エンコードが済んでいない場合はワーカーの準備完了を待つ
+  if (response.status === 202) {
+    const { job_id } = await response.json();
+    await waitForJob(videoId, job_id);
+  } else if (response.type !== 'opaqueredirect' && !response.ok) {
+    throw new Error('Failed to download video');
+  } else if (response.body) {
+    // 連結動画は大きいのでfetchでは読まず、ブラウザのダウンロードに任せる
+    await response.body.cancel();
+  }
+  
+  navigateDownload(videoUrl, filename);
+};
+
 // Google Photos API functions
+// 認証情報はブラウザごとに保存される（localStorageに保存したIDをX-Client-Idで送る）
+const clientHeaders = () => {
+  let clientId = localStorage.getItem('swipecut-client-id');
+  if (!clientId) {
+    clientId = crypto.randomUUID();
+    localStorage.setItem('swipecut-client-id', clientId);
+  }
+  return { 'X-Client-Id': clientId };
+};
+
 export const getGooglePhotosAuthUrl = async () => {
-  const response = await fetch(`${API_BASE}/google-photos/auth-url`);
+  const response = await fetch(`${API_BASE}/google-photos/auth-url`, { headers: clientHeaders() });
   
   if (!response.ok) {
     throw new Error('Failed to get auth URL');
@@ -100,7 +329,7 @@ export const getGooglePhotosAuthUrl = async () => {
 };
 
 export const getGooglePhotosVideos = async (pageSize = 25) => {
-  const response = await fetch(`${API_BASE}/google-photos/videos?page_size=${pageSize}`);
+  const response = await fetch(`${API_BASE}/google-photos/videos?page_size=${pageSize}`, { headers: clientHeaders() });
   
   if (!response.ok) {
     throw new Error('Failed to get videos');
@@ -112,6 +341,7 @@ export const getGooglePhotosVideos = async (pageSize = 25) => {
 export const downloadGooglePhotosVideo = async (mediaItemId, chunkSec = 60) => {
   const response = await fetch(`${API_BASE}/google-photos/download?media_item_id=${mediaItemId}&chunk_sec=${chunkSec}`, {
     method: 'POST',
+    headers: clientHeaders(),
   });
   
   if (!response.ok) {
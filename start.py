@@ -2,6 +2,8 @@
 """
 SwipeCut API 起動スクリプト
 環境変数からポートを取得してuvicornを起動
+WORKER_COUNT（デフォルト: 1）の数だけ分割・エクスポート用ワーカーも起動する
+（別マシンでワーカーを動かす場合は WORKER_COUNT=0）
 """
 import os
 import subprocess
@@ -26,6 +28,17 @@ def main():
     
     print(f"🔧 Command: {' '.join(cmd)}")
     
+    # 既存DBのスキーマを変換してから起動（変換済みなら何もしない）
+    subprocess.run(['python3', 'migrate_schema.py'], check=True)
+    
+    # ワーカーを起動
+    worker = None
+    worker_count = int(os.getenv('WORKER_COUNT', '1'))
+    if worker_count > 0:
+        worker_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'worker.py')
+        print(f"👷 Starting {worker_count} worker(s)")
+        worker = subprocess.Popen(['python3', worker_script, '--concurrency', str(worker_count)])
+    
     try:
         subprocess.run(cmd, check=True)
     except subprocess.CalledProcessError as e:
@@ -34,6 +47,10 @@ def main():
     except KeyboardInterrupt:
         print("🛑 Shutting down...")
         sys.exit(0)
+    finally:
+        if worker:
+            worker.terminate()
+            worker.wait()
 
 if __name__ == "__main__":
     main()
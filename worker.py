@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+SwipeCut ワーカー起動スクリプト
+jobsテーブルから分割・エクスポートのジョブをリース付きで取得して実行する
+同じDB・ストレージを共有していれば、複数プロセス・複数マシンで並列に動かせる
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+
+# リポジトリ直下から起動した場合は backend/ をインポートパスに追加
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+if os.path.isdir(BACKEND_DIR):
+    sys.path.insert(0, BACKEND_DIR)
+
+_stopping = threading.Event()
+logger = logging.getLogger("worker")
+
+
+def _handle_signal(signum, frame):
+    logger.info("🛑 Worker %d stopping after current job...", os.getpid())
+    _stopping.set()
+
+
+def run_job(db, job, owner):
+    import logs
+
+    # ジョブ中のログ（tasks・video など）に job_id・video_id を付ける
+    with logs.bind(job_id=job.id, kind=job.kind, video_id=job.video_id):
+        _run_job(db, job, owner)
+
+
+def _run_job(db, job, owner):
+    import jobs
+    import scheduler
+    from db import SessionLocal
+    from tasks import HANDLERS
+
+    logger.info("🔧 Job claimed, attempt %d", job.attempts)
+    lease_lost = threading.Event()
+    finished = threading.Event()
+
+    # 長時間の処理中もリースを延長し続ける
+    def keep_alive():
+        hb_db = SessionLocal()
+        try:
+            while not finished.wait(jobs.LEASE_SEC / 3):
+                if not jobs.heartbeat(hb_db, job.id, owner):
+                    lease_lost.set()
+                    return
+        finally:
+            hb_db.close()
+
+    heartbeat_thread = threading.Thread(target=keep_alive, daemon=True)
+    heartbeat_thread.start()
+
+    def report(done, total):
+        if not jobs.heartbeat(db, job.id, owner, done, total):
+            lease_lost.set()
+
+    try:
+        handler = HANDLERS[job.kind]
+        # ジョブ種別の優先度でffmpegの実行枠とnice値が決まる
+        with scheduler.priority(scheduler.KIND_PRIORITY.get(job.kind, scheduler.INGEST)):
+            started = time.perf_counter()
+            result = handler(db, job, report)
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+        finished.set()
+        if jobs.complete(db, job.id, owner, result):
+            logger.info("✅ Job done", extra={"stage": job.kind, "elapsed_ms": elapsed_ms})
+        else:
+            logger.warning("⚠️ Job finished after its lease was lost; result discarded")
+    except Exception as e:
+        finished.set()
+        db.rollback()
+        jobs.fail(db, job.id, owner, str(e))
+        logger.exception("❌ Job failed: %s", e)
+    finally:
+        finished.set()
+        heartbeat_thread.join()
+
+
+def worker_loop(poll_interval: float, kinds):
+    import jobs
+    import logs
+    from db import SessionLocal, create_tables
+    from library import backfill_stats
+    from tasks import resume_interrupted_segmentation
+
+    # --concurrency ではforkした子プロセスごとにログの書き出しスレッドを起動する
+    logs.setup()
+    signal.signal(signal.SIGTERM, _handle_signal)
+    signal.signal(signal.SIGINT, _handle_signal)
+
+    create_tables()
+    owner = jobs.worker_id()
+    logger.info("🚀 Worker %s started (kinds: %s)", owner, ", ".join(kinds) if kinds else "all")
+
+    db = SessionLocal()
+    try:
+        # 前回のプロセスが分割の途中で落ちた動画を拾い直す
+        resume_interrupted_segmentation(db)
+        # 集計列の追加前に作られた動画のライブラリ用集計値を計算
+        backfill_stats(db)
+        while not _stopping.is_set():
+            job = jobs.claim(db, owner, kinds)
+            if job is None:
+                _stopping.wait(poll_interval)
+                continue
+            run_job(db, job, owner)
+    finally:
+        db.close()
+        logs.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SwipeCut segmentation/export worker")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("WORKER_CONCURRENCY", "1")),
+                        help="起動するワーカープロセス数")
+    parser.add_argument("--kinds", default=os.getenv("WORKER_KINDS", ""),
+                        help="処理するジョブ種別（カンマ区切り、例: segment,export）")
+    parser.add_argument("--poll-interval", type=float, default=float(os.getenv("WORKER_POLL_INTERVAL", "1.0")),
+                        help="ジョブがないときの待機秒数")
+    args = parser.parse_args()
+    kinds = [k for k in args.kinds.split(",") if k]
+
+    if args.concurrency <= 1:
+        worker_loop(args.poll_interval, kinds)
+        return
+
+    processes = [
+        multiprocessing.Process(target=worker_loop, args=(args.poll_interval, kinds))
+        for _ in range(args.concurrency)
+    ]
+    for process in processes:
+        process.start()
+
+    def stop_all(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop_all)
+    signal.signal(signal.SIGINT, stop_all)
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()